@@ -0,0 +1,199 @@
+"""
+Content-addressed on-disk cache of parsed Brewin programs.
+
+    cache = AstCache("/tmp/brewin-asts")
+    ast = cache.parse(source)        # parses with brewparse only on a miss
+
+An entry is keyed by a hash of the source text, of the grammar (brewlex.py,
+brewparse.py and the parse tables in parsetab.py) and of the node classes it is
+decoded into (element.py), so editing any of them never serves a stale tree.
+An entry holds the AST as nested dicts and lists in marshal format: loading one
+is a few times faster than parsing, and on a hit neither ply nor the parse
+tables are ever imported. Only programs that parse without a syntax error are
+stored: ply recovers from some errors by parsing on past them, and a hit on
+such a tree would skip the error report.
+
+Entries are written to a temporary file and renamed into place, so processes
+sharing a directory only ever see complete entries; when two of them write the
+same entry, both write the same bytes. Hits refresh an entry's modification
+time, and once the directory grows past max_bytes the least recently used
+entries are removed. An entry that is missing or unreadable is just a miss.
+
+Setting BREWIN_AST_CACHE to a directory puts a cache in front of every
+Interpreter.compile (see parse_program), e.g. for harness reruns.
+"""
+
+import hashlib
+import marshal
+import os
+import tempfile
+
+import brewparse
+from element import Element
+
+FORMAT_VERSION = 1  # bump when the encoding below changes
+ENTRY_SUFFIX = ".ast"
+GRAMMAR_FILES = ("brewlex.py", "brewparse.py", "parsetab.py", "element.py")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+EVICT_TO = 0.8  # eviction leaves the directory at this fraction of max_bytes
+
+_grammar_hash = None
+
+
+def grammar_hash(): # return hex digest of everything that decides what a source parses to
+    global _grammar_hash
+    if _grammar_hash is None:
+        digest = hashlib.sha256(f"{FORMAT_VERSION}:{marshal.version}".encode())
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in GRAMMAR_FILES:
+            with open(os.path.join(here, name), "rb") as handle:
+                digest.update(handle.read())
+        _grammar_hash = digest.hexdigest()
+    return _grammar_hash
+
+
+# an Element is a dict of its fields with its elem_type under None; lists and tuples stay as they are
+def encode(node):
+    if isinstance(node, Element):
+        data = {None: node.elem_type}
+        for key in node.FIELDS:
+            data[key] = encode(getattr(node, key))
+        return data
+    if isinstance(node, (list, tuple)):
+        return type(node)(encode(v) for v in node)
+    return node
+
+
+def decode(data):
+    if isinstance(data, dict):
+        fields = {key: decode(value) for key, value in data.items() if key is not None}
+        return Element(data[None], **fields)
+    if isinstance(data, (list, tuple)):
+        return type(data)(decode(v) for v in data)
+    return data
+
+
+class AstCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self.__bytes = None  # estimated size of the directory; None until first scanned
+        os.makedirs(directory, exist_ok=True)
+
+    def hit_rate(self): # return fraction of lookups that were hits, or None before any lookup
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else None
+
+    def key(self, program): # return hex digest naming program's entry
+        return hashlib.sha256(grammar_hash().encode() + program.encode("utf-8")).hexdigest()
+
+    def parse(self, program): # return program Element
+        path = os.path.join(self.directory, self.key(program) + ENTRY_SUFFIX)
+        ast = self.__load(path)
+        if ast is not None:
+            self.stats["hits"] += 1
+            return ast
+        self.stats["misses"] += 1
+        try:
+            ast = brewparse.parse_program(program, strict=True, quiet=True)
+        except SyntaxError: # parsed again to report it, or to recover as ply does, and never stored
+            return brewparse.parse_program(program)
+        self.__store(path, ast)
+        return ast
+
+    def clear(self): # no return
+        for entry in self.__entries():
+            self.__remove(entry[2])
+        self.__bytes = 0
+
+    def __load(self, path): # return program Element, or None on a miss
+        try:
+            with open(path, "rb") as handle:
+                data = marshal.load(handle)
+            ast = decode(data)
+        except (OSError, EOFError, ValueError, TypeError): # missing, evicted, or not an entry
+            return None
+        try:
+            os.utime(path) # marks the entry as recently used
+        except OSError:
+            pass
+        return ast
+
+    def __store(self, path, ast): # no return; a cache that can't be written to is only slower
+        data = marshal.dumps(encode(ast))
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as handle:
+                    handle.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                self.__remove(temp_path)
+                raise
+        except OSError:
+            return
+        self.stats["writes"] += 1
+        if self.__bytes is None:
+            self.__bytes = sum(entry[1] for entry in self.__entries())
+        else:
+            self.__bytes += len(data)
+        if self.__bytes > self.max_bytes:
+            self.__evict()
+
+    # removes the least recently used entries; other processes may be removing them too
+    def __evict(self): # no return
+        entries = sorted(self.__entries())
+        total = sum(entry[1] for entry in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            if self.__remove(path):
+                self.stats["evictions"] += 1
+            total -= size
+        self.__bytes = total
+
+    def __entries(self): # return list of (mtime, size, path)
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+        return entries
+
+    def __remove(self, path): # return True if this call removed path
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+_default = None
+
+
+def default_cache(): # return the AstCache in BREWIN_AST_CACHE, or None if it isn't set
+    global _default
+    directory = os.environ.get("BREWIN_AST_CACHE")
+    if not directory:
+        return None
+    if _default is None or _default.directory != directory:
+        _default = AstCache(directory)
+    return _default
+
+
+# brewparse.parse_program, behind the default cache if there is one
+def parse_program(program): # return program Element
+    cache = default_cache()
+    if cache is None:
+        return brewparse.parse_program(program)
+    return cache.parse(program)
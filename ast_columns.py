@@ -0,0 +1,183 @@
+"""
+Struct-of-arrays storage for large Brewin ASTs.
+
+    tree = ColumnTree.from_ast(parse_program(source))
+    calls = tree.nodes_of_kind(InterpreterBase.FCALL_NODE)   # indexes, from one scan
+    interpreter.run_program(interpreter.compile_ast(tree.root()))
+
+Every node is a row, in preorder, of parallel array columns:
+
+    kind          code of its elem_type in kinds
+    first_child   row of its first child, or -1
+    next_sibling  row of the next child of its parent, or -1
+    slot          which field of its parent it is (an index into the parent's FIELDS)
+    payload       index in payloads of its FIELDS and the values of its fields that aren't nodes
+    end           the row after its subtree, so a pass can skip a subtree at once
+
+A field holding a list of nodes (statements, args, ...) is a row of kind LIST
+whose children are the items. A node field that is None has no row. Payloads are
+shared by every node with the same FIELDS and non-node fields, so all the reads
+of a variable (say) share one.
+
+Passes that only need kinds or payloads scan the columns without building any
+node. root() builds ColumnNodes: Elements that read their fields from the columns
+the first time one is touched, so the interpreter and every existing pass run on
+them unchanged; nodes shared in the parsed tree (see brewparse.shared) come back
+as one node per occurrence.
+"""
+
+from array import array
+
+from element import Element, LazyNode
+
+LIST = "list"  # kind of the row holding a list of nodes
+
+
+class ColumnTree:
+    def __init__(self):
+        self.kinds = [LIST]  # code -> elem_type
+        self.kind_codes = {LIST: 0}
+        self.payloads = []  # (FIELDS, value of each field or None where it's a node)
+        self.payload_codes = {}  # only while the tree is being built
+        self.kind = array("H")
+        self.first_child = array("i")
+        self.next_sibling = array("i")
+        self.slot = array("B")
+        self.payload = array("i")
+        self.end = array("i")
+        self.views = {}  # row -> ColumnNode, so every row is one node
+
+    @classmethod
+    def from_ast(cls, ast): # return ColumnTree
+        tree = cls()
+        tree.__add(ast, 0)
+        tree.payload_codes = None
+        return tree
+
+    def __len__(self):
+        return len(self.kind)
+
+    # appends the subtree of value as rows; iterative, since generated programs nest deeply
+    def __add(self, value, slot): # no return
+        stack = [(value, slot, -1, False)]  # (node or list, slot, parent row, done)
+        last_child = {}  # parent row -> row of its latest child
+        while stack:
+            value, slot, parent, done = stack.pop()
+            if done:
+                self.end[value] = len(self.kind)
+                continue
+            row = self.__row(value, slot)
+            if parent >= 0:
+                previous = last_child.get(parent)
+                if previous is None:
+                    self.first_child[parent] = row
+                else:
+                    self.next_sibling[previous] = row
+                last_child[parent] = row
+            stack.append((row, None, None, True))
+            children = []
+            if isinstance(value, list):
+                children = [(item, 0) for item in value]
+            else:
+                for i, key in enumerate(value.FIELDS):
+                    field = getattr(value, key)
+                    if isinstance(field, (Element, list)):
+                        children.append((field, i))
+            for child, child_slot in reversed(children):
+                stack.append((child, child_slot, row, False))
+
+    def __row(self, value, slot): # return index of a new row for value, whose children come later
+        if isinstance(value, list):
+            kind = 0
+            payload = -1
+        else:
+            kind = self.kind_codes.get(value.elem_type)
+            if kind is None:
+                kind = self.kind_codes[value.elem_type] = len(self.kinds)
+                self.kinds.append(value.elem_type)
+            payload = self.__payload(value)
+        self.kind.append(kind)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        self.slot.append(slot)
+        self.payload.append(payload)
+        self.end.append(-1)
+        return len(self.kind) - 1
+
+    def __payload(self, node): # return index in payloads
+        payload = [node.FIELDS]
+        for key in node.FIELDS:
+            value = getattr(node, key)
+            payload.append(None if isinstance(value, (Element, list)) else value)
+        payload = tuple(payload)
+        key = payload + tuple(type(value) for value in payload)  # True == 1, so types are part of the key
+        code = self.payload_codes.get(key)
+        if code is None:
+            code = self.payload_codes[key] = len(self.payloads)
+            self.payloads.append(payload)
+        return code
+
+    # analysis helpers that only read the columns
+
+    def elem_type(self, row): # return str
+        return self.kinds[self.kind[row]]
+
+    def children(self, row): # yield the rows of row's children
+        child = self.first_child[row]
+        while child >= 0:
+            yield child
+            child = self.next_sibling[child]
+
+    def nodes_of_kind(self, elem_type, start=0, stop=None): # return list of rows, within [start, stop)
+        code = self.kind_codes.get(elem_type)
+        if code is None:
+            return []
+        kind = self.kind
+        stop = len(kind) if stop is None else stop
+        rows = []
+        row = start
+        while True:
+            try:
+                row = kind.index(code, row, stop)
+            except ValueError:
+                return rows
+            rows.append(row)
+            row += 1
+
+    def field(self, row, key): # return the non-node field key of row, or None
+        payload = self.payloads[self.payload[row]]
+        if key not in payload[0]:
+            return None
+        return payload[1 + payload[0].index(key)]
+
+    # Element views
+
+    def root(self): # return the ColumnNode of the first row
+        return self.node(0)
+
+    def node(self, row): # return ColumnNode, or list of them for a LIST row
+        if self.kind[row] == 0:
+            return [self.node(child) for child in self.children(row)]
+        view = self.views.get(row)
+        if view is None:
+            view = self.views[row] = ColumnNode(self, row)
+        return view
+
+    def fields(self, row): # return dict of the fields of row, in FIELDS order
+        payload = self.payloads[self.payload[row]]
+        names = payload[0]
+        values = dict(zip(names, payload[1:]))
+        for child in self.children(row):
+            values[names[self.slot[child]]] = self.node(child)
+        return values
+
+
+# An Element that reads its fields from its row of a ColumnTree
+class ColumnNode(LazyNode):
+    def __init__(self, tree, row):
+        self.elem_type = tree.elem_type(row)
+        self.__tree = tree
+        self.__row = row
+
+    def _read_fields(self): # return dict of the node's fields
+        return self.__tree.fields(self.__row)
@@ -0,0 +1,59 @@
+"""
+Runs Brewin programs as asyncio coroutines.
+
+    async def read():            # returns the next input line, or None at end of input
+        ...
+    async def write(text):
+        ...
+    result = await AsyncInterpreter(read, write).run(program)
+
+inputi()/inputs() await the input source, print() awaits the output sink, and
+the run yields to the event loop every yield_every statements, so one event loop
+can host many interactive sessions side by side. Cancelling the coroutine (e.g.
+with asyncio.timeout) abandons the run.
+
+Runs are scheduler.ResumableRuns, so the evaluator itself suspends (see
+interpreterv4.Interpreter.run_steps): run() steps the run's generator on the
+event loop's thread, and awaits whatever it paused for. A session waiting for input is a suspended
+coroutine over a suspended generator, with no thread of its own.
+"""
+
+import asyncio
+
+import scheduler
+
+
+class AsyncInterpreter:
+    def __init__(self, input_source, output_sink, yield_every=1000, **options):
+        self.input_source = input_source  # async () -> str, or None at end of input
+        self.output_sink = output_sink  # async (str) -> None
+        self.yield_every = yield_every
+        self.options = options  # passed on to interpreterv4.Interpreter
+        self.stats = None  # of the last run; see scheduler.ResumableRun
+
+    async def run(self, program): # return interpreterv4.RunResult
+        run = scheduler.ResumableRun(
+            program,
+            slice_steps=self.yield_every,
+            wait_for_input=True,
+            pause_on_output=True,
+            **self.options,
+        )
+        self.stats = run.stats
+        try:
+            request = run.resume()
+            while request[0] != scheduler.DONE:
+                if request[0] == scheduler.SLICE:
+                    await asyncio.sleep(0)
+                elif request[0] == scheduler.INPUT:
+                    value = await self.input_source()
+                    if value is None:
+                        run.close_input()
+                    else:
+                        run.feed(value)
+                else:
+                    await self.output_sink(request[1])
+                request = run.resume()
+            return request[1]
+        finally:
+            run.close()
@@ -0,0 +1,926 @@
+"""
+Benchmarks for the Brewin interpreter.
+
+Usage: python3.11 bench.py [benchmark ...]   (runs every benchmark if none are named)
+
+Each benchmark prints the best wall-clock time over a few repeats.
+"""
+
+import asyncio
+import gc
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import ast_cache
+import binast
+import brewparse
+import brewscan
+import lanes
+import loop_vectorizer
+import partial_eval
+import scheduler
+from ast_columns import ColumnTree
+from async_interpreter import AsyncInterpreter
+from brewparse import BrewinParser
+from element import iter_elements
+from incremental_parse import IncrementalParser
+from intbase import ErrorType, InterpreterBase
+from interpreterv4 import Interpreter
+from parallel_parse import ParallelParser
+
+
+def best_time(func, repeat=3):
+    """Best wall-clock time of func() over repeat calls, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run_program(program, inp=None):
+    """Run a Brewin program without console output and return its output log."""
+    interpreter = Interpreter(False, inp)
+    interpreter.run(program)
+    return interpreter.get_output()
+
+
+class InputClock(list):
+    """Input list that timestamps every read, so a program can mark its phases with inputi()."""
+
+    def __init__(self, reads):
+        super().__init__(["0"] * reads)
+        self.times = []
+
+    def __getitem__(self, index):
+        self.times.append(time.perf_counter())
+        return super().__getitem__(index)
+
+
+def report(name, seconds, detail=""):
+    print(f"{name:<40} {seconds * 1000:10.2f} ms {detail}")
+
+
+LINKED_LIST_PROGRAM = """
+struct node {
+  val: int;
+  next: node;
+}
+
+func main() {
+  var head;
+  var n;
+  var i;
+  for (i = 0; i < N_NODES; i = i + 1) {
+    n = new node;
+    n.val = i;
+    n.next = head;
+    head = n;
+  }
+  var total;
+  var p;
+  total = 0;
+  for (p = head; p != nil; p = p.next) {
+    total = total + p.val;
+    if (total < 0) {
+      print("overflow");
+    }
+  }
+  print(total);
+}
+"""
+
+TREE_PROGRAM = """
+struct tree {
+  val: int;
+  left: tree;
+  right: tree;
+}
+
+func build(d) {
+  var t;
+  t = new tree;
+  t.val = d;
+  if (d > 0) {
+    t.left = build(d - 1);
+    t.right = build(d - 1);
+  }
+  return t;
+}
+
+func count(t) {
+  if (t == nil) {
+    return 0;
+  }
+  return 1 + count(t.left) + count(t.right);
+}
+
+func main() {
+  var root;
+  root = build(DEPTH);
+  print(count(root));
+}
+"""
+
+ARRAY_PROGRAM = """
+func main() {
+  var a;
+  var i;
+  a = array(N_ELEMS);
+  for (i = 0; i < N_ELEMS; i = i + 1) {
+    array_set(a, i, i);
+  }
+  array_map(a, "*", 2);
+  array_map(a, "+", 1);
+  print(array_sum(a));
+}
+"""
+
+MAP_PROGRAM = """
+func main() {
+  var m;
+  var i;
+  var r;
+  var hits;
+  m = map();
+  for (i = 0; i < N_KEYS; i = i + 1) {
+    map_put(m, i, i);
+  }
+  hits = 0;
+  inputi();
+  for (r = 0; r < N_ROUNDS; r = r + 1) {
+    for (i = 0; i < N_LOOKUPS; i = i + 1) {
+      if (map_has(m, i * STRIDE)) {
+        hits = hits + 1;
+        if (hits < 0) {
+          print("overflow");
+        }
+      }
+    }
+  }
+  inputi();
+  print(hits);
+}
+"""
+
+# the first three inputs configure the run and are the same for every student
+GRADING_PROGRAM = """
+func weight(mode, round) {
+  var w;
+  w = 1;
+  if (mode == "squares") {
+    w = round * round;
+  } else {
+    if (mode == "linear") {
+      w = round + 1;
+    }
+  }
+  return w;
+}
+
+func main() {
+  var mode;
+  var rounds;
+  var scale;
+  var key;
+  var i;
+  var answer;
+  mode = inputs();
+  rounds = inputi();
+  scale = inputi();
+  print("mode ", mode, ", ", rounds, " rounds, scale ", scale);
+  key = 0;
+  for (i = 0; i < rounds; i = i + 1) {
+    key = key + weight(mode, i) * scale;
+  }
+  answer = inputi();
+  if (answer == key) {
+    print("correct");
+  } else {
+    print("expected ", key, ", got ", answer);
+  }
+}
+"""
+
+# every lane takes its own path: a different branch, loop count, early return or raise per input
+BRANCHING_PROGRAM = """
+func classify(n) {
+  if (n < 0) {
+    raise "negative";
+  }
+  if (n == 0) {
+    return "zero";
+  }
+  var i;
+  var steps;
+  steps = 0;
+  for (i = n; i != 1; i = i + 0) {
+    if (i - i / 2 * 2 == 0) {
+      i = i / 2;
+    } else {
+      i = 3 * i + 1;
+    }
+    steps = steps + 1;
+    if (steps > 50) {
+      return "long";
+    }
+  }
+  return steps;
+}
+
+func main() {
+  var n;
+  var d;
+  n = inputi();
+  try {
+    print(n, " ", classify(n));
+  }
+  catch "negative" {
+    print(n, " is negative");
+  }
+  d = inputi();
+  print(100 / d);
+  print("done");
+}
+"""
+
+FIB_PROGRAM = """
+func fib(n) {
+  if (n < 2) {
+    return n;
+  }
+  return fib(n - 1) + fib(n - 2);
+}
+
+func main() {
+  print(fib(N));
+}
+"""
+
+# the right operands are speculated, and some of them divide by zero in the worker
+SPECULATED_DIV0_PROGRAM = """
+func ratio(n, d) {
+  var i;
+  var t;
+  t = 0;
+  for (i = 0; i < n; i = i + 1) {
+    t = t + i / d;
+  }
+  return t;
+}
+
+func main() {
+  try {
+    print(ratio(50, 2) + ratio(50, 0));
+    print("not reached");
+  } catch "div0" {
+    print("caught");
+  }
+  print(ratio(40, 3) + ratio(40, 1));
+  print(ratio(10, 1) + ratio(10, 0));
+}
+"""
+
+SHORT_PROGRAM = """
+func main() {
+  var i;
+  var t;
+  t = 0;
+  for (i = 0; i < 100; i = i + 1) {
+    t = t + i;
+  }
+  print(t);
+}
+"""
+
+RUNAWAY_PROGRAM = """
+func main() {
+  var i;
+  var t;
+  for (i = 0; true; i = i + 1) {
+    t = i;
+  }
+}
+"""
+
+VECTOR_PROGRAM = """
+func main() {
+  var i;
+  var squares;
+  var poly;
+  var last;
+  var halves;
+  var n;
+  n = N;
+  squares = 0;
+  poly = 1;
+  halves = 0;
+  for (i = 0; i < n; i = i + 1) {
+    squares = squares + i * i;
+    poly = poly + 3 * i * i * i - 2 * i + 7;
+    last = i * 2 - n;
+  }
+  for (i = n; i > 0; i = i - 3) {
+    halves = halves + i / 2 - (i - 50) / 7;
+  }
+  print(squares, " ", poly, " ", last, " ", halves, " ", i);
+}
+"""
+
+SESSION_PROGRAM = """
+func main() {
+  var n;
+  var i;
+  var t;
+  n = inputi("n? ");
+  t = 0;
+  for (i = 0; i < n; i = i + 1) {
+    t = t + i;
+    if (t < 0) {
+      print("overflow");
+    }
+  }
+  print(t);
+}
+"""
+
+
+def bench_linked_list():
+    """Build a linked list of structs, then walk it summing a field."""
+    for size in (1000, 4000):
+        program = LINKED_LIST_PROGRAM.replace("N_NODES", str(size))
+        assert run_program(program) == [str(size * (size - 1) // 2)]
+        report(f"linked_list n={size}", best_time(lambda: run_program(program)))
+
+
+def bench_tree():
+    """Recursively build a complete binary tree of structs, then count its nodes."""
+    for depth in (8, 10, 12):
+        program = TREE_PROGRAM.replace("DEPTH", str(depth))
+        assert run_program(program) == [str(2 ** (depth + 1) - 1)]
+        report(f"tree depth={depth}", best_time(lambda: run_program(program)))
+
+
+def bench_array():
+    """Fill an array element by element, then transform and sum it with bulk builtins."""
+    for size in (1000, 10000, 100000):
+        program = ARRAY_PROGRAM.replace("N_ELEMS", str(size))
+        assert run_program(program) == [str(size * size)]
+        report(f"array n={size}", best_time(lambda: run_program(program)))
+
+
+def bench_map(lookups=10000, rounds=10):
+    """Per-lookup cost of map_has as the map grows; it should stay flat."""
+    for size in (10**3, 10**4, 10**5, 10**6):
+        lookups_here = min(lookups, size)
+        program = (
+            MAP_PROGRAM.replace("N_KEYS", str(size))
+            .replace("N_ROUNDS", str(rounds))
+            .replace("N_LOOKUPS", str(lookups_here))
+            .replace("STRIDE", str(size // lookups_here))
+        )
+        # the program reads an input right before and right after its lookups
+        clock = InputClock(2)
+        assert run_program(program, clock) == [str(lookups_here * rounds)]
+        elapsed = clock.times[1] - clock.times[0]
+        per_lookup = elapsed / (lookups_here * rounds)
+        report(f"map n={size}", elapsed, f"({per_lookup * 1e6:.2f} us per lookup)")
+
+
+def bench_specialize(students=200):
+    """Grade many inputs sharing a setup prefix, as written and specialized for that prefix."""
+    setup = ["squares", "12", "3"]
+    inputs = [setup + [str(n)] for n in range(students)]
+    interpreter = Interpreter(False)
+    program = interpreter.compile(GRADING_PROGRAM)
+    spec = partial_eval.specialize(interpreter, GRADING_PROGRAM, setup)
+    residual_inputs = [spec.remaining_inputs(inp) for inp in inputs]
+    expected = [r.output for r in interpreter.run_many(program, inputs)]
+    assert [r.output for r in interpreter.run_many(spec.program, residual_inputs)] == expected
+    report(
+        f"grading students={students}",
+        best_time(lambda: list(interpreter.run_many(program, inputs))),
+    )
+    report(
+        f"grading students={students} specialized",
+        best_time(lambda: list(interpreter.run_many(spec.program, residual_inputs))),
+        f"({spec.stats})",
+    )
+
+
+def bench_run_many(runs=200):
+    """Every test program run several times in one run_many, and the grading program over interleaved inputs."""
+    for source, inp in read_test_cases():
+        fresh = results_of(Interpreter(False), source, [inp])
+        interpreter = Interpreter(False)
+        program = interpreter.compile(source)
+        assert results_of(interpreter, program, [inp] * 3) == fresh * 3, "a run saw state left by the previous one"
+    # a wrong answer, a right one, then one that runs out of input
+    inputs = [["squares", "12", "3", "0"], ["squares", "12", "3", "1518"], ["squares", "12"]]
+    interpreter = Interpreter(False)
+    program = interpreter.compile(GRADING_PROGRAM)
+    expected = [results_of(Interpreter(False), GRADING_PROGRAM, [inp])[0] for inp in inputs]
+    assert results_of(interpreter, program, inputs * 2) == expected * 2, "a run saw state left by the previous one"
+
+    inputs = [["linear", str(n), "2", str(n * (n + 1))] for n in range(runs)]
+    report(f"run() runs={runs}", best_time(lambda: [run_program(GRADING_PROGRAM, inp) for inp in inputs]))
+    report(f"run_many runs={runs}", best_time(lambda: list(interpreter.run_many(program, inputs))))
+
+
+# an empty input vector would read the keyboard, so there is none
+def lane_variants(inp): # return input vectors near inp: itself, one short, and each int shifted
+    if not inp:
+        return [["1"], ["x"]]
+    shifted = [[str(int(x) + delta) if x.lstrip("-").isdigit() else x + "x" for x in inp] for delta in (-1, 1)]
+    return [inp] + ([inp[:-1]] if len(inp) > 1 else []) + shifted
+
+
+def bench_lanes(students=(10, 100, 1000)):
+    """Grade many students in one lane-parallel pass and one run each; every lane must match its own run."""
+    for source, inp in read_test_cases():
+        lane_inputs = lane_variants(inp)
+        expected = results_of(Interpreter(False), source, lane_inputs)
+        results = Interpreter(False).run_lanes(source, lane_inputs)
+        assert [(r.output, r.error_type) for r in results] == expected, "a lane differs from its own run"
+    # one short of input, some dividing by zero
+    inputs = [[str(n), str(n % 4)] for n in range(-3, 30)] + [["7"]]
+    interpreter = Interpreter(False)
+    program = interpreter.compile(BRANCHING_PROGRAM)
+    expected = results_of(Interpreter(False), BRANCHING_PROGRAM, inputs)
+    results = interpreter.run_lanes(program, inputs)
+    assert [(r.output, r.error_type) for r in results] == expected, "a lane differs from its own run"
+    stats = interpreter.get_stats()["lanes"]
+    if lanes.np is None:
+        report("lanes", 0, "(skipped: numpy is not installed, so every lane ran alone)")
+    else:
+        assert stats["together"] > 0, f"no lane ran in the lane-parallel pass: {stats}"
+
+    interpreter = Interpreter(False)
+    program = interpreter.compile(GRADING_PROGRAM)
+    for count in students:
+        inputs = [["squares" if n % 3 else "linear", str(5 + n % 7), "3", str(n)] for n in range(count)]
+        expected = results_of(interpreter, program, inputs)
+        results = interpreter.run_lanes(program, inputs)
+        assert [(r.output, r.error_type) for r in results] == expected, "a lane differs from its own run"
+        stats = interpreter.get_stats()["lanes"]
+        assert lanes.np is None or stats["together"] > 0, f"no student ran in the lane-parallel pass: {stats}"
+        report(f"grading students={count} one run each", best_time(lambda: list(interpreter.run_many(program, inputs))))
+        report(f"grading students={count} lanes", best_time(lambda: interpreter.run_lanes(program, inputs)), f"({stats})")
+
+
+def bench_parallel(n=22):
+    """Naive recursive fib, sequentially and with its pure calls speculated across processes; both must agree."""
+    program = FIB_PROGRAM.replace("N", str(n))
+    workers = os.cpu_count() or 1
+    interpreter = Interpreter(False, parallel_workers=workers)
+    try:
+        for source, inp in read_test_cases():
+            expected = results_of(Interpreter(False), source, [inp])
+            assert results_of(interpreter, source, [inp]) == expected, "speculating changed a test"
+        # a worker fails, so the call runs again locally and raises there
+        expected = results_of(Interpreter(False), SPECULATED_DIV0_PROGRAM, [[]])
+        assert results_of(interpreter, SPECULATED_DIV0_PROGRAM, [[]]) == expected, "speculating changed an error"
+        stats = interpreter.get_stats()["speculation"]
+        assert stats["fallbacks"] > 0, f"no speculated call fell back: {stats}"
+    finally:
+        interpreter.close()
+    results = []
+    for parallel_workers in (None, workers):
+        interpreter = Interpreter(False, parallel_workers=parallel_workers)
+        compiled = interpreter.compile(program)
+        results.append(results_of(interpreter, compiled, [[]]))  # also starts the workers
+        assert results[-1] == results[0], f"speculating changed fib({n})"
+        elapsed = best_time(lambda: list(interpreter.run_many(compiled, [[]])))
+        stats = interpreter.get_stats().get("speculation")
+        report(f"fib({n}) workers={parallel_workers}", elapsed, f"({stats})")
+        interpreter.close()
+
+
+# run in a fresh interpreter, where nothing has been imported or built yet
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import brewparse
+imported = time.perf_counter()
+brewparse.parse_program("func main() { print(1); }")
+parsed = time.perf_counter()
+print(imported - start, parsed - imported)
+"""
+
+
+def bench_startup(repeat=5):
+    """Time to import the parser, then to parse a first program, in a new process."""
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        samples.append([float(seconds) for seconds in out.split()])
+    report("startup import", min(s[0] for s in samples))
+    report("startup first parse", min(s[1] for s in samples))
+
+
+def bench_parse_threads(threads=16, rounds=4):
+    """Parse the whole test corpus from many threads at once; every AST must match a lone parse."""
+    sources = read_corpus()
+    local = threading.local()
+
+    def parse(source): # return what a parse must reproduce: the tree and the final line number
+        parser = getattr(local, "parser", None)
+        if parser is None:
+            parser = local.parser = BrewinParser()
+        return (str(parser.parse(source)), parser.lexer.lineno)
+
+    expected = [parse(source) for source in sources]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6) # switch threads as often as possible, mid-parse
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(parse, sources * rounds))
+        elapsed = time.perf_counter() - start
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert results == expected * rounds, "a concurrent parse differs from a lone one"
+    report(f"parse threads={threads}", elapsed, f"({len(results)} programs)")
+
+
+def read_corpus(versions="v*"): # return list of the sources of the test programs of versions
+    here = os.path.dirname(os.path.abspath(__file__))
+    sources = []
+    for path in sorted(glob.glob(os.path.join(here, versions, "*", "*.br"))):
+        with open(path, encoding="utf-8") as handle:
+            sources.append(handle.read())
+    return sources
+
+
+def bench_ast_cache(directory="/tmp/brewin-bench-asts"):
+    """Parse the test corpus through an empty AST cache, then again through the filled one."""
+    sources = read_corpus()
+    shutil.rmtree(directory, ignore_errors=True)
+    cache = ast_cache.AstCache(directory)
+    for label in ("cold", "warm"):
+        start = time.perf_counter()
+        for source in sources:
+            cache.parse(source)
+        report(f"ast cache {label}", time.perf_counter() - start, f"({len(sources)} programs)")
+    report("ast cache overall", 0, f"(hit rate {cache.hit_rate():.2f}, {cache.stats})")
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def read_test_cases(version="v4"): # return list of (source, input lines) of the test programs of version
+    cases = []
+    for source in read_corpus(version):
+        lines = source.splitlines()
+        marks = [i for i, line in enumerate(lines) if line.strip() == "*IN*"]
+        cases.append((source, lines[marks[0] + 1 : marks[1]] if len(marks) == 2 else []))
+    return cases
+
+
+def results_of(interpreter, program, inputs): # return (output, error type) of each run
+    return [(result.output, result.error_type) for result in interpreter.run_many(program, inputs)]
+
+
+def bench_vectorize(sizes=(-5, 0, 1, 2, 7, 60, 100), size=10**6):
+    """Arithmetic loops run as written and vectorized; both must print the same, also across the test corpus."""
+    for n in sizes: # small, since the plain loops build a chain of thunks as deep as n
+        program = VECTOR_PROGRAM.replace("N", str(n))
+        outputs = [run_program(program)]
+        interpreter = Interpreter(False, vectorize_loops=True)
+        interpreter.run(program)
+        outputs.append(interpreter.get_output())
+        assert outputs[0] == outputs[1], f"vectorizing changed the output for n={n}"
+        methods = [loop["method"] for loop in interpreter.get_stats()["vectorized_loops"]]
+        # the loop with divisions has no closed form, so without numpy it runs as written
+        expected = ["closed form", "numpy"] if loop_vectorizer.np is not None else ["closed form"]
+        assert n <= 0 or methods == expected, f"a loop wasn't vectorized for n={n}: {methods}"
+    for source, inp in read_test_cases():
+        plain = results_of(Interpreter(False), source, [inp])
+        assert results_of(Interpreter(False, vectorize_loops=True), source, [inp]) == plain, "vectorizing changed a test"
+
+    interpreter = Interpreter(False, vectorize_loops=True)
+    program = interpreter.compile(VECTOR_PROGRAM.replace("N", str(size)))
+    elapsed = best_time(lambda: list(interpreter.run_many(program, [[]])))
+    methods = [loop["method"] for loop in interpreter.get_stats()["vectorized_loops"]]
+    report(f"vectorized loops n={size}", elapsed, f"({methods})")
+
+
+def generated_program(functions, statement_end=" "): # return source of a program with many functions
+    parts = []
+    for i in range(functions):
+        statements = ["var y: int;", f"y = x * {i} + 1;", "if (y > 100) { y = y - 100; }", "return y;"]
+        body = statement_end.join(statements)
+        parts.append(f"func f{i}(x: int): int {{{statement_end}{body}{statement_end}}}")
+    parts.append("func main(): void { print(f0(1)); }")
+    return "\n".join(parts)
+
+
+def bench_binast(functions=5000, path="/tmp/brewin-bench.bast"):
+    """Round-trip every test program through binast, then time loading a large one against parsing it."""
+    for source in read_corpus():
+        ast = brewparse.parse_program(source)
+        assert str(binast.loads(binast.dumps(ast))) == str(ast), "binast round trip changed a tree"
+
+    source = generated_program(functions)
+    binast.dump(brewparse.parse_program(source), path)
+    main_ast = lambda ast: ast.get("functions")[-1]
+
+    elapsed = best_time(lambda: main_ast(brewparse.parse_program(source)).get("statements"))
+    report(f"reparse functions={functions}", elapsed)
+    elapsed = best_time(lambda: main_ast(binast.load(path)).get("statements"))
+    report(f"binast load functions={functions}", elapsed, f"({os.path.getsize(path)} bytes)")
+    elapsed = best_time(lambda: sum(1 for _ in iter_elements(binast.load(path))))
+    report(f"binast load and decode all functions={functions}", elapsed)
+    os.remove(path)
+
+
+# AST node as it was before nodes had classes of their own: every field in a per-node dict
+class DictElement:
+    def __init__(self, elem_type, **kwargs):
+        self.elem_type = elem_type
+        self.dict = {}
+        for key, value in kwargs.items():
+            self.dict[key] = value
+
+    def get(self, key):
+        if key not in self.dict:
+            return None
+        return self.dict[key]
+
+
+def dict_backed(node): # return a copy of the tree made of DictElements
+    if isinstance(node, list):
+        return [dict_backed(v) for v in node]
+    if hasattr(node, "FIELDS"):
+        return DictElement(node.elem_type, **{key: dict_backed(getattr(node, key)) for key in node.FIELDS})
+    return node
+
+
+def iter_dict_backed(node): # yield every DictElement in a tree made by dict_backed
+    if isinstance(node, list):
+        for item in node:
+            yield from iter_dict_backed(item)
+    elif isinstance(node, DictElement):
+        yield node
+        for value in node.dict.values():
+            yield from iter_dict_backed(value)
+
+
+def node_bytes(node): # return memory of the node object, plus its attribute dict and field dict if it has them
+    size = sys.getsizeof(node)
+    if hasattr(node, "__dict__"):
+        size += sys.getsizeof(vars(node))
+    if isinstance(node, DictElement):
+        size += sys.getsizeof(node.dict)
+    return size
+
+
+def bench_nodes(functions=2000, rounds=20):
+    """Memory per AST node and cost per field access, for slotted nodes and dict-backed ones."""
+    for label, sources in (("v4 corpus", read_corpus("v4")), (f"functions={functions}", [generated_program(functions)])):
+        trees = [brewparse.parse_program(source) for source in sources]
+        for kind, roots in (("slotted", trees), ("dict", dict_backed(trees))):
+            nodes = list(iter_elements(roots)) if kind == "slotted" else list(iter_dict_backed(roots))
+            ops = [node for node in nodes if node.elem_type in ("+", "-", "*", "/", "<", ">", "==")]
+            distinct = {id(node): node for node in nodes}.values() # brewparse.shared nodes occur many times
+            per_node = sum(node_bytes(node) for node in distinct) / len(nodes)
+            report(f"nodes {label} {kind}", 0, f"({len(nodes)} nodes, {len(distinct)} distinct, {per_node:.0f} bytes each)")
+
+            def read_attributes():
+                for _ in range(rounds):
+                    for node in ops:
+                        node.op1, node.op2
+
+            def read_with_get():
+                for _ in range(rounds):
+                    for node in ops:
+                        node.get("op1"), node.get("op2")
+
+            accesses = 2 * rounds * len(ops)
+            readers = [("attribute", read_attributes)] if kind == "slotted" else []
+            for how, func in readers + [("get()", read_with_get)]:
+                elapsed = best_time(func)
+                report(f"  {how} access", elapsed, f"({elapsed / accesses * 1e9:.0f} ns per access)")
+
+
+def bench_lazy_functions(functions=(100, 1000, 5000)):
+    """Parse and run a library of functions that only calls one of them, with every body parsed and lazily."""
+    for count in functions:
+        source = generated_program(count, "\n")
+        outputs = []
+        for label, lazy in (("eager", False), ("lazy", True)):
+            interpreter = Interpreter(False, lazy_functions=lazy)
+            elapsed = best_time(lambda: interpreter.run(source))
+            report(f"run functions={count} {label}", elapsed)
+            outputs.append(interpreter.get_output())
+        assert outputs[0] == outputs[1], "lazily parsed bodies changed the output"
+        elapsed = best_time(lambda: brewscan.validate(brewscan.parse_program(source)), repeat=1)
+        report("  validate every body lazily", elapsed)
+
+
+def bench_incremental(functions=(100, 1000, 10000), edits=20):
+    """Latency of a one-line edit in the middle of programs of growing size, reparsed whole and incrementally."""
+    for count in functions:
+        source = generated_program(count, "\n")
+        parser = IncrementalParser(source)
+        before = list(parser.nodes)
+
+        def edit_one_line():
+            for i in range(edits):
+                at = parser.source.index(f" = x * {count // 2} + ") - 1
+                parser.edit(at, at + 1, "y" if i % 2 else "z")
+
+        elapsed = best_time(edit_one_line, repeat=1) / edits
+        report(f"edit functions={count} incremental", elapsed, f"({len(source) // 1024} KB)")
+        assert str(parser.ast) == str(brewparse.parse_program(parser.source)), "incremental edit changed the tree"
+        assert parser.stats["full_parses"] == 1, "an edit needed a full parse"
+        reused = sum(old is new for old, new in zip(before, parser.nodes))
+        assert reused == count, "an untouched function was reparsed" # all but the edited one of count + 1
+        report(f"edit functions={count} full reparse", best_time(lambda: brewparse.parse_program(parser.source)))
+
+
+def bench_parallel_parse(functions=20000, workers=(1, 2, 4)):
+    """Parse one large generated program with a growing number of worker processes."""
+    source = generated_program(functions, "\n")
+    expected = str(brewparse.parse_program(source))
+    for count in workers:
+        with ParallelParser(count) as parser:
+            elapsed = best_time(lambda: parser.parse(source), repeat=2) # the first one also starts the pool
+            report(f"parse {len(source) // 1024} KB workers={count}", elapsed, f"(of {os.cpu_count()} cores)")
+            elapsed = best_time(lambda: sum(1 for _ in iter_elements(parser.parse(source))), repeat=2)
+            report("  parse and decode every node", elapsed)
+            assert str(parser.parse(source)) == expected, "parsing in parallel changed the tree"
+
+
+def traced_bytes(build): # return (result of build(), bytes it allocated that are still live)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def bench_columns(lines=100000):
+    """Memory and traversal speed of a large AST as Elements and as ColumnTree columns."""
+    for source in read_corpus():
+        ast = brewparse.parse_program(source)
+        assert str(ColumnTree.from_ast(ast).root()) == str(ast), "ColumnTree changed a tree"
+
+    source = generated_program(lines // 6, "\n")
+    ast, ast_bytes = traced_bytes(lambda: brewparse.parse_program(source))
+    tree, tree_bytes = traced_bytes(lambda: ColumnTree.from_ast(ast))
+    report(f"columns lines={lines} elements", 0, f"({ast_bytes / 1e6:.1f} MB)")
+    report(f"columns lines={lines} columns", 0, f"({len(tree)} rows, {tree_bytes / 1e6:.1f} MB)")
+
+    def count_ifs_in_elements():
+        return sum(1 for node in iter_elements(ast) if node.elem_type == InterpreterBase.IF_NODE)
+
+    def count_ifs_in_columns():
+        return len(tree.nodes_of_kind(InterpreterBase.IF_NODE))
+
+    assert count_ifs_in_columns() == count_ifs_in_elements() == lines // 6
+    report("  find ifs in elements", best_time(count_ifs_in_elements))
+    report("  find ifs in columns", best_time(count_ifs_in_columns))
+    report("  convert to columns", best_time(lambda: ColumnTree.from_ast(ast)))
+
+    outputs = []
+    for root in (ast, ColumnTree.from_ast(ast).root()):
+        interpreter = Interpreter(False)
+        interpreter.run_program(interpreter.compile_ast(root))
+        outputs.append(interpreter.get_output())
+    assert outputs[0] == outputs[1], "running from columns changed the output"
+
+
+def resume_to_end(run, inputs): # return RunResult of a ResumableRun, fed inputs one at a time as it waits
+    inputs = list(inputs)
+    request = run.resume()
+    while request[0] != scheduler.DONE:
+        if request[0] == scheduler.INPUT:
+            if inputs:
+                run.feed(inputs.pop(0))
+            else:
+                run.close_input()
+        request = run.resume()
+    return request[1]
+
+
+def bench_scheduler(runs=1000):
+    """Many short programs next to a runaway one, sequentially and interleaved by the scheduler."""
+    for source, inp in read_test_cases():
+        plain = results_of(Interpreter(False), source, [inp])[0]
+        result = resume_to_end(scheduler.ResumableRun(source, slice_steps=7, wait_for_input=True), inp)
+        assert (result.output, result.error_type) == plain, "pausing changed a test"
+    # input closed before the last read: a Brewin error, as when the input list runs out
+    for read in ("inputi", "inputs"):
+        source = f"func main() {{ var a; a = {read}(); print(a); print({read}(\"more? \")); }}"
+        plain = results_of(Interpreter(False), source, [["5"]])[0]
+        sched = scheduler.Scheduler(slice_steps=1)
+        run = sched.spawn(source, wait_for_input=True)
+        sched.run(rounds=None)
+        sched.feed(run, "5")
+        sched.run(rounds=None)
+        assert sched.waiting == {run}, "a run didn't wait for its second input"
+        sched.close_input(run)
+        finished, pending = sched.run(rounds=None)
+        assert finished == [run] and not pending
+        assert (run.result.output, run.result.error_type) == plain == (["5", "more? "], ErrorType.FAULT_ERROR)
+
+    interpreter = Interpreter(False)
+    program = interpreter.compile(SHORT_PROGRAM)
+    report(f"sequential runs={runs}", best_time(lambda: list(interpreter.run_many(program, [[]] * runs))))
+
+    def interleaved():
+        threads = threading.active_count()
+        sched = scheduler.Scheduler(slice_steps=1000)
+        runaway = sched.spawn(RUNAWAY_PROGRAM)
+        short = [sched.spawn(program) for _ in range(runs)]
+        finished = []
+        while len(finished) < runs:
+            done, pending = sched.run()
+            finished += done
+        assert pending == [runaway] and runaway.stats["slices"] > 0
+        assert all(run.result.output == ["4950"] for run in short)
+        assert threading.active_count() == threads, "paused runs hold threads"
+        sched.close()
+        return runaway.stats
+
+    stats = interleaved()
+    report(f"scheduled runs={runs} + runaway", best_time(interleaved), f"(runaway: {stats})")
+
+
+def bench_async(sessions=500, typing_delay=0.01):
+    """Interactive sessions on one event loop, each waiting typing_delay seconds for its input."""
+
+    threads = threading.active_count()
+
+    async def session(n):
+        async def read():
+            await asyncio.sleep(typing_delay)
+            assert threading.active_count() == threads, "sessions hold threads"
+            return str(n)
+
+        async def write(text):
+            pass
+
+        result = await AsyncInterpreter(read, write, yield_every=100).run(SESSION_PROGRAM)
+        assert result.output == ["n? ", str(n * (n - 1) // 2)]
+
+    async def all_sessions():
+        await asyncio.gather(*[session(n) for n in range(sessions)])
+
+    elapsed = best_time(lambda: asyncio.run(all_sessions()), repeat=1)
+    report(f"async sessions={sessions}", elapsed, f"({typing_delay * sessions:.1f} s of input waits)")
+
+
+BENCHMARKS = {
+    "linked_list": bench_linked_list,
+    "tree": bench_tree,
+    "array": bench_array,
+    "map": bench_map,
+    "run_many": bench_run_many,
+    "lanes": bench_lanes,
+    "specialize": bench_specialize,
+    "vectorize": bench_vectorize,
+    "parallel": bench_parallel,
+    "scheduler": bench_scheduler,
+    "async": bench_async,
+    "startup": bench_startup,
+    "parse_threads": bench_parse_threads,
+    "ast_cache": bench_ast_cache,
+    "binast": bench_binast,
+    "nodes": bench_nodes,
+    "columns": bench_columns,
+    "lazy_functions": bench_lazy_functions,
+    "incremental": bench_incremental,
+    "parallel_parse": bench_parallel_parse,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f"Unknown benchmark {name}; expect one of {sorted(BENCHMARKS)}")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
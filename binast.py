@@ -0,0 +1,205 @@
+"""
+Flat binary format for Brewin ASTs, loaded lazily through mmap.
+
+    binast.dump(ast, "prog.bast")
+    ast = binast.load("prog.bast")     # only the root is decoded here
+
+A file is a header, then node records, then a string table. Every value in the
+tree is a fixed-size slot: a type code plus a 64-bit payload, which is the value
+itself for ints and bools, an index into the string table for strings, and the
+file offset of a record for Elements, lists and tuples.
+
+    header    MAGIC, VERSION (u16), string table offset (u64), root slot
+    element   elem_type string index (u32), field count (u32),
+              then per field: key string index (u32) and value slot
+    list      item count (u32), then an item slot per item (also for tuples)
+    strings   count (u32), then per string: offset and length (u32 each) into
+              the UTF-8 bytes that follow
+
+Records are written children first, so a writer never has to patch offsets. A
+node that occurs in several places (see brewparse.shared) is written once, and
+loads as one node again.
+
+load() maps the file and decodes nothing up front. Each Element it returns reads
+its own record the first time one of its fields is touched, and each string is
+decoded once and interned, so elem_types compare fast. The pages are the file's,
+so any number of processes loading the same file share them. The mapping stays
+open as long as some node that hasn't been decoded yet still refers to it.
+"""
+
+import mmap
+import struct
+import sys
+
+from element import Element, LazyNode
+
+MAGIC = b"BRAST\0"
+VERSION = 1
+
+NONE, FALSE, TRUE, INT, BIG_INT, STRING, ELEMENT, LIST, TUPLE = range(9)
+INT_MIN = -(2**63)
+INT_MAX = 2**63 - 1
+
+HEADER = struct.Struct(f"<{len(MAGIC)}sHQ")
+SLOT = struct.Struct("<Bq")  # type code, payload
+COUNT = struct.Struct("<I")
+ELEMENT_HEAD = struct.Struct("<II")  # elem_type, field count
+FIELD_KEY = struct.Struct("<I")
+STRING_ENTRY = struct.Struct("<II")  # offset, length
+
+
+def dumps(ast): # return bytes
+    return _Writer().write(ast)
+
+
+def dump(ast, path): # no return
+    with open(path, "wb") as handle:
+        handle.write(dumps(ast))
+
+
+def loads(data): # return the root of the tree in data (bytes, bytearray or mmap)
+    return _Tree(data).root()
+
+
+def load(path): # return the root of the tree in the file at path
+    with open(path, "rb") as handle:
+        data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    return loads(data)
+
+
+class _Writer:
+    def __init__(self):
+        self.out = bytearray(HEADER.size + SLOT.size) # header and root slot are filled in last
+        self.strings = {} # str -> index
+        self.written = {} # id of an Element -> offset of its record, so shared nodes are written once
+
+    def write(self, ast): # return bytes
+        root = self.__slot(ast)
+        strings_offset = len(self.out)
+        self.__write_strings()
+        HEADER.pack_into(self.out, 0, MAGIC, VERSION, strings_offset)
+        self.out[HEADER.size : HEADER.size + SLOT.size] = root
+        return bytes(self.out)
+
+    def __string(self, s): # return index of s in the string table
+        index = self.strings.get(s)
+        if index is None:
+            index = self.strings[s] = len(self.strings)
+        return index
+
+    def __slot(self, value): # return packed slot; writes the records value needs first
+        if value is None:
+            return SLOT.pack(NONE, 0)
+        if value is True or value is False:
+            return SLOT.pack(TRUE if value else FALSE, 0)
+        if isinstance(value, int):
+            if INT_MIN <= value <= INT_MAX:
+                return SLOT.pack(INT, value)
+            return SLOT.pack(BIG_INT, self.__string(str(value)))
+        if isinstance(value, str):
+            return SLOT.pack(STRING, self.__string(value))
+        if isinstance(value, Element):
+            if id(value) in self.written:
+                return SLOT.pack(ELEMENT, self.written[id(value)])
+            fields = [(self.__string(key), self.__slot(getattr(value, key))) for key in value.FIELDS]
+            offset = len(self.out)
+            self.out += ELEMENT_HEAD.pack(self.__string(value.elem_type), len(fields))
+            for key, slot in fields:
+                self.out += FIELD_KEY.pack(key)
+                self.out += slot
+            self.written[id(value)] = offset
+            return SLOT.pack(ELEMENT, offset)
+        if isinstance(value, (list, tuple)):
+            slots = [self.__slot(item) for item in value]
+            offset = len(self.out)
+            self.out += COUNT.pack(len(slots))
+            for slot in slots:
+                self.out += slot
+            return SLOT.pack(TUPLE if isinstance(value, tuple) else LIST, offset)
+        raise TypeError(f"can't encode {type(value).__name__} in a Brewin AST")
+
+    def __write_strings(self): # no return
+        encoded = [s.encode("utf-8") for s in self.strings]
+        self.out += COUNT.pack(len(encoded))
+        offset = 0
+        for data in encoded:
+            self.out += STRING_ENTRY.pack(offset, len(data))
+            offset += len(data)
+        for data in encoded:
+            self.out += data
+
+
+# A mapped file and the strings decoded from it so far
+class _Tree:
+    def __init__(self, data):
+        magic, version, strings_offset = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("not a Brewin AST file")
+        if version != VERSION:
+            raise ValueError(f"Brewin AST file version {version}, expected {VERSION}")
+        self.data = data
+        self.strings_offset = strings_offset
+        (self.string_count,) = COUNT.unpack_from(data, strings_offset)
+        self.string_bytes = strings_offset + COUNT.size + self.string_count * STRING_ENTRY.size
+        self.strings = [None] * self.string_count
+        self.nodes = {} # record offset -> LazyElement, so a node shared in the tree that was written stays shared
+
+    def root(self):
+        return self.value(HEADER.size)
+
+    def string(self, index): # return str
+        s = self.strings[index]
+        if s is None:
+            offset, length = STRING_ENTRY.unpack_from(
+                self.data, self.strings_offset + COUNT.size + index * STRING_ENTRY.size
+            )
+            start = self.string_bytes + offset
+            s = self.strings[index] = sys.intern(str(self.data[start : start + length], "utf-8"))
+        return s
+
+    def value(self, slot_offset): # return the value in the slot at slot_offset
+        code, payload = SLOT.unpack_from(self.data, slot_offset)
+        if code == ELEMENT:
+            node = self.nodes.get(payload)
+            if node is None:
+                node = self.nodes[payload] = LazyElement(self, payload)
+            return node
+        if code == INT:
+            return payload
+        if code == STRING:
+            return self.string(payload)
+        if code == LIST or code == TUPLE:
+            (count,) = COUNT.unpack_from(self.data, payload)
+            first = payload + COUNT.size
+            items = [self.value(first + i * SLOT.size) for i in range(count)]
+            return items if code == LIST else tuple(items)
+        if code == NONE:
+            return None
+        if code == BIG_INT:
+            return int(self.string(payload))
+        return code == TRUE
+
+    def fields(self, offset): # return dict of the fields of the element record at offset
+        _, count = ELEMENT_HEAD.unpack_from(self.data, offset)
+        fields = {}
+        field_offset = offset + ELEMENT_HEAD.size
+        for _ in range(count):
+            (key,) = FIELD_KEY.unpack_from(self.data, field_offset)
+            fields[self.string(key)] = self.value(field_offset + FIELD_KEY.size)
+            field_offset += FIELD_KEY.size + SLOT.size
+        return fields
+
+
+# An Element whose fields are read from its record on first access
+class LazyElement(LazyNode):
+    def __init__(self, tree, offset):
+        (type_index,) = FIELD_KEY.unpack_from(tree.data, offset)
+        self.elem_type = tree.string(type_index)
+        self.__tree = tree
+        self.__offset = offset
+
+    def _read_fields(self): # return dict of the node's fields
+        fields = self.__tree.fields(self.__offset)
+        del self.__tree # lets the mapping go once every node referring to it is decoded
+        del self.__offset
+        return fields
@@ -0,0 +1,72 @@
+"""
+Storage and bulk operations for Brewin arrays.
+
+An array is a contiguous array('q') of 64-bit ints. Bulk operations run as one
+native loop over the buffer (NumPy if installed, the array module otherwise)
+instead of one interpreter dispatch per element. Values that don't fit in 64
+bits raise OverflowError and division by zero raises ZeroDivisionError; the
+interpreter turns these into Brewin errors.
+"""
+
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional
+    np = None
+
+INT64_MIN = -(2**63)
+INT64_MAX = 2**63 - 1
+NUMPY_MIN_LENGTH = 64  # below this NumPy's call overhead outweighs the loop it saves
+
+MAP_OPS = {
+    "+": lambda x, k: x + k,
+    "-": lambda x, k: x - k,
+    "*": lambda x, k: x * k,
+    "/": lambda x, k: x // k,
+}
+
+
+def new_array(length):
+    return array("q", bytes(8 * length))
+
+
+def fill(arr, value):
+    arr[:] = array("q", [value]) * len(arr)
+
+
+def total(arr):
+    # python's sum over the buffer is exact, numpy's would wrap around on overflow
+    return sum(arr)
+
+
+def map_op(arr, op, k):
+    if op == "/" and k == 0:
+        raise ZeroDivisionError("array division by zero")
+    if np is not None and len(arr) >= NUMPY_MIN_LENGTH:
+        _map_numpy(arr, op, k)
+        return
+    f = MAP_OPS[op]
+    arr[:] = array("q", [f(x, k) for x in arr])
+
+
+def to_printable(arr):
+    return "[" + ", ".join(str(x) for x in arr) + "]"
+
+
+def _map_numpy(arr, op, k):
+    view = np.frombuffer(arr, dtype=np.int64)  # shares memory with arr
+    f = MAP_OPS[op]
+    # every op is monotonic in x, so the results at the extremes bound all the others
+    low, high = int(view.min()), int(view.max())
+    for result in (f(low, k), f(high, k)):
+        if result < INT64_MIN or result > INT64_MAX:
+            raise OverflowError("array element out of int64 range")
+    if op == "+":
+        np.add(view, k, out=view)
+    elif op == "-":
+        np.subtract(view, k, out=view)
+    elif op == "*":
+        np.multiply(view, k, out=view)
+    else:
+        np.floor_divide(view, k, out=view)
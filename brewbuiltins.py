@@ -0,0 +1,260 @@
+"""
+Registry of the functions a Brewin program can call without defining them.
+
+A builtin is a Python function called as func(interpreter, args) that returns a
+Value. Strict builtins get their arguments as evaluated Value objects; lazy ones
+get LazyArg objects and only evaluate the arguments they need, via arg.value().
+Builtins report Brewin errors through interpreter.error() and do I/O through
+interpreter.output() and interpreter.get_input().
+
+Host code can add builtins to an interpreter's registry before compiling:
+
+    interpreter.builtins.register("twice", 1, lambda interp, args: ..., returns=Type.INT)
+
+returns, if given, promises the type of every value the builtin returns; the
+static type checker relies on it. pure=True declares that the builtin has no side
+effects, so partial_eval may precompute calls to it on constant arguments.
+
+Calls are linked once, when a program is compiled. A user function of the same
+name and arity as a builtin shadows it, except for the RESERVED names, which
+always call the builtin.
+"""
+
+import brewarray
+from intbase import ErrorType
+from type_valuev2 import Type, Value, get_printable, map_key, UserException
+
+NIL_VALUE = Value(Type.NIL, None)
+RESERVED = ("print", "inputi", "inputs")  # names a user function can't take over
+
+
+class Builtin:
+    def __init__(self, name, arity, func, strict, returns, pure):
+        self.name = name
+        self.arity = arity  # None accepts any number of arguments
+        self.func = func
+        self.strict = strict
+        self.returns = returns  # Type of every value it returns, if there is one
+        self.pure = pure  # no side effects, so calls on constant arguments can be precomputed
+
+
+# Argument of a lazy builtin; evaluated (once) the first time its value is asked for
+class LazyArg:
+    def __init__(self, evaluate, expr_ast):
+        self.__evaluate = evaluate
+        self.__expr_ast = expr_ast
+        self.__value = None
+
+    def value(self): # return Value object
+        if self.__value is None:
+            self.__value = self.__evaluate(self.__expr_ast)
+        return self.__value
+
+
+class BuiltinRegistry:
+    def __init__(self):
+        self.__builtins = {}  # (name, arity) -> Builtin
+
+    def register(self, name, arity, func, strict=True, returns=None, pure=False):
+        self.__builtins[(name, arity)] = Builtin(name, arity, func, strict, returns, pure)
+
+    def lookup(self, name, arity): # return Builtin or None
+        builtin = self.__builtins.get((name, arity))
+        if builtin is None:
+            builtin = self.__builtins.get((name, None))
+        return builtin
+
+    def copy(self): # return BuiltinRegistry
+        registry = BuiltinRegistry()
+        registry.__builtins = dict(self.__builtins)
+        return registry
+
+
+def default_registry(): # return BuiltinRegistry
+    registry = BuiltinRegistry()
+    registry.register("print", None, _print, returns=Type.NIL)
+    for name, parse, returns in (("inputi", lambda s: Value(Type.INT, int(s)), Type.INT),
+                                 ("inputs", lambda s: Value(Type.STRING, s), Type.STRING)):
+        registry.register(name, 0, _input(name, parse), returns=returns)
+        registry.register(name, 1, _input(name, parse), returns=returns)
+
+    registry.register("strlen", 1, _strlen, returns=Type.INT, pure=True)
+    registry.register("substr", 3, _substr, returns=Type.STRING, pure=True)
+    registry.register("str_find", 2, _str_find, returns=Type.INT, pure=True)
+    registry.register("parse_int", 1, _parse_int, returns=Type.INT, pure=True)
+    registry.register("to_string", 1, _to_string, returns=Type.STRING, pure=True)
+
+    registry.register("array", 1, _array, returns=Type.ARRAY)
+    registry.register("array_len", 1, _array_len, returns=Type.INT)
+    registry.register("array_get", 2, _array_get, returns=Type.INT)
+    registry.register("array_set", 3, _array_set, returns=Type.NIL)
+    registry.register("array_fill", 2, _array_fill, returns=Type.NIL)
+    registry.register("array_sum", 1, _array_sum, returns=Type.INT)
+    registry.register("array_map", 3, _array_map, returns=Type.NIL)
+
+    registry.register("map", 0, _map, returns=Type.MAP)
+    registry.register("map_get", 2, _map_get)
+    registry.register("map_put", 3, _map_put, returns=Type.NIL)
+    registry.register("map_has", 2, _map_has, returns=Type.BOOL)
+    registry.register("map_size", 1, _map_size, returns=Type.INT)
+    return registry
+
+
+def _check_type(interpreter, name, value_obj, t): # return the python value of value_obj
+    if value_obj.type() != t:
+        interpreter.error(ErrorType.TYPE_ERROR, f"{name} expects type {t}, got {value_obj.type()}")
+    return value_obj.value()
+
+
+def _print(interpreter, args):
+    interpreter.output("".join(_printable(interpreter, "print", arg) for arg in args))
+    return NIL_VALUE
+
+
+def _input(name, parse):
+    def call(interpreter, args):
+        if args:
+            interpreter.output(_printable(interpreter, "input", args[0]))  # the prompt
+        text = interpreter.get_input()
+        if text is None: # past the end of the input list, or of closed input
+            interpreter.error(ErrorType.FAULT_ERROR, f"{name} read past the end of input")
+        return parse(text)
+    return call
+
+
+def _printable(interpreter, name, value_obj): # return str
+    printable = get_printable(value_obj)
+    if printable is None:
+        interpreter.error(ErrorType.TYPE_ERROR, f"{name} of a {value_obj.type()}")
+    return printable
+
+
+# strings
+
+def _strlen(interpreter, args):
+    return Value(Type.INT, len(_check_type(interpreter, "strlen", args[0], Type.STRING)))
+
+
+def _substr(interpreter, args):
+    s = _check_type(interpreter, "substr", args[0], Type.STRING)
+    start = _check_type(interpreter, "substr", args[1], Type.INT)
+    end = _check_type(interpreter, "substr", args[2], Type.INT)
+    if not 0 <= start <= end <= len(s):
+        interpreter.error(
+            ErrorType.FAULT_ERROR, f"substr range {start}..{end} out of bounds for length {len(s)}"
+        )
+    return Value(Type.STRING, s[start:end])
+
+
+def _str_find(interpreter, args):
+    s = _check_type(interpreter, "str_find", args[0], Type.STRING)
+    sub = _check_type(interpreter, "str_find", args[1], Type.STRING)
+    return Value(Type.INT, s.find(sub))
+
+
+def _parse_int(interpreter, args):
+    s = _check_type(interpreter, "parse_int", args[0], Type.STRING)
+    try:
+        return Value(Type.INT, int(s))
+    except ValueError:
+        interpreter.error(ErrorType.FAULT_ERROR, f"parse_int of a non-integer string {s}")
+
+
+def _to_string(interpreter, args):
+    return Value(Type.STRING, _printable(interpreter, "to_string", args[0]))
+
+
+# arrays: elements are always plain ints, so reading one never forces anything
+
+def _index(interpreter, arr, value_obj): # return int
+    index = _check_type(interpreter, "array index", value_obj, Type.INT)
+    if index < 0 or index >= len(arr):
+        interpreter.error(
+            ErrorType.FAULT_ERROR, f"Array index {index} out of bounds for length {len(arr)}"
+        )
+    return index
+
+
+def _array(interpreter, args):
+    length = _check_type(interpreter, "array", args[0], Type.INT)
+    if length < 0:
+        interpreter.error(ErrorType.FAULT_ERROR, f"Negative array length {length}")
+    return Value(Type.ARRAY, brewarray.new_array(length))
+
+
+def _array_len(interpreter, args):
+    return Value(Type.INT, len(_check_type(interpreter, "array_len", args[0], Type.ARRAY)))
+
+
+def _array_sum(interpreter, args):
+    arr = _check_type(interpreter, "array_sum", args[0], Type.ARRAY)
+    return Value(Type.INT, brewarray.total(arr))
+
+
+def _array_get(interpreter, args):
+    arr = _check_type(interpreter, "array_get", args[0], Type.ARRAY)
+    return Value(Type.INT, arr[_index(interpreter, arr, args[1])])
+
+
+def _array_set(interpreter, args):
+    arr = _check_type(interpreter, "array_set", args[0], Type.ARRAY)
+    index = _index(interpreter, arr, args[1])
+    value = _check_type(interpreter, "array_set", args[2], Type.INT)
+    try:
+        arr[index] = value
+    except OverflowError:
+        interpreter.error(ErrorType.FAULT_ERROR, f"{value} does not fit in an array element")
+    return NIL_VALUE
+
+
+def _array_fill(interpreter, args):
+    arr = _check_type(interpreter, "array_fill", args[0], Type.ARRAY)
+    value = _check_type(interpreter, "array_fill", args[1], Type.INT)
+    try:
+        brewarray.fill(arr, value)
+    except OverflowError:
+        interpreter.error(ErrorType.FAULT_ERROR, f"{value} does not fit in an array element")
+    return NIL_VALUE
+
+
+def _array_map(interpreter, args):
+    arr = _check_type(interpreter, "array_map", args[0], Type.ARRAY)
+    op = args[1].value() if args[1].type() == Type.STRING else None
+    if op not in brewarray.MAP_OPS:
+        interpreter.error(ErrorType.TYPE_ERROR, f"Unsupported array_map operation {op}")
+    k = _check_type(interpreter, "array_map", args[2], Type.INT)
+    try:
+        brewarray.map_op(arr, op, k)
+    except OverflowError:
+        interpreter.error(ErrorType.FAULT_ERROR, "array_map result does not fit in an array element")
+    except ZeroDivisionError:
+        raise UserException("div0")
+    return NIL_VALUE
+
+
+# maps: each entry maps map_key(key) -> (key, value), keeping the key Value alive so
+# reference keys can't have their id reused
+
+def _map(interpreter, args):
+    return Value(Type.MAP, {})
+
+
+def _map_get(interpreter, args):
+    entries = _check_type(interpreter, "map_get", args[0], Type.MAP)
+    entry = entries.get(map_key(args[1]))
+    return NIL_VALUE if entry is None else entry[1]
+
+
+def _map_put(interpreter, args):
+    entries = _check_type(interpreter, "map_put", args[0], Type.MAP)
+    entries[map_key(args[1])] = (args[1], args[2])
+    return NIL_VALUE
+
+
+def _map_has(interpreter, args):
+    entries = _check_type(interpreter, "map_has", args[0], Type.MAP)
+    return Value(Type.BOOL, map_key(args[1]) in entries)
+
+
+def _map_size(interpreter, args):
+    return Value(Type.INT, len(_check_type(interpreter, "map_size", args[0], Type.MAP)))
@@ -1,4 +1,4 @@
-from ply import lex
+import sys
 
 reserved = (
     "VAR",
@@ -106,6 +106,7 @@ def t_NUMBER(t):
 def t_NAME(t):
     r"[A-Za-z_][\w_]*"
     t.type = reserved_map.get(t.value, "NAME")
+    t.value = sys.intern(t.value) # names are dict keys all through the interpreter
     return t
 
 def t_newline(t):
@@ -120,7 +121,7 @@ def t_comment(t):
 
 def t_STRING(t):
     r'".*?"'
-    t.value = t.value[1:-1]
+    t.value = sys.intern(t.value[1:-1])
     return t
 
 
@@ -128,8 +129,15 @@ def t_error(t):
     print(f"Illegal character {t.value[0]}")
     t.lexer.skip(1)
 
-def reset_lineno():
-    lexer.lineno = 1
+_lexer = None
 
-# Build the lexer
-lexer = lex.lex()
+
+# the lexer every brewparse.BrewinParser clones; it is built on first use, so importing
+# this module doesn't import ply
+def get_lexer(): # return ply lexer
+    global _lexer
+    if _lexer is None:
+        from ply import lex
+
+        _lexer = lex.lex()
+    return _lexer
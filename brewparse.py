@@ -1,7 +1,12 @@
-from element import Element
+import copy
+import threading
+
+from element import (
+    Arg, Assign, BinOp, Call, Catch, FieldDef, For, FuncDef, If, Literal, New, Nil, Program, Raise,
+    Return, StructDef, Try, UnaryOp, VarDef, VarRef,
+)
 from brewlex import *
 from intbase import InterpreterBase
-from ply import yacc
 
 # Parsing rules
 
@@ -15,6 +20,17 @@ precedence = (
 )
 
 
+# Literals, nil, variable reads and unary operations over them never change once parsed (unlike
+# calls and binary operations, which compiling annotates), so each distinct one is built once
+# per parse and shared by every place it occurs.
+def shared(p, node_class, *args): # return node_class(*args), or the equal node built before
+    key = (node_class,) + args # a child node is part of the key as itself, so only shared children match
+    node = p.parser.shared_nodes.get(key)
+    if node is None:
+        node = p.parser.shared_nodes[key] = node_class(*args)
+    return node
+
+
 def collapse_items(p, group_index, singleton_index):
     if len(p) == 2:
         p[0] = [p[1]]
@@ -27,9 +43,9 @@ def p_program(p):
     """program : structs funcs
     | funcs"""
     if len(p) == 2:
-        p[0] = Element(InterpreterBase.PROGRAM_NODE, structs=[], functions=p[1])
+        p[0] = Program([], p[1])
     else:
-        p[0] = Element(InterpreterBase.PROGRAM_NODE, structs=p[1], functions=p[2])
+        p[0] = Program(p[1], p[2])
 
 def p_structs(p):
     """structs : structs struct
@@ -38,7 +54,7 @@ def p_structs(p):
 
 def p_struct(p):
    "struct : STRUCT NAME LBRACE fields RBRACE"
-   p[0] = Element(InterpreterBase.STRUCT_NODE, name=p[2], fields=p[4])
+   p[0] = StructDef(p[2], p[4])
 
 def p_fields(p):
    """fields : fields field
@@ -47,7 +63,7 @@ def p_fields(p):
 
 def p_field(p):
   "field : NAME COLON NAME SEMI"  # field_name: type
-  p[0] = Element(InterpreterBase.FIELD_DEF_NODE, name=p[1], var_type=p[3])
+  p[0] = FieldDef(p[1], p[3])
 
 def p_funcs(p):
     """funcs : funcs func
@@ -59,17 +75,17 @@ def p_func(p):
     """func : FUNC NAME LPAREN formal_args RPAREN COLON NAME LBRACE statements RBRACE
     | FUNC NAME LPAREN RPAREN COLON NAME LBRACE statements RBRACE"""
     if len(p) == 11:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=p[4], return_type = p[7], statements=p[9])
+        p[0] = FuncDef(p[2], p[4], p[7], p[9])
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=[], return_type = p[6], statements=p[8])
+        p[0] = FuncDef(p[2], [], p[6], p[8])
 
 def p_func2(p):
     """func : FUNC NAME LPAREN formal_args RPAREN LBRACE statements RBRACE
     | FUNC NAME LPAREN RPAREN LBRACE statements RBRACE"""
     if len(p) == 9:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=p[4], return_type = None, statements=p[7])
+        p[0] = FuncDef(p[2], p[4], None, p[7])
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=[], return_type = None, statements=p[6])
+        p[0] = FuncDef(p[2], [], None, p[6])
 
 def p_formal_args(p):
     """formal_args : formal_args COMMA formal_arg
@@ -81,9 +97,9 @@ def p_formal_arg(p):
     """formal_arg : NAME COLON NAME
     | NAME"""
     if len(p) == 2:
-      p[0] = Element(InterpreterBase.ARG_NODE, name=p[1], var_type = None)
+      p[0] = Arg(p[1], None)
     else:
-      p[0] = Element(InterpreterBase.ARG_NODE, name=p[1], var_type = p[3])
+      p[0] = Arg(p[1], p[3])
 
 def p_statements(p):
     """statements : statements statement
@@ -95,17 +111,18 @@ def p_statement___assign(p):
     "statement : assign SEMI"
     p[0] = p[1]
 
+# name is the variable, fields the (possibly empty) tuple of fields after it: a.b.c -> a, (b, c)
 def p_assign(p):
     "assign : variable_w_dot ASSIGN expression"
-    p[0] = Element("=", name=p[1], expression=p[3])
+    p[0] = Assign(p[1][0], p[1][1:], p[3])
 
 def p_statement___var(p):
     """statement : VAR variable COLON NAME SEMI
     | VAR variable SEMI"""
     if len(p) == 6:
-      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[2], var_type=p[4])
+      p[0] = VarDef(p[2], p[4])
     else:
-      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[2], var_type=None)
+      p[0] = VarDef(p[2], None)
 
 def p_variable(p):
     "variable : NAME"
@@ -115,32 +132,22 @@ def p_variable_w_dot(p):
     """variable_w_dot : variable_w_dot DOT NAME
     | NAME"""
     if len(p) == 4:
-        p[0] = p[1] + "." + p[3]
+        p[0] = p[1] + (p[3],)
     else:
-        p[0] = p[1]
+        p[0] = (p[1],)
 
 def p_statement_if(p):
     """statement : IF LPAREN expression RPAREN LBRACE statements RBRACE
     | IF LPAREN expression RPAREN LBRACE statements RBRACE ELSE LBRACE statements RBRACE
     """
     if len(p) == 8:
-        p[0] = Element(
-            InterpreterBase.IF_NODE,
-            condition=p[3],
-            statements=p[6],
-            else_statements=None,
-        )
+        p[0] = If(p[3], p[6], None)
     else:
-        p[0] = Element(
-            InterpreterBase.IF_NODE,
-            condition=p[3],
-            statements=p[6],
-            else_statements=p[10],
-        )
+        p[0] = If(p[3], p[6], p[10])
 
 def p_statement_try(p):
     """statement : TRY LBRACE statements RBRACE catchers"""
-    p[0] = Element(InterpreterBase.TRY_NODE, statements=p[3], catchers=p[5])
+    p[0] = Try(p[3], p[5])
 
 def p_catches(p):
     """catchers : catchers catch
@@ -149,15 +156,15 @@ def p_catches(p):
 
 def p_catch(p):
     "catch : CATCH STRING LBRACE statements RBRACE"
-    p[0] = Element(InterpreterBase.CATCH_NODE, exception_type=p[2], statements=p[4])
+    p[0] = Catch(p[2], p[4])
 
 def p_statement_for(p):
     "statement : FOR LPAREN assign SEMI expression SEMI assign RPAREN LBRACE statements RBRACE"
-    p[0] = Element(InterpreterBase.FOR_NODE, init=p[3], condition=p[5], update=p[7], statements=p[10])
+    p[0] = For(p[3], p[5], p[7], p[10])
 
 def p_statement_raise(p):
     "statement : RAISE expression SEMI"
-    p[0] = Element(InterpreterBase.RAISE_NODE, exception_type=p[2])
+    p[0] = Raise(p[2])
 
 def p_statement_expr(p):
     "statement : expression SEMI"
@@ -171,21 +178,21 @@ def p_statement_return(p):
         expr = p[2]
     else:
         expr = None
-    p[0] = Element(InterpreterBase.RETURN_NODE, expression=expr)
+    p[0] = Return(expr)
 
 
 def p_expression_not(p):
     "expression : NOT expression"
-    p[0] = Element(InterpreterBase.NOT_NODE, op1=p[2])
+    p[0] = shared(p, UnaryOp, InterpreterBase.NOT_NODE, p[2])
 
 
 def p_expression_uminus(p):
     "expression : MINUS expression %prec UMINUS"
-    p[0] = Element(InterpreterBase.NEG_NODE, op1=p[2])
+    p[0] = shared(p, UnaryOp, InterpreterBase.NEG_NODE, p[2])
 
 def p_expression_new(p):
     "expression : NEW NAME"
-    p[0] = Element(InterpreterBase.NEW_NODE, var_type=p[2])
+    p[0] = New(p[2])
 
 
 def p_arith_expression_binop(p):
@@ -199,7 +206,7 @@ def p_arith_expression_binop(p):
     | expression MINUS expression
     | expression MULTIPLY expression
     | expression DIVIDE expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinOp(p[2], p[1], p[3])
 
 
 def p_expression_group(p):
@@ -210,43 +217,43 @@ def p_expression_group(p):
 def p_expression_and_or(p):
     """expression : expression OR expression
     | expression AND expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinOp(p[2], p[1], p[3])
 
 
 def p_expression_number(p):
     "expression : NUMBER"
-    p[0] = Element(InterpreterBase.INT_NODE, val=p[1])
+    p[0] = shared(p, Literal, InterpreterBase.INT_NODE, p[1])
 
 
 def p_expression_bool(p):
     """expression : TRUE
     | FALSE"""
     bool_val = p[1] == InterpreterBase.TRUE_DEF
-    p[0] = Element(InterpreterBase.BOOL_NODE, val=bool_val)
+    p[0] = shared(p, Literal, InterpreterBase.BOOL_NODE, bool_val)
 
 
 def p_expression_nil(p):
     "expression : NIL"
-    p[0] = Element(InterpreterBase.NIL_NODE)
+    p[0] = shared(p, Nil)
 
 
 def p_expression_string(p):
     "expression : STRING"
-    p[0] = Element(InterpreterBase.STRING_NODE, val=p[1])
+    p[0] = shared(p, Literal, InterpreterBase.STRING_NODE, p[1])
 
 
 def p_expression_variable(p):
     "expression : variable_w_dot"
-    p[0] = Element(InterpreterBase.VAR_NODE, name=p[1])
+    p[0] = shared(p, VarRef, p[1][0], p[1][1:])
 
 
 def p_func_call(p):
     """expression : NAME LPAREN args RPAREN
     | NAME LPAREN RPAREN"""
     if len(p) == 5:
-        p[0] = Element(InterpreterBase.FCALL_NODE, name=p[1], args=p[3])
+        p[0] = Call(p[1], p[3])
     else:
-        p[0] = Element(InterpreterBase.FCALL_NODE, name=p[1], args=[])
+        p[0] = Call(p[1], [])
 
 
 def p_expression_args(p):
@@ -256,20 +263,73 @@ def p_expression_args(p):
 
 
 def p_error(p):
+    if p:
+        p.lexer.syntax_errors += 1  # ply recovers by parsing on from the next token; see BrewinParser.parse
+    if getattr(_local, "quiet", False):
+        return
     if p:
         print(f"Syntax error at '{p.value}' on line {p.lineno}")
     else:
         print("Syntax error at EOF")
 
 
-# exported function
-def parse_program(program):
-    reset_lineno()
-    ast = yacc.parse(program)
-    if ast is None:
-        raise SyntaxError("Syntax error")
-    return ast
-
-
-# generate our parser
-yacc.yacc() # yacc.yacc(debug=True, debuglog=open("parse.log", "w"))
+# A lexer and LR parser of its own: a BrewinParser shares nothing it changes while parsing
+# with any other, so threads can parse at the same time as long as each uses its own.
+class BrewinParser:
+    def __init__(self):
+        lexer, parser = _get_tables()
+        self.lexer = lexer.clone()
+        self.parser = copy.copy(parser) # shares the parse tables, which parsing only reads
+
+    # first_line is the line program starts on, for parsing part of a file (see brewscan). A
+    # program with a syntax error ply recovered from still parses, to what followed the error,
+    # unless strict is set. quiet leaves syntax errors unreported, for a parse the caller repeats
+    # if it fails.
+    def parse(self, program, first_line=1, strict=False, quiet=False): # return program Element
+        self.lexer.lineno = first_line
+        self.lexer.syntax_errors = 0
+        self.parser.shared_nodes = {}  # see shared
+        was_quiet = getattr(_local, "quiet", False)
+        _local.quiet = quiet  # p_error runs in the parsing thread
+        try:
+            ast = self.parser.parse(program, lexer=self.lexer)
+        finally:
+            self.parser.shared_nodes = None
+            _local.quiet = was_quiet
+        if ast is None or strict and self.lexer.syntax_errors:
+            raise SyntaxError("Syntax error")
+        return ast
+
+
+_local = threading.local()  # each thread's BrewinParser for parse_program, and whether it is quiet
+
+
+# exported function; safe to call from several threads at once
+def parse_program(program, first_line=1, strict=False, quiet=False):
+    parser = getattr(_local, "parser", None)
+    if parser is None:
+        parser = _local.parser = BrewinParser()
+    return parser.parse(program, first_line, strict, quiet)
+
+
+_parser = None
+_tables_lock = threading.Lock()
+
+
+# The lexer and parser every BrewinParser copies are built on the first parse. The parser
+# is loaded straight from the tables in parsetab.py, without checking them against the
+# grammar above: after changing the grammar, regenerate them with
+#     python -c "import brewparse; from ply import yacc; yacc.yacc(module=brewparse, debug=False)"
+# Tables written by another version of ply raise yacc.VersionError.
+def _get_tables(): # return (ply lexer, ply LRParser)
+    global _parser
+    with _tables_lock:
+        if _parser is None:
+            import parsetab
+            from ply import yacc
+
+            tables = yacc.LRTable()
+            tables.read_table(parsetab)
+            tables.bind_callables(globals())
+            _parser = yacc.LRParser(tables, p_error)
+        return get_lexer(), _parser
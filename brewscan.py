@@ -0,0 +1,172 @@
+"""
+Parsing Brewin programs with function bodies parsed on first use.
+
+    ast = brewscan.parse_program(source)   # structs, the first function and headers only
+    Interpreter(lazy_functions=True).run(source)
+
+A quick scan of the top level finds every struct and func definition by
+balancing braces (skipping comments and strings the way brewlex does). The
+structs and the first function are parsed with brewparse as usual. Every later
+function becomes a FuncStub, whose name, args and return_type come from a
+regex over its header, so it can be registered in func_name_to_ast and linked
+to by calls. Its statements are parsed the first time they are read, normally
+when the function is first called; interpreterv4.Program then compiles that body
+on its own before anything runs it.
+
+A program whose top level the scan can't split cleanly (e.g. a struct after a
+func, unbalanced braces, an unclosed comment or a comment inside a header) is
+parsed whole, so its syntax errors are reported exactly as brewparse reports
+them.
+
+Syntax errors inside a later function's body only show up once the body is
+parsed: reading its statements raises SyntaxError, every time until it parses.
+Functions a run never calls are never checked, unless validate() is used; it is
+safe to run in another thread while the program runs, e.g.
+
+    errors = ThreadPoolExecutor(1).submit(brewscan.validate, ast)
+"""
+
+import re
+import sys
+import threading
+
+import brewparse
+from brewlex import reserved_map
+from element import Arg, FuncDef, LazyNode
+from intbase import InterpreterBase
+
+NAME = r"[A-Za-z_]\w*"
+COMMENT = r"/\*(?:(?!\*/)[\s\S])*\*/"  # ends at the first */, as brewlex's does, even when backtracking
+TOKEN = re.compile(rf'{COMMENT}|/\*|".*?"|[{{}}]|\b(?:func|struct)\b')  # a lone /* is never closed
+GAP = re.compile(rf"(?:\s|{COMMENT})*")  # what may come between top-level definitions
+ARG = rf"{NAME}(?:\s*:\s*{NAME})?"
+HEADER = re.compile(rf"func\s+({NAME})\s*\(\s*((?:{ARG}(?:\s*,\s*{ARG})*)?)\s*\)\s*(?::\s*({NAME})\s*)?")
+
+
+# A top-level definition: kind is "func" or "struct"; text[start:end] is all of it, and
+# text[start:body] its header
+class Span:
+    def __init__(self, kind, start, line):
+        self.kind = kind
+        self.start = start
+        self.line = line
+        self.body = None
+        self.end = None
+
+
+# scans program[start:end], which starts on line; a region that doesn't start at the top level
+# of program, or that a string or comment crosses, isn't scanned the way brewlex would lex it
+def scan(program, start=0, end=None, line=1): # return list of Spans, or None if the region isn't only definitions
+    end = len(program) if end is None else end
+    spans = []
+    span = None
+    depth = 0
+    position = start  # line is the line of program[position]
+    for match in TOKEN.finditer(program, start, end):
+        token = match.group()
+        if token == "/*":
+            return None
+        if token == "{":
+            if depth == 0:
+                if span is None:
+                    return None
+                span.body = match.start()
+            depth += 1
+        elif token == "}":
+            depth -= 1
+            if depth < 0:
+                return None
+            if depth == 0:
+                span.end = match.end()
+                spans.append(span)
+                span = None
+        elif depth == 0 and token in ("func", "struct"):
+            previous_end = spans[-1].end if spans else start
+            if span is not None or not GAP.fullmatch(program, previous_end, match.start()):
+                return None
+            line += program.count("\n", position, match.start())
+            position = match.start()
+            span = Span(token, match.start(), line)
+    if span is not None or depth != 0:
+        return None
+    if not GAP.fullmatch(program, spans[-1].end if spans else start, end):
+        return None
+    return spans
+
+
+def parse_program(program): # return program Element, with a FuncStub for every function but the first
+    spans = scan(program)
+    if not spans or spans[-1].kind != "func":
+        return brewparse.parse_program(program)
+    first_func = next(i for i, span in enumerate(spans) if span.kind == "func")
+    if any(span.kind != "func" for span in spans[first_func:]):
+        return brewparse.parse_program(program)
+    stubs = []
+    for span in spans[first_func + 1 :]:
+        stub = _stub(program, span)
+        if stub is None:
+            return brewparse.parse_program(program)
+        stubs.append(stub)
+    try:
+        ast = brewparse.parse_program(program[: spans[first_func].end], strict=True, quiet=True)
+    except SyntaxError:
+        return brewparse.parse_program(program)
+    ast.functions.extend(stubs)
+    return ast
+
+
+def validate(ast): # return list of the names of functions whose bodies don't parse
+    failed = []
+    for func_def in ast.functions:
+        if isinstance(func_def, FuncStub) and not func_def.is_parsed():
+            try:
+                func_def.statements
+            except SyntaxError:
+                failed.append(func_def.name)
+    return failed
+
+
+def _stub(program, span): # return FuncStub, or None if the header isn't one the regex understands
+    match = HEADER.fullmatch(program, span.start, span.body)
+    if match is None:
+        return None
+    name, arg_text, return_type = match.groups()
+    args = []
+    for arg in arg_text.split(",") if arg_text else []:
+        arg_name, _, var_type = (part.strip() for part in arg.partition(":"))
+        args.append(Arg(sys.intern(arg_name), sys.intern(var_type) if var_type else None))
+    names = [name, return_type] + [arg.name for arg in args] + [arg.var_type for arg in args]
+    if any(n in reserved_map for n in names if n is not None): # brewlex would make these keywords
+        return None
+    return FuncStub(program, span, sys.intern(name), args, return_type and sys.intern(return_type))
+
+
+# A function whose header has been parsed but whose body is parsed the first time a field
+# it doesn't have yet is read
+class FuncStub(LazyNode):
+    compile_hook = None  # called with the parsed FuncDef before its body is published
+
+    def __init__(self, program, span, name, args, return_type):
+        self.elem_type = InterpreterBase.FUNC_NODE
+        self.name = name
+        self.args = args
+        self.return_type = return_type
+        self.__source = (program, span)
+        self.__lock = threading.Lock()
+
+    def is_parsed(self): # return Bool
+        return "FIELDS" in self.__dict__
+
+    def _decode(self): # no return; the body may be read from several threads at once
+        with self.__lock:
+            if not self.is_parsed():
+                super()._decode()
+
+    def _read_fields(self): # return dict of the function's fields
+        program, span = self.__source
+        parsed = brewparse.parse_program(program[span.start : span.end], span.line, strict=True)
+        func_def = FuncDef(self.name, self.args, self.return_type, parsed.functions[0].statements)
+        if self.compile_hook is not None:
+            self.compile_hook(func_def)
+        del self.__source
+        return func_def.dict
@@ -0,0 +1,270 @@
+"""
+Common subexpression elimination for Brewin function bodies.
+
+Repeated pure expressions, such as the two a * b in a * b + a * b or repeated
+calls f(x) to a pure function, are bound once to a compiler temporary and every
+occurrence is replaced by a reference to it:
+
+    y = f(x) * 2 + f(x);         @cse0 := f(x);
+    print(f(x));           =>    y = @cse0 * 2 + @cse0;
+                                 print(@cse0);
+
+Like a variable assignment, binding a temporary (a DEF_NODE statement) creates a
+thunk: f(x) is still only evaluated if and when some occurrence needs it, and at
+most once for all of them. Errors and non-termination therefore happen exactly
+where they did before.
+
+An expression is pure if it only reads plain variables and literals, applies
+binary operators, and calls pure builtins (see brewbuiltins) or user functions
+that do nothing else either. Struct fields, arrays and maps are mutable and are
+never shared. Expressions under unary - and ! are left alone, since a thunk
+evaluates their operand in the current environment rather than its own.
+
+A temporary is defined right before the statement holding the first occurrence,
+and later occurrences share it while none of the expression's variables has
+been assigned or redefined. Sharing only pays for itself on expressions worth
+more than the assignment that creates the temporary; see MIN_SAVED_COST.
+"""
+
+from brewbuiltins import Builtin
+from element import NODE_CLASSES, Element, iter_elements
+from intbase import InterpreterBase
+
+DEF_NODE = "cse_def"  # TempDef: binds a temporary to a thunk
+REF_NODE = "cse_ref"  # TempRef: reads a temporary
+TEMP_PREFIX = "@cse"  # can't be written in Brewin, so temporaries never clash with user variables
+BIN_OPS = {"+", "-", "*", "/", "==", "!=", ">", ">=", "<", "<=", "||", "&&"}
+LITERAL_NODES = {
+    InterpreterBase.INT_NODE,
+    InterpreterBase.STRING_NODE,
+    InterpreterBase.BOOL_NODE,
+    InterpreterBase.NIL_NODE,
+}
+CALL_COST = 25  # estimated cost of a user function call, in expression nodes
+MIN_SAVED_COST = 20  # binding a temporary costs about as much as evaluating this many nodes
+
+
+class TempDef(Element):
+    __slots__ = FIELDS = ("name", "expression")
+
+    def __init__(self, name, expression):
+        self.elem_type = DEF_NODE
+        self.name = name
+        self.expression = expression
+
+
+class TempRef(Element):
+    __slots__ = FIELDS = ("name",)
+
+    def __init__(self, name):
+        self.elem_type = REF_NODE
+        self.name = name
+
+
+NODE_CLASSES[DEF_NODE] = TempDef
+NODE_CLASSES[REF_NODE] = TempRef
+
+
+def eliminate(ast): # return report dict
+    """Hoist repeated pure expressions in every function of ast into temporaries."""
+    return CommonSubexpressions(ast).eliminate()
+
+
+def pure_functions(ast): # return set of func_asts
+    """The functions of ast that (with everything they call) touch no mutable state and do no I/O."""
+    pure = set(ast.get("functions"))
+    changed = True
+    while changed:
+        changed = False
+        for func_ast in list(pure):
+            if not all(is_pure_node(node, pure) for node in iter_elements(func_ast.get("statements"))):
+                pure.discard(func_ast)
+                changed = True
+    return pure
+
+
+def is_pure_node(node, pure_funcs): # return Bool
+    kind = node.elem_type
+    if kind == InterpreterBase.NEW_NODE:
+        return False
+    if kind in (InterpreterBase.VAR_NODE, "="):
+        return not node.get("fields")
+    if kind == InterpreterBase.FCALL_NODE:
+        target = node.target
+        if isinstance(target, Builtin):
+            return target.pure
+        return target in pure_funcs
+    return True
+
+
+# The first occurrence of an expression that later occurrences may share
+class _Candidate:
+    def __init__(self, node, cost, block, statement, use):
+        self.node = node
+        self.cost = cost
+        self.block = block  # statement list the temporary is defined in
+        self.statement = statement  # statement of block the temporary goes before
+        self.uses = [use]  # (parent, key) of every occurrence
+        self.name = None  # the temporary, once hoisted
+
+    def worth_hoisting(self):
+        return (len(self.uses) - 1) * self.cost >= MIN_SAVED_COST
+
+
+class CommonSubexpressions:
+    def __init__(self, ast):
+        self.ast = ast
+        self.pure_funcs = pure_functions(ast)
+
+    def eliminate(self): # return report dict
+        hoisted = 0
+        shared = 0
+        for func_ast in self.ast.get("functions"):
+            self.candidates = []
+            self.__block(func_ast.get("statements"), {})
+            chosen = [candidate for candidate in self.candidates if candidate.worth_hoisting()]
+            for i, candidate in enumerate(chosen):
+                candidate.name = f"{TEMP_PREFIX}{i}"
+                self.__replace_uses(candidate)
+                shared += len(candidate.uses) - 1
+            for candidate in self.__definition_order(chosen):
+                self.__define(candidate)
+            hoisted += len(chosen)
+        return {"hoisted": hoisted, "shared_occurrences": shared}
+
+    # cost of evaluating expr_ast if it may be shared, else None
+    def __cost(self, expr_ast): # return int or None
+        kind = expr_ast.elem_type
+        if kind in LITERAL_NODES:
+            return 1
+        if kind == InterpreterBase.VAR_NODE:
+            return None if expr_ast.get("fields") else 1
+        if kind in BIN_OPS:
+            left = self.__cost(expr_ast.get("op1"))
+            right = self.__cost(expr_ast.get("op2"))
+            return None if left is None or right is None else 1 + left + right
+        if kind == InterpreterBase.FCALL_NODE and is_pure_node(expr_ast, self.pure_funcs):
+            cost = 1 if isinstance(expr_ast.target, Builtin) else CALL_COST
+            for arg in expr_ast.get("args"):
+                arg_cost = self.__cost(arg)
+                if arg_cost is None:
+                    return None
+                cost += arg_cost
+            return cost
+        return None
+
+    def __key(self, expr_ast): # return hashable structure of expr_ast
+        kind = expr_ast.elem_type
+        if kind in LITERAL_NODES:
+            return (kind, type(expr_ast.get("val")), expr_ast.get("val"))
+        if kind == InterpreterBase.VAR_NODE:
+            return (kind, expr_ast.get("name"))
+        if kind == InterpreterBase.FCALL_NODE:
+            return (kind, expr_ast.get("name")) + tuple(self.__key(arg) for arg in expr_ast.get("args"))
+        return (kind, self.__key(expr_ast.get("op1")), self.__key(expr_ast.get("op2")))
+
+    # available maps key -> _Candidate for the expressions whose first occurrence is still valid
+    def __block(self, statements, available): # no return
+        available = dict(available)
+        for statement in list(statements):
+            self.__statement(statement, statements, available)
+
+    def __statement(self, statement, block, available): # no return
+        kind = statement.elem_type
+        if kind == "=":
+            self.__expr(statement, "expression", block, statement, available)
+        elif kind == InterpreterBase.FCALL_NODE:
+            self.__args(statement, block, statement, available)
+        elif kind == InterpreterBase.RETURN_NODE:
+            if statement.get("expression") is not None:
+                self.__expr(statement, "expression", block, statement, available)
+        elif kind == InterpreterBase.RAISE_NODE:
+            self.__expr(statement, "exception_type", block, statement, available)
+        elif kind == InterpreterBase.IF_NODE:
+            self.__expr(statement, "condition", block, statement, available)
+            self.__block(statement.get("statements"), available)
+            if statement.get("else_statements") is not None:
+                self.__block(statement.get("else_statements"), available)
+        elif kind == InterpreterBase.FOR_NODE:
+            # the body runs again after everything the loop assigns, so those are never available inside
+            self.__kill(available, statement)
+            self.__block(statement.get("statements"), available)
+        elif kind == InterpreterBase.TRY_NODE:
+            self.__block(statement.get("statements"), available)
+            self.__kill(available, statement) # a catch block may start after any statement of the try
+            for catcher in statement.get("catchers"):
+                self.__block(catcher.get("statements"), available)
+        self.__kill(available, statement)
+
+    def __kill(self, available, statement): # no return
+        names = {
+            node.get("name")
+            for node in iter_elements(statement)
+            if node.elem_type in ("=", InterpreterBase.VAR_DEF_NODE) and not node.get("fields")
+        }
+        if not names:
+            return
+        for key, candidate in list(available.items()):
+            if any(
+                node.elem_type == InterpreterBase.VAR_NODE and node.get("name") in names
+                for node in iter_elements(candidate.node)
+            ):
+                del available[key]
+
+    def __args(self, call_ast, block, statement, available): # no return
+        args = call_ast.get("args")
+        for i in range(len(args)):
+            self.__expr(args, i, block, statement, available)
+
+    # visits the expression parent[key]; occurrences are recorded by where they sit so they can be replaced
+    def __expr(self, parent, key, block, statement, available): # no return
+        expr_ast = parent[key] if isinstance(parent, list) else parent.get(key)
+        kind = expr_ast.elem_type
+        if kind in (InterpreterBase.NEG_NODE, InterpreterBase.NOT_NODE):
+            return
+        cost = self.__cost(expr_ast) if kind in BIN_OPS or kind == InterpreterBase.FCALL_NODE else None
+        if cost is not None:
+            expr_key = self.__key(expr_ast)
+            candidate = available.get(expr_key)
+            if candidate is not None:
+                candidate.uses.append((parent, key))
+                return
+            candidate = _Candidate(expr_ast, cost, block, statement, (parent, key))
+            available[expr_key] = candidate
+            self.candidates.append(candidate)
+        if kind in BIN_OPS:
+            self.__expr(expr_ast, "op1", block, statement, available)
+            self.__expr(expr_ast, "op2", block, statement, available)
+        elif kind == InterpreterBase.FCALL_NODE:
+            self.__args(expr_ast, block, statement, available)
+
+    def __replace_uses(self, candidate): # no return
+        for parent, key in candidate.uses:
+            ref = TempRef(candidate.name)
+            if isinstance(parent, list):
+                parent[key] = ref
+            else:
+                setattr(parent, key, ref)
+
+    # a temporary whose expression reads another one has to be defined after it
+    def __definition_order(self, chosen): # return list of _Candidates
+        by_name = {candidate.name: candidate for candidate in chosen}
+        ordered = []
+        placed = set()
+
+        def place(candidate):
+            if candidate.name in placed:
+                return
+            placed.add(candidate.name)
+            for node in iter_elements(candidate.node):
+                if node.elem_type == REF_NODE:
+                    place(by_name[node.get("name")])
+            ordered.append(candidate)
+
+        for candidate in chosen:
+            place(candidate)
+        return ordered
+
+    def __define(self, candidate): # no return
+        index = next(i for i, s in enumerate(candidate.block) if s is candidate.statement)
+        candidate.block.insert(index, TempDef(candidate.name, candidate.node))
@@ -1,19 +1,66 @@
-class Element:
-    def __init__(self, elem_type, **kwargs):
-        self.elem_type = elem_type
-        self.dict = {}
-        for key, value in kwargs.items():
-            self.dict[key] = value
+"""
+AST nodes.
+
+Each kind of node has a class of its own that keeps its fields in __slots__, so
+the interpreter reads them as plain attributes (call_ast.args) rather than
+through a per-node dict. Element(elem_type, **fields) still builds any node: it
+picks the class registered for elem_type in NODE_CLASSES, and falls back to a
+GenericElement for node kinds (or sets of fields) no class describes. A LazyNode
+builds its fields the first time one is read.
+
+Every node has elem_type, FIELDS (its field names, in order) and get(key), which
+returns None for fields the node doesn't have. Besides its fields, a call node
+has the target the interpreter links it to, and binary operations, ifs and fors
+have the proven flag set by typecheck.
+"""
+
+from intbase import InterpreterBase
+
+BIN_OPS = ("+", "-", "*", "/", "==", "!=", ">", ">=", "<", "<=", "||", "&&")
+
+
+# Element(elem_type, **fields) builds the node class for elem_type; calling a node class builds that class
+class _NodeClass(type):
+    def __call__(cls, *args, **fields):
+        if cls is not Element:
+            return super().__call__(*args, **fields)
+        elem_type = args[0]
+        node_class = NODE_CLASSES.get(elem_type)
+        if node_class is None or fields.keys() != node_class.FIELD_SET:
+            return GenericElement(elem_type, fields)
+        node = node_class.__new__(node_class)
+        node.elem_type = elem_type
+        for key, value in fields.items():
+            setattr(node, key, value)
+        return node
+
+
+class Element(metaclass=_NodeClass):
+    __slots__ = ("elem_type",)
+    FIELDS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if isinstance(cls.FIELDS, tuple): # else the fields differ from node to node
+            cls.FIELD_SET = frozenset(cls.FIELDS)
 
     def get(self, key):
-        if key not in self.dict:
-            return None
-        return self.dict[key]
+        return getattr(self, key, None)
+
+    # a new dict of the fields; assign to an attribute to change one
+    @property
+    def dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+    # only the tree itself is pickled; what compiling attaches to nodes (call targets, type
+    # proofs) holds functions, and a Program rebuilds it anyway
+    def __reduce__(self):
+        return (_rebuild, (self.elem_type, self.dict))
 
     def __str__(self):
         s = f"{self.elem_type}: "
-        for key, value in self.dict.items():
-            s += key + ": " + self.__val(value) + ", "
+        for key in self.FIELDS:
+            s += key + ": " + self.__val(getattr(self, key)) + ", "
         return s[0:-2]
 
     def __val(self, v):
@@ -27,3 +74,271 @@ class Element:
                 return "[" + s[0:-2] + "]"
             return "[" + s + "]"
         return str(v)
+
+
+def _rebuild(elem_type, fields):
+    return Element(elem_type, **fields)
+
+
+# A node kind without a class of its own; its fields are ordinary attributes
+class GenericElement(Element):
+    def __init__(self, elem_type, fields):
+        self.elem_type = elem_type
+        self.FIELDS = tuple(fields)
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+
+# Class attribute of LazyNode that decodes the node on first read; the decoded value then
+# shadows it, since it only has __get__
+class _Decoding:
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, node, owner=None):
+        if node is None:
+            return self
+        node._decode()
+        return node.__dict__[self.name]
+
+
+# A node whose fields are only built when one of them is first read, e.g. from a file (binast)
+# or from columns (ast_columns); after that they are ordinary attributes. Subclasses set
+# elem_type and provide _read_fields.
+class LazyNode(Element):
+    FIELDS = _Decoding()
+
+    def __getattr__(self, name): # only called for attributes that aren't set yet
+        if "FIELDS" in self.__dict__:
+            raise AttributeError(name)
+        self._decode()
+        return getattr(self, name)
+
+    def _decode(self): # no return
+        fields = self._read_fields()
+        self.__dict__.update(fields)
+        self.FIELDS = tuple(fields)
+
+
+class Program(Element):
+    __slots__ = FIELDS = ("structs", "functions")
+
+    def __init__(self, structs, functions):
+        self.elem_type = InterpreterBase.PROGRAM_NODE
+        self.structs = structs
+        self.functions = functions
+
+
+class StructDef(Element):
+    __slots__ = FIELDS = ("name", "fields")
+
+    def __init__(self, name, fields):
+        self.elem_type = InterpreterBase.STRUCT_NODE
+        self.name = name
+        self.fields = fields
+
+
+class FieldDef(Element):
+    __slots__ = FIELDS = ("name", "var_type")
+
+    def __init__(self, name, var_type):
+        self.elem_type = InterpreterBase.FIELD_DEF_NODE
+        self.name = name
+        self.var_type = var_type
+
+
+class FuncDef(Element):
+    __slots__ = FIELDS = ("name", "args", "return_type", "statements")
+
+    def __init__(self, name, args, return_type, statements):
+        self.elem_type = InterpreterBase.FUNC_NODE
+        self.name = name
+        self.args = args
+        self.return_type = return_type
+        self.statements = statements
+
+
+class Arg(Element):
+    __slots__ = FIELDS = ("name", "var_type")
+
+    def __init__(self, name, var_type):
+        self.elem_type = InterpreterBase.ARG_NODE
+        self.name = name
+        self.var_type = var_type
+
+
+class Assign(Element):
+    __slots__ = FIELDS = ("name", "fields", "expression")
+
+    def __init__(self, name, fields, expression):
+        self.elem_type = "="
+        self.name = name
+        self.fields = fields  # tuple of field names after the variable, as in s.a.b = ...
+        self.expression = expression
+
+
+class VarDef(Element):
+    __slots__ = FIELDS = ("name", "var_type")
+
+    def __init__(self, name, var_type):
+        self.elem_type = InterpreterBase.VAR_DEF_NODE
+        self.name = name
+        self.var_type = var_type
+
+
+class If(Element):
+    FIELDS = ("condition", "statements", "else_statements")
+    __slots__ = FIELDS + ("proven",)
+
+    def __init__(self, condition, statements, else_statements):
+        self.elem_type = InterpreterBase.IF_NODE
+        self.condition = condition
+        self.statements = statements
+        self.else_statements = else_statements
+
+
+class Try(Element):
+    __slots__ = FIELDS = ("statements", "catchers")
+
+    def __init__(self, statements, catchers):
+        self.elem_type = InterpreterBase.TRY_NODE
+        self.statements = statements
+        self.catchers = catchers
+
+
+class Catch(Element):
+    __slots__ = FIELDS = ("exception_type", "statements")
+
+    def __init__(self, exception_type, statements):
+        self.elem_type = InterpreterBase.CATCH_NODE
+        self.exception_type = exception_type
+        self.statements = statements
+
+
+class For(Element):
+    FIELDS = ("init", "condition", "update", "statements")
+    __slots__ = FIELDS + ("proven",)
+
+    def __init__(self, init, condition, update, statements):
+        self.elem_type = InterpreterBase.FOR_NODE
+        self.init = init
+        self.condition = condition
+        self.update = update
+        self.statements = statements
+
+
+class Raise(Element):
+    __slots__ = FIELDS = ("exception_type",)
+
+    def __init__(self, exception_type):
+        self.elem_type = InterpreterBase.RAISE_NODE
+        self.exception_type = exception_type
+
+
+class Return(Element):
+    __slots__ = FIELDS = ("expression",)
+
+    def __init__(self, expression):
+        self.elem_type = InterpreterBase.RETURN_NODE
+        self.expression = expression
+
+
+class New(Element):
+    __slots__ = FIELDS = ("var_type",)
+
+    def __init__(self, var_type):
+        self.elem_type = InterpreterBase.NEW_NODE
+        self.var_type = var_type
+
+
+class BinOp(Element):
+    FIELDS = ("op1", "op2")
+    __slots__ = FIELDS + ("proven",)
+
+    def __init__(self, op, op1, op2):
+        self.elem_type = op
+        self.op1 = op1
+        self.op2 = op2
+
+
+class UnaryOp(Element):
+    __slots__ = FIELDS = ("op1",)
+
+    def __init__(self, op, op1):
+        self.elem_type = op  # InterpreterBase.NEG_NODE or NOT_NODE
+        self.op1 = op1
+
+
+class Literal(Element):
+    __slots__ = FIELDS = ("val",)
+
+    def __init__(self, kind, val):
+        self.elem_type = kind  # InterpreterBase.INT_NODE, STRING_NODE or BOOL_NODE
+        self.val = val
+
+
+class Nil(Element):
+    __slots__ = ()
+
+    def __init__(self):
+        self.elem_type = InterpreterBase.NIL_NODE
+
+
+class VarRef(Element):
+    __slots__ = FIELDS = ("name", "fields")
+
+    def __init__(self, name, fields):
+        self.elem_type = InterpreterBase.VAR_NODE
+        self.name = name
+        self.fields = fields  # tuple of field names after the variable, as in s.a.b
+
+
+class Call(Element):
+    FIELDS = ("name", "args")
+    __slots__ = FIELDS + ("target",)
+
+    def __init__(self, name, args):
+        self.elem_type = InterpreterBase.FCALL_NODE
+        self.name = name
+        self.args = args
+
+
+NODE_CLASSES = {  # elem_type -> class of its nodes; modules that add node kinds register them here
+    InterpreterBase.PROGRAM_NODE: Program,
+    InterpreterBase.STRUCT_NODE: StructDef,
+    InterpreterBase.FIELD_DEF_NODE: FieldDef,
+    InterpreterBase.FUNC_NODE: FuncDef,
+    InterpreterBase.ARG_NODE: Arg,
+    "=": Assign,
+    InterpreterBase.VAR_DEF_NODE: VarDef,
+    InterpreterBase.IF_NODE: If,
+    InterpreterBase.TRY_NODE: Try,
+    InterpreterBase.CATCH_NODE: Catch,
+    InterpreterBase.FOR_NODE: For,
+    InterpreterBase.RAISE_NODE: Raise,
+    InterpreterBase.RETURN_NODE: Return,
+    InterpreterBase.NEW_NODE: New,
+    InterpreterBase.NEG_NODE: UnaryOp,
+    InterpreterBase.NOT_NODE: UnaryOp,
+    InterpreterBase.INT_NODE: Literal,
+    InterpreterBase.STRING_NODE: Literal,
+    InterpreterBase.BOOL_NODE: Literal,
+    InterpreterBase.NIL_NODE: Nil,
+    InterpreterBase.VAR_NODE: VarRef,
+    InterpreterBase.FCALL_NODE: Call,
+}
+for op in BIN_OPS:
+    NODE_CLASSES[op] = BinOp
+
+
+# yield every Element in the tree rooted at node (which may also be a list of nodes)
+def iter_elements(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, Element):
+            yield node
+            for key in node.FIELDS:
+                stack.append(getattr(node, key))
@@ -0,0 +1,122 @@
+"""
+Incremental reparsing of edited Brewin programs.
+
+    parser = IncrementalParser(source)
+    ast = parser.edit(start, end, text)   # after source[start:end] is replaced by text
+
+An edit only rescans (see brewscan.scan) the top-level definitions it touches,
+along with the whitespace and comments around them, and reparses just the
+structs and functions found there.
+The new Program node reuses every other StructDef and FuncDef of the previous
+tree as is, so anything keyed on their identity (a cache per function, say)
+survives the edit. Definitions after the edit keep their line numbers in
+syntax errors, as their spans are shifted along with the text.
+
+The region starts right after a definition and ends right before one, so no
+comment or string of the old text crosses its ends. A region with an unclosed
+comment isn't scanned, and its definitions are parsed strictly, on their own,
+so a string running past its end is an error there. Whenever the region can't
+be handled on its own (it doesn't split into definitions, a struct ends up
+after a func, or a definition doesn't parse cleanly), the whole program is
+parsed instead, so the result is always the tree brewparse gives, syntax
+errors included.
+
+An edit that leaves a syntax error raises SyntaxError; the text is still
+updated, and the next edit parses the whole program again. Compiling annotates the nodes of a tree (see
+interpreterv4.Program), so only the latest tree should be compiled and run.
+"""
+
+from bisect import bisect_left, bisect_right
+
+from brewparse import BrewinParser
+from brewscan import scan
+from element import Element
+from intbase import InterpreterBase
+
+STRUCT_SUFFIX = "\nfunc main() { return; }"  # a program needs a function, so a lone struct is parsed with this
+
+
+class IncrementalParser:
+    def __init__(self, source):
+        self.source = source
+        self.ast = None
+        self.spans = None  # brewscan.Spans of the top-level definitions; None to parse everything next edit
+        self.nodes = None  # the StructDef or FuncDef of each span
+        self.stats = {"edits": 0, "reparsed_definitions": 0, "full_parses": 0}
+        self.parser = BrewinParser()
+        self.__parse_all()
+
+    def edit(self, start, end, text): # return program Element for the edited source
+        old = self.source
+        self.source = old[:start] + text + old[end:]
+        self.stats["edits"] += 1
+        if self.spans is None:
+            return self.__parse_all()
+        first, last, region_start, region_end, line = self.__region(old, start, end)
+        delta = len(text) - (end - start)
+        spans = scan(self.source, region_start, region_end + delta, line)
+        if spans is None or not self.__fits(first, last, spans):
+            return self.__parse_all()
+        try:
+            nodes = [self.__parse(span) for span in spans]
+        except SyntaxError:
+            return self.__parse_all()
+        self.stats["reparsed_definitions"] += len(nodes)
+        replaced_structs = sum(span.kind == "struct" for span in self.spans[first:last])
+        structs = len(self.ast.structs) - replaced_structs + sum(span.kind == "struct" for span in spans)
+        line_delta = text.count("\n") - old.count("\n", start, end)
+        for span in self.spans[last:]:
+            span.start += delta
+            span.body += delta
+            span.end += delta
+            span.line += line_delta
+        self.spans[first:last] = spans
+        self.nodes[first:last] = nodes
+        self.ast = Element(
+            InterpreterBase.PROGRAM_NODE, structs=self.nodes[:structs], functions=self.nodes[structs:]
+        )
+        return self.ast
+
+    # the spans [first, last) that old[start:end] overlaps, and the region of old from the end of
+    # the definition before them to the start of the one after them
+    def __region(self, old, start, end): # return (first, last, region_start, region_end, line of region_start)
+        first = bisect_right(self.spans, start, key=lambda span: span.end)
+        last = max(first, bisect_left(self.spans, end, key=lambda span: span.start))
+        if first == 0:
+            region_start, line = 0, 1
+        else:
+            previous = self.spans[first - 1]
+            region_start = previous.end
+            line = previous.line + old.count("\n", previous.start, region_start)
+        region_end = self.spans[last].start if last < len(self.spans) else len(old)
+        return first, last, region_start, region_end, line
+
+    # whether spans can replace [first, last) and keep every struct before every func, and a func last
+    def __fits(self, first, last, spans): # return Bool
+        kinds = [span.kind for span in spans]
+        if first > 0:
+            kinds.insert(0, self.spans[first - 1].kind)
+        if last < len(self.spans):
+            kinds.append(self.spans[last].kind)
+        elif not kinds or kinds[-1] != "func":
+            return False
+        return kinds == sorted(kinds, key=lambda kind: kind == "func")
+
+    # quiet, since a definition that doesn't parse is reported by the whole-program parse instead
+    def __parse(self, span): # return StructDef or FuncDef
+        text = self.source[span.start : span.end]
+        if span.kind == "struct":
+            return self.parser.parse(text + STRUCT_SUFFIX, span.line, strict=True, quiet=True).structs[0]
+        return self.parser.parse(text, span.line, strict=True, quiet=True).functions[0]
+
+    def __parse_all(self): # return program Element
+        self.spans = self.nodes = None
+        self.stats["full_parses"] += 1
+        self.ast = self.parser.parse(self.source)
+        spans = scan(self.source)
+        # the grammar puts the structs first, so they line up with the spans; a tree ply
+        # recovered from an error only holds what came after it
+        if spans is not None and not self.parser.lexer.syntax_errors:
+            self.spans = spans
+            self.nodes = self.ast.structs + self.ast.functions
+        return self.ast
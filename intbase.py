@@ -49,6 +49,7 @@ class InterpreterBase:
     def reset(self):
         self.output_log = []
         self.input_cursor = 0
+        self.input_reads = 0  # number of get_input calls, including ones past the end of inp
         self.error_type = None
         self.error_line = None
 
@@ -57,6 +58,7 @@ class InterpreterBase:
         pass
 
     def get_input(self):
+        self.input_reads += 1
         if not self.inp:
             return input()  # Get input from keyboard if not input list provided
 
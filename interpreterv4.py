@@ -1,12 +1,31 @@
 # document that we won't have a return inside the init/update of a for loop
 
 import copy
+import operator
 from enum import Enum
 
-from brewparse import parse_program
+import ast_cache
+import brewbuiltins
+import brewscan
+import cse
+import lanes
+import loop_vectorizer
+import speculate
+import typecheck
+from element import Element, iter_elements
 from env_v2 import EnvironmentManager
 from intbase import InterpreterBase, ErrorType
-from type_valuev2 import Type, Value, create_value, get_printable, Thunk, UserException
+from type_valuev2 import (
+    Type, Value, create_value, get_printable, Thunk, UserException, StructLayout, Struct
+)
+
+
+COUNTED_FOR_OPS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+# what Interpreter.run_steps pauses with
+SLICE = "slice"
+INPUT = "input"
+OUTPUT = "output"
 
 
 class ExecStatus(Enum):
@@ -14,7 +33,162 @@ class ExecStatus(Enum):
     RETURN = 2
 
 
-# Main interpreter class
+# Output of one program run; exception is whatever the run raised, error_type is set for Brewin errors
+class RunResult:
+    def __init__(self, output, error_type=None, exception=None):
+        self.output = output
+        self.error_type = error_type
+        self.exception = exception
+
+
+# Raised by get_input to abandon a builtin until input is fed; Brewin code can only catch UserExceptions
+class _InputWait(Exception):
+    pass
+
+
+# Raised by __eval_now at a thunk it can't force, as its expression has a call
+class _Blocked(Exception):
+    def __init__(self, thunk_obj):
+        super().__init__()
+        self.thunk_obj = thunk_obj
+
+
+# Target of a call that doesn't resolve to any function; the error is only raised if the call runs
+class UnresolvedCall:
+    def __init__(self, message):
+        self.message = message
+
+
+# A parsed program plus everything derived from its AST that can be shared between runs
+class Program:
+    def __init__(self, ast, builtins, op_to_lambda, eliminate_subexpressions=True):
+        self.ast = ast
+        self.builtins = builtins
+        self.op_to_lambda = op_to_lambda
+        self.eliminate_subexpressions = eliminate_subexpressions
+        self.func_name_to_ast = {}
+        parsed_funcs = []
+        for func_def in ast.get("functions"):
+            func_name = func_def.get("name")
+            num_params = len(func_def.get("args"))
+            if func_name not in self.func_name_to_ast:
+                self.func_name_to_ast[func_name] = {}
+            self.func_name_to_ast[func_name][num_params] = func_def
+            if isinstance(func_def, brewscan.FuncStub) and not func_def.is_parsed():
+                func_def.compile_hook = self.__compile_function # compiled once its body is parsed
+            else:
+                parsed_funcs.append(func_def)
+        self.struct_layouts = {} # struct name -> StructLayout
+        for struct_def in ast.get("structs"):
+            self.struct_layouts[struct_def.get("name")] = StructLayout(struct_def)
+        self.cse_report = {"hoisted": 0, "shared_occurrences": 0}
+        self.type_report = {"operations": 0, "proven": 0, "percent_proven": 100.0, "mismatches": []}
+        if len(parsed_funcs) < len(ast.get("functions")):
+            ast = Element(InterpreterBase.PROGRAM_NODE, structs=ast.get("structs"), functions=parsed_funcs)
+        self.__compile(ast)
+        self.counted_fors = {} # for_ast -> (var_name, step) or None
+        self.loop_plans = {} # for_ast -> loop_vectorizer.LoopPlan or None
+        self.has_calls = {} # expression node -> whether it has a call in it
+
+    # recognizes for (i = a; i < b; i = i + c) where c is an int literal and the body never assigns i
+    def counted_for(self, for_ast): # return (var_name, step) or None
+        if for_ast in self.counted_fors:
+            return self.counted_fors[for_ast]
+        counted = None
+        var_name = for_ast.get("init").get("name")
+        cond_ast = for_ast.get("condition")
+        update_ast = for_ast.get("update")
+        update_expr = update_ast.get("expression")
+        if (
+            cond_ast.elem_type in COUNTED_FOR_OPS
+            and cond_ast.get("op1").elem_type == InterpreterBase.VAR_NODE
+            and cond_ast.get("op1").get("name") == var_name
+            and not cond_ast.get("op1").get("fields")
+            and not for_ast.get("init").get("fields")
+            and update_ast.get("name") == var_name
+            and not update_ast.get("fields")
+            and update_expr.elem_type in ("+", "-")
+            and update_expr.get("op1").elem_type == InterpreterBase.VAR_NODE
+            and update_expr.get("op1").get("name") == var_name
+            and not update_expr.get("op1").get("fields")
+            and update_expr.get("op2").elem_type == InterpreterBase.INT_NODE
+            and not self.__assigns_var(for_ast.get("statements"), var_name)
+        ):
+            step = update_expr.get("op2").get("val")
+            counted = (var_name, step if update_expr.elem_type == "+" else -step)
+        self.counted_fors[for_ast] = counted
+        return counted
+
+    def __assigns_var(self, statements, var_name): # return Bool
+        for statement in statements or []:
+            if statement.elem_type == "=" and statement.get("name") == var_name:
+                return True
+            if statement.elem_type == InterpreterBase.FOR_NODE:
+                if self.__assigns_var([statement.get("init"), statement.get("update")], var_name):
+                    return True
+            if statement.elem_type == InterpreterBase.TRY_NODE:
+                for catcher in statement.get("catchers"):
+                    if self.__assigns_var(catcher.get("statements"), var_name):
+                        return True
+            if self.__assigns_var(statement.get("statements"), var_name):
+                return True
+            if self.__assigns_var(statement.get("else_statements"), var_name):
+                return True
+        return False
+
+    # the passes over the functions of ast; calls to functions outside it are treated as
+    # calls to unknown (impure, untyped) ones
+    def __compile(self, ast): # no return
+        self.__link_calls(ast)
+        # needs the calls linked to tell pure functions apart, and runs before the type checker so
+        # it sees the temporaries
+        if self.eliminate_subexpressions:
+            for key, count in cse.eliminate(ast).items():
+                self.cse_report[key] += count
+        # marks the operations whose type checks can be skipped; needs the calls linked first
+        report = typecheck.check_program(ast, self.op_to_lambda, self.struct_layouts)
+        self.type_report["operations"] += report["operations"]
+        self.type_report["proven"] += report["proven"]
+        operations = self.type_report["operations"]
+        self.type_report["percent_proven"] = (
+            round(100 * self.type_report["proven"] / operations, 1) if operations else 100.0
+        )
+        self.type_report["mismatches"] = sorted(set(self.type_report["mismatches"] + report["mismatches"]))
+
+    # a function brewscan parses only when it is first called
+    def __compile_function(self, func_def): # no return
+        self.__compile(Element(InterpreterBase.PROGRAM_NODE, structs=self.ast.get("structs"), functions=[func_def]))
+
+    # attach to every fcall node the function it calls: the func_ast of a user function, a
+    # brewbuiltins.Builtin, or an UnresolvedCall
+    def __link_calls(self, ast): # no return
+        for node in iter_elements(ast):
+            if node.elem_type != InterpreterBase.FCALL_NODE:
+                continue
+            func_name = node.get("name")
+            num_params = len(node.get("args"))
+            candidate_funcs = self.func_name_to_ast.get(func_name)
+            if func_name in brewbuiltins.RESERVED or candidate_funcs is None or num_params not in candidate_funcs:
+                target = self.builtins.lookup(func_name, num_params)
+            else:
+                target = candidate_funcs[num_params]
+            if target is None:
+                if candidate_funcs is None:
+                    target = UnresolvedCall(f"Function {func_name} not found")
+                else:
+                    target = UnresolvedCall(f"Function {func_name} taking {num_params} params not found")
+            node.target = target
+
+
+# Main interpreter class.
+#
+# The methods that run Brewin code are generators, so a run can pause at any statement: a pause is
+# a yield that passes up through every yield from to whoever drives the run, and a paused run is
+# nothing but a suspended generator (see scheduler). run, run_many and call_function drive them to
+# the end without pausing. Expressions without calls can't pause, so __eval_now evaluates them by
+# plain recursion; when one needs a thunk whose expression has a call, it stops before that thunk,
+# the thunk is forced as a generator, and the expression is evaluated again. What it already forced
+# is memoized, so it picks up where it stopped.
 class Interpreter(InterpreterBase):
     # constants
     NIL_VALUE = create_value(InterpreterBase.NIL_DEF)
@@ -22,30 +196,243 @@ class Interpreter(InterpreterBase):
     BIN_OPS = {"+", "-", "*", "/", "==", "!=", ">", ">=", "<", "<=", "||", "&&"}
 
     # methods
-    def __init__(self, console_output=True, inp=None, trace_output=False):
+    def __init__(
+        self,
+        console_output=True,
+        inp=None,
+        trace_output=False,
+        vectorize_loops=False,
+        builtins=None,
+        eliminate_subexpressions=True,
+        parallel_workers=None,
+        ast_cache=None,
+        lazy_functions=False,
+        slice_steps=None,
+        wait_for_input=False,
+        pause_on_output=False,
+    ):
         super().__init__(console_output, inp)
+        # native functions callable from Brewin; extend before compiling a program
+        self.builtins = builtins if builtins is not None else brewbuiltins.default_registry()
         self.trace_output = trace_output
+        self.vectorize_loops = vectorize_loops # evaluate pure arithmetic for loops without running their body
+        self.eliminate_subexpressions = eliminate_subexpressions # share repeated pure expressions, see cse
+        self.parallel_workers = parallel_workers # run independent pure calls in this many processes, see speculate
+        self.speculator = None
+        self.ast_cache = ast_cache # an ast_cache.AstCache compile parses through; else BREWIN_AST_CACHE's, if set
+        self.lazy_functions = lazy_functions # compile parses function bodies when first called, see brewscan
+        # how run_steps pauses: with (SLICE,) every slice_steps statements, with (INPUT,) when a
+        # builtin reads input that hasn't been appended to inp yet, and with (OUTPUT, text) for
+        # each line a builtin prints
+        self.slice_steps = slice_steps
+        self.wait_for_input = wait_for_input
+        self.pause_on_output = pause_on_output
+        self.input_closed = False # set once no more input will be appended to inp
+        self.pause_stats = {"steps": 0, "slices": 0, "input_waits": 0} # over all run_steps runs
+        self.__resumable = False # set while run_steps runs; such a run never reads the keyboard
+        self.__slicing = False # set while a run_steps run pauses every slice_steps statements
+        self.__eager = 0 # nesting of __finish; nothing pauses while it's positive
+        self.__slice_left = slice_steps
+        self.__paused_lines = 0 # lines of output_log the run has paused with
+        self.__replayed = 0 # lines a builtin called again after an input wait has yet to print a second time
+        self.__just_forced = None # thunk __eval forced before evaluating an expression again
         self.__setup_ops()
 
     def run(self, program):
+        self.run_program(self.compile(program))
+
+    # parses a program once so it can be run many times
+    def compile(self, program): # return Program
+        if self.lazy_functions:
+            return self.compile_ast(brewscan.parse_program(program))
+        if self.ast_cache is not None:
+            return self.compile_ast(self.ast_cache.parse(program))
+        return self.compile_ast(ast_cache.parse_program(program))
+
+    # for program ASTs built or rewritten by host code, e.g. partial_eval
+    def compile_ast(self, ast): # return Program
+        return Program(ast, self.builtins, self.op_to_lambda, self.eliminate_subexpressions)
+
+    def run_program(self, compiled):
+        self.__prepare(compiled)
+        self.__execute()
+
+    # runs a compiled program once, pausing as slice_steps, wait_for_input and pause_on_output ask
+    def run_steps(self, compiled): # generator of pause requests; returns RunResult
+        self.__prepare(compiled)
+        exception = None
+        try:
+            self.__start_run()
+            self.__resumable = True
+            self.__slicing = self.slice_steps is not None
+            self.__slice_left = self.slice_steps
+            self.__paused_lines = 0
+            yield from self.__run_main()
+        except Exception as e:
+            exception = e
+        finally:
+            self.__resumable = False
+            self.__slicing = False
+        return RunResult(list(self.output_log), self.error_type, exception)
+
+    # runs a program (source text or a compiled Program) against each input vector in turn,
+    # yielding a RunResult per run; parsing and the function table are only done once
+    def run_many(self, program, inputs_iter):
+        compiled = program if isinstance(program, Program) else self.compile(program)
+        self.__prepare(compiled)
+        for inp in inputs_iter:
+            self.reset()
+            self.inp = list(inp)
+            yield self.__execute_to_result()
+
+    # runs one program over many input vectors, returning a RunResult per lane.
+    # lanes runs every lane it can in one pass (see lanes); each lane it drops is run here on its
+    # own, and as the program is deterministic, lanes whose inputs agree on every value that run
+    # actually read share its result instead of being executed again
+    def run_lanes(self, program, lane_inputs):
+        compiled = program if isinstance(program, Program) else self.compile(program)
+        self.__prepare(compiled)
+        lane_inputs = [list(inp) for inp in lane_inputs]
+        results = [None] * len(lane_inputs)
+        if lane_inputs and lanes.supports(compiled):
+            for lane, output in enumerate(lanes.run(compiled, lane_inputs)):
+                if output is not None:
+                    results[lane] = RunResult(output)
+        together = len(results) - results.count(None)
+        alone = 0
+        runs_by_reads = {} # number of inputs a run read -> {those inputs: its RunResult}
+        self.__start_run()
+        for lane, inp in enumerate(lane_inputs):
+            if results[lane] is not None:
+                continue
+            result = self.__shared_result(runs_by_reads, inp)
+            if result is None:
+                self.reset()
+                self.inp = inp
+                result = self.__execute_to_result()
+                alone += 1
+                if inp or self.input_reads == 0: # empty input lists read from the keyboard
+                    runs_by_reads.setdefault(self.input_reads, {})[tuple(inp[: self.input_reads])] = result
+            results[lane] = RunResult(list(result.output), result.error_type, result.exception)
+        self.stats["lanes"] = {"lanes": len(results), "together": together, "alone": alone}
+        return results
+
+    def __shared_result(self, runs_by_reads, inp): # return RunResult of a run that read what inp holds, or None
+        if not inp:
+            return runs_by_reads.get(0, {}).get(())
+        for reads, runs in runs_by_reads.items():
+            result = runs.get(tuple(inp[:reads]))
+            if result is not None:
+                return result
+        return None
+
+    def __prepare(self, compiled):
+        self.func_name_to_ast = compiled.func_name_to_ast
+        self.struct_layouts = compiled.struct_layouts
+        self.counted_for = compiled.counted_for
+        self.loop_plans = compiled.loop_plans
+        self.type_report = compiled.type_report
+        self.cse_report = compiled.cse_report
+        self.has_calls = compiled.has_calls
+        if self.parallel_workers and (self.speculator is None or self.speculator.program is not compiled):
+            self.close()
+            self.speculator = speculate.Speculator(compiled, self.parallel_workers)
+
+    # shuts down the worker processes of parallel_workers, if any were started
+    def close(self):
+        if self.speculator is not None:
+            self.speculator.close()
+            self.speculator = None
+
+    # calls one function of a compiled program on argument values, e.g. in a speculate worker
+    def call_function(self, compiled, func_name, args): # return Value object
+        self.__prepare(compiled)
+        self.reset()
+        self.__start_run()
+        literal_nodes = {
+            Type.INT: InterpreterBase.INT_NODE,
+            Type.BOOL: InterpreterBase.BOOL_NODE,
+            Type.STRING: InterpreterBase.STRING_NODE,
+            Type.NIL: InterpreterBase.NIL_NODE,
+        }
+        arg_asts = [Element(literal_nodes[arg.type()], val=arg.value()) for arg in args]
+        return self.__finish(self.__call_user_func(self.__get_func_by_name(func_name, len(args)), arg_asts, None))
+
+    def __start_run(self):
+        self.stats = {
+            "vectorized_loops": [],
+            "types": self.type_report,
+            "cse": dict(self.cse_report, eliminated_evaluations=0),
+        }
+        if self.speculator is not None:
+            self.stats["speculation"] = self.speculator.new_run()
+        self.env = EnvironmentManager()
+
+    def __execute(self):
+        self.__start_run()
+        self.__finish(self.__run_main())
+
+    def __run_main(self): # no return
         try:
-            ast = parse_program(program)
-            self.__set_up_function_table(ast)
-            self.env = EnvironmentManager()
-            self.__call_func_aux("main", [])
+            yield from self.__call_user_func(self.__get_func_by_name("main", 0), [], None)
         except UserException as e:
             self.error(ErrorType.FAULT_ERROR, f"Unhandled user-defined exception: {str(e)}")
+
+    def __execute_to_result(self): # return RunResult
+        exception = None
+        try:
+            self.__execute()
         except Exception as e:
-            raise # re-raise the exception for regular errors
+            exception = e
+        return RunResult(list(self.output_log), self.error_type, exception)
 
-    def __set_up_function_table(self, ast):
-        self.func_name_to_ast = {}
-        for func_def in ast.get("functions"):
-            func_name = func_def.get("name")
-            num_params = len(func_def.get("args"))
-            if func_name not in self.func_name_to_ast:
-                self.func_name_to_ast[func_name] = {}
-            self.func_name_to_ast[func_name][num_params] = func_def
+    def get_stats(self):
+        return self.stats
+
+    # past the end of inp, a run_steps run pauses until more input is appended (with
+    # wait_for_input) or reads nil, rather than reading the keyboard
+    def get_input(self): # return str, or None past the end of input
+        if not self.__resumable:
+            return super().get_input()
+        if self.input_cursor == len(self.inp):
+            if self.wait_for_input and not self.input_closed and not self.__eager:
+                raise _InputWait()
+            self.input_reads += 1
+            return None
+        self.input_reads += 1
+        self.input_cursor += 1
+        return self.inp[self.input_cursor - 1]
+
+    def output(self, v):
+        if self.__replayed:
+            self.__replayed -= 1
+            return
+        super().output(v)
+
+    # runs steps to the end without pausing, for runs that aren't run_steps and for code called
+    # from Python rather than the evaluator
+    def __finish(self, steps): # return the value of the generator steps
+        self.__eager += 1
+        try:
+            while True:
+                next(steps) # nothing pauses while eager, so this runs steps to its end
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            self.__eager -= 1
+
+    def __pause_for_output(self): # no return
+        while not self.__eager and self.__paused_lines < len(self.output_log):
+            self.__paused_lines += 1
+            yield (OUTPUT, self.output_log[self.__paused_lines - 1])
+
+    def __step(self): # no return; pauses once a slice's steps are used up
+        self.pause_stats["steps"] += 1
+        self.__slice_left -= 1
+        if self.__slice_left <= 0 and not self.__eager:
+            self.__slice_left = self.slice_steps
+            self.pause_stats["slices"] += 1
+            yield (SLICE,)
 
     def __get_func_by_name(self, name, num_params):
         if name not in self.func_name_to_ast:
@@ -63,198 +450,375 @@ class Interpreter(InterpreterBase):
         for statement in statements:
             if self.trace_output:
                 print(statement)
-            status, return_val = self.__run_statement(statement)
+            if not self.__slicing and self.__run_quick(statement):
+                continue
+            status, return_val = yield from self.__run_statement(statement)
             if status == ExecStatus.RETURN:
                 self.env.pop_block()
                 return (status, return_val)
         self.env.pop_block()
         return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
 
+    # runs a statement that can't pause without a generator; return Bool, whether it was one
+    def __run_quick(self, statement):
+        if statement.elem_type == "=" and not statement.fields:
+            self.__assign(statement)
+        elif statement.elem_type == InterpreterBase.VAR_DEF_NODE:
+            self.__var_def(statement)
+        elif statement.elem_type == cse.DEF_NODE:
+            self.__define_temp(statement)
+        elif statement.elem_type == InterpreterBase.FCALL_NODE and isinstance(statement.target, brewbuiltins.Builtin):
+            return self.__call_builtin_quick(statement.target, statement.args)
+        else:
+            return False
+        return True
+
+    # unless slicing, callers try __run_quick first
     def __run_statement(self, statement): # return (status, return_val) of a func
         status = ExecStatus.CONTINUE
         return_val = None
+        if self.__slicing:
+            yield from self.__step()
+            if self.__run_quick(statement):
+                return (status, return_val)
         if statement.elem_type == InterpreterBase.FCALL_NODE:
-            self.__call_func(statement)
+            yield from self.__call_func(statement, None)
         elif statement.elem_type == "=":
-            self.__assign(statement)
-        elif statement.elem_type == InterpreterBase.VAR_DEF_NODE:
-            self.__var_def(statement)
+            yield from self.__assign_field(statement.name, statement.fields, statement.expression)
         elif statement.elem_type == InterpreterBase.RETURN_NODE:
-            status, return_val = self.__do_return(statement)
+            status, return_val = yield from self.__do_return(statement)
         elif statement.elem_type == Interpreter.IF_NODE:
-            status, return_val = self.__do_if(statement)
+            status, return_val = yield from self.__do_if(statement)
         elif statement.elem_type == Interpreter.FOR_NODE:
-            status, return_val = self.__do_for(statement)
+            status, return_val = yield from self.__do_for(statement)
         elif statement.elem_type == InterpreterBase.RAISE_NODE:
-            self.__handle_raise(statement)
+            yield from self.__handle_raise(statement)
         elif statement.elem_type == InterpreterBase.TRY_NODE:
-            return self.__handle_try(statement)
+            return (yield from self.__handle_try(statement))
         return (status, return_val)
-    
-    def __call_func(self, call_node): # return return_val
-        func_name = call_node.get("name")
-        actual_args = call_node.get("args")
-        # print(f"⛄️: call func: {func_name}")
-        # print(f"⛄️: self.env = {self.env.environment}")
-        return self.__call_func_aux(func_name, actual_args)
-
-    def __call_func_aux(self, func_name, actual_args): # return return_val
-        if func_name == "print":
-            return self.__call_print(actual_args)
-        if func_name == "inputi" or func_name == "inputs":
-            return self.__call_input(func_name, actual_args)
-
-        func_ast = self.__get_func_by_name(func_name, len(actual_args))
-        formal_args = func_ast.get("args")
-        if len(actual_args) != len(formal_args):
-            super().error(
-                ErrorType.NAME_ERROR,
-                f"Function {func_ast.get('name')} with {len(actual_args)} args not found",
-            )
 
-        # first evaluate all of the actual parameters and associate them with the formal parameter names
+    # thunk_env is the environment of the thunk the call is in, or None for the current one
+    def __call_func(self, call_node, thunk_env): # return return_val
+        actual_args = call_node.args
+        target = call_node.target # linked when the program was compiled
+        if isinstance(target, brewbuiltins.Builtin):
+            return (yield from self.__call_builtin(target, actual_args, thunk_env))
+        if isinstance(target, UnresolvedCall):
+            super().error(ErrorType.NAME_ERROR, target.message)
+        return (yield from self.__call_user_func(target, actual_args, thunk_env))
+
+    def __call_user_func(self, func_ast, actual_args, thunk_env): # return return_val
+        # the actual parameters are thunks, evaluated in the caller's environment when needed
+        args_env = self.__snapshot() if thunk_env is None else copy.copy(thunk_env)
         args = {}
-        curr_dict = copy.copy(self.env) # create a shallow copy of the curr env dict
-        curr_dict.environment = [ # create a new environment structure where each list and dictionary is shallow-copied
-            [copy.copy(env) for env in func_env] for func_env in self.env.environment
-        ]
-        for formal_ast, actual_ast in zip(formal_args, actual_args):
-            # print(f"📱: self.env = {self.env.environment}")
-            thunk = Thunk(actual_ast, curr_dict)
-            # result = copy.copy(self.__eval_expr(actual_ast))
-            arg_name = formal_ast.get("name")
-            args[arg_name] = thunk
+        for formal_ast, actual_ast in zip(func_ast.args, actual_args):
+            args[formal_ast.name] = Thunk(actual_ast, args_env)
 
         # then create the new activation record 
         self.env.push_func()
         # and add the formal arguments to the activation record
         for arg_name, value in args.items():
-            # print(f"📱: arg_name = {arg_name}")
-            # print(f"📱: value env = {value.copied_env.environment}")
             self.env.create(arg_name, value)
-        _, return_val = self.__run_statements(func_ast.get("statements"))
+        _, return_val = yield from self.__run_statements(func_ast.statements)
         self.env.pop_func()
         return return_val
 
-    def __call_print(self, args): # return nil
-        output = ""
-        for arg in args:
-            # eager eval
-            # print(f"🖨️: arg = {arg}")
-            # print(f"🖨️: self.env.get(arg) = {self.env.get('b').expr_ast}")
-            result = self.__eval_expr(arg)  # result could be Thunk or Value object
-            output = output + get_printable(result)
-        super().output(output)
-        return Interpreter.NIL_VALUE
-
-    def __call_input(self, name, args): # return Value object
-        if args is not None and len(args) == 1:
-            result = self.__eval_expr(args[0])
-            super().output(get_printable(result))
-        elif args is not None and len(args) > 1:
-            super().error(
-                ErrorType.NAME_ERROR, "No inputi() function that takes > 1 parameter"
-            )
-        inp = super().get_input()
-        if name == "inputi":
-            return Value(Type.INT, int(inp))
-        if name == "inputs":
-            return Value(Type.STRING, inp)
+    # the arguments of a lazy builtin are evaluated within its call, where nothing can pause
+    def __call_builtin(self, builtin, actual_args, thunk_env): # return Value object
+        if builtin.strict:
+            args = []
+            for arg in actual_args:
+                args.append(self.__eval_quick(arg, thunk_env) or (yield from self.__eval(arg, thunk_env)))
+        else:
+            args = [
+                brewbuiltins.LazyArg(lambda arg: self.__finish(self.__eval(arg, thunk_env)), arg)
+                for arg in actual_args
+            ]
+        if self.wait_for_input and self.__resumable and not self.__eager:
+            value_obj = yield from self.__call_builtin_for_input(builtin, args)
+        else:
+            value_obj = builtin.func(self, args)
+        if self.pause_on_output and self.__resumable:
+            yield from self.__pause_for_output()
+        return value_obj
 
-    def __assign(self, assign_ast): # no return
-        var_name = assign_ast.get("name")
-        expr_ast = assign_ast.get("expression")
+    # calls a builtin whose call can't pause, with arguments that can't either, without a generator;
+    # return Bool, whether it could
+    def __call_builtin_quick(self, builtin, actual_args):
+        if self.__resumable and (self.wait_for_input or self.pause_on_output):
+            return False
+        if builtin.strict:
+            args = []
+            for arg in actual_args:
+                value_obj = self.__eval_quick(arg, None)
+                if value_obj is None:
+                    return False
+                args.append(value_obj)
+        else:
+            args = [brewbuiltins.LazyArg(lambda arg: self.__finish(self.__eval(arg, None)), arg) for arg in actual_args]
+        builtin.func(self, args)
+        return True
 
-        curr_dict = copy.copy(self.env) # create a shallow copy of the curr env dict
-        curr_dict.environment = [ # create a new environment structure where each list and dictionary is shallow-copied
+    # a builtin that finds no input is abandoned, and called again once there is some; the lines
+    # it printed the first time (e.g. the prompt of inputi) are printed only once
+    def __call_builtin_for_input(self, builtin, args): # return Value object
+        printed = len(self.output_log)
+        input_cursor, input_reads = self.input_cursor, self.input_reads
+        try:
+            while True:
+                try:
+                    return builtin.func(self, args)
+                except _InputWait:
+                    wanted = len(self.inp) + 1
+                    self.__replayed = len(self.output_log) - printed
+                    self.input_cursor, self.input_reads = input_cursor, input_reads
+                    if self.pause_on_output:
+                        yield from self.__pause_for_output()
+                    while len(self.inp) < wanted and not self.input_closed:
+                        self.pause_stats["input_waits"] += 1
+                        yield (INPUT,)
+        finally:
+            self.__replayed = 0
+
+    # a copy of the current environment down to its scope dicts, for a thunk to evaluate in
+    def __snapshot(self): # return EnvironmentManager
+        snapshot = copy.copy(self.env) # create a shallow copy of the curr env dict
+        snapshot.environment = [ # create a new environment structure where each list and dictionary is shallow-copied
             [copy.copy(env) for env in func_env] for func_env in self.env.environment
         ]
-        # create thunk
-        thunk_obj = Thunk(expr_ast, curr_dict)
-        # set thunk to dict
-        if not self.env.set(var_name, thunk_obj):
+        return snapshot
+
+    def __assign(self, assign_ast): # no return
+        var_name = assign_ast.name
+        if not self.env.set(var_name, Thunk(assign_ast.expression, self.__snapshot())):
             super().error(
                 ErrorType.NAME_ERROR, f"Undefined variable {var_name} in assignment"
             )
-    
+
+    # field stores are strict: objects are shared, so a lazy s.f = s.f + 1 would end up reading itself
+    def __assign_field(self, var_name, fields, expr_ast): # no return
+        obj = self.__get_fields((yield from self.__get_var(var_name)), fields[:-1])
+        slot = self.__get_slot(obj, fields[-1])
+        obj.value().slots[slot] = self.__eval_quick(expr_ast, None) or (yield from self.__eval(expr_ast, None))
+
+    # binds a cse temporary to a thunk; thunks only ever look up names in the current function,
+    # so unlike an assignment it only snapshots that function's scopes
+    def __define_temp(self, def_ast): # no return
+        snapshot = EnvironmentManager()
+        snapshot.environment = [[copy.copy(env) for env in self.env.environment[-1]]]
+        self.env.create(def_ast.name, Thunk(def_ast.expression, snapshot))
+
     def __var_def(self, var_ast): # no return
-        var_name = var_ast.get("name")
+        var_name = var_ast.name
         if not self.env.create(var_name, Interpreter.NIL_VALUE):
             super().error(
                 ErrorType.NAME_ERROR, f"Duplicate definition for variable {var_name}"
             )
 
-    def __eval_expr(self, expr_ast): # return Value Object
+    # evaluates expr_ast in thunk_env, or in the current environment if it is None
+    def __eval(self, expr_ast, thunk_env): # return Value Object
+        if not self.__has_call(expr_ast):
+            while True:
+                try:
+                    return self.__eval_now(expr_ast, thunk_env)
+                except _Blocked as blocked:
+                    yield from self.__handle_thunk(blocked.thunk_obj)
+                    self.__just_forced = blocked.thunk_obj
+        if expr_ast.elem_type == InterpreterBase.FCALL_NODE:
+            return (yield from self.__call_func(expr_ast, thunk_env))
+        # the operand of - and ! is evaluated in the current environment, even inside a thunk
+        if expr_ast.elem_type in (InterpreterBase.NEG_NODE, InterpreterBase.NOT_NODE):
+            return self.__apply_unary(expr_ast, (yield from self.__eval(expr_ast.op1, None)))
+        op = expr_ast.elem_type
+        # short circuiting
+        if op in ("&&", "||"):
+            left_value_obj = yield from self.__eval(expr_ast.op1, thunk_env)
+            if op == "&&" and not left_value_obj.value():
+                return Value(Type.BOOL, False)
+            if op == "||" and left_value_obj.value():
+                return Value(Type.BOOL, True)
+            return (yield from self.__eval(expr_ast.op2, thunk_env))
+        if self.speculator is not None and expr_ast in self.speculator.ops:
+            left_value_obj, right_value_obj = self.__eval_operands_speculatively(
+                expr_ast,
+                lambda e: self.__finish(self.__eval(e, thunk_env)),
+                self.env.get if thunk_env is None else thunk_env.get,
+            )
+        else:
+            left_value_obj = self.__eval_quick(expr_ast.op1, thunk_env) or (yield from self.__eval(expr_ast.op1, thunk_env))
+            right_value_obj = self.__eval_quick(expr_ast.op2, thunk_env) or (yield from self.__eval(expr_ast.op2, thunk_env))
+        return self.__apply_op(expr_ast, left_value_obj, right_value_obj)
+
+    # as __eval, without a generator; None if the expression may pause, and __eval has to evaluate it
+    def __eval_quick(self, expr_ast, thunk_env): # return Value Object or None
+        has_call = self.has_calls.get(expr_ast)
+        if has_call or has_call is None and self.__has_call(expr_ast):
+            return None
+        try:
+            return self.__eval_now(expr_ast, thunk_env)
+        except _Blocked:
+            return None
+
+    # evaluates an expression without a call in it by plain recursion
+    def __eval_now(self, expr_ast, thunk_env): # return Value Object
         if expr_ast.elem_type == InterpreterBase.NIL_NODE:
             return Interpreter.NIL_VALUE
         if expr_ast.elem_type == InterpreterBase.INT_NODE:
-            return Value(Type.INT, expr_ast.get("val"))
+            return Value(Type.INT, expr_ast.val)
         if expr_ast.elem_type == InterpreterBase.STRING_NODE:
-            return Value(Type.STRING, expr_ast.get("val"))
+            return Value(Type.STRING, expr_ast.val)
         if expr_ast.elem_type == InterpreterBase.BOOL_NODE:
-            return Value(Type.BOOL, expr_ast.get("val"))
+            return Value(Type.BOOL, expr_ast.val)
         if expr_ast.elem_type == InterpreterBase.VAR_NODE:
-            var_name = expr_ast.get("name")
-            val_thunk = self.env.get(var_name)
+            val_thunk = (self.env if thunk_env is None else thunk_env).get(expr_ast.name)
             if val_thunk is None:
-                super().error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
-            if not isinstance(val_thunk, Thunk): # then should be a Value obj?
-                return val_thunk    
-            val_thunk = self.__handle_thunk(val_thunk) # return Value Obj?
+                super().error(ErrorType.NAME_ERROR, f"Variable {expr_ast.name} not found")
+            if isinstance(val_thunk, Thunk):
+                val_thunk = self.__force_now(val_thunk)
+            if expr_ast.fields:
+                return self.__get_fields(val_thunk, expr_ast.fields)
             return val_thunk
-        if expr_ast.elem_type == InterpreterBase.FCALL_NODE:
-            return self.__call_func(expr_ast)
-        if expr_ast.elem_type in Interpreter.BIN_OPS:
-            return self.__eval_op(expr_ast)
-        if expr_ast.elem_type == Interpreter.NEG_NODE:
-            return self.__eval_unary(expr_ast, Type.INT, lambda x: -1 * x)
-        if expr_ast.elem_type == Interpreter.NOT_NODE:
-            return self.__eval_unary(expr_ast, Type.BOOL, lambda x: not x)
-
-    def __eval_op(self, arith_ast): # return Value Object
-        op = arith_ast.elem_type
+        if expr_ast.elem_type == InterpreterBase.NEW_NODE:
+            return self.__new_struct(expr_ast)
+        if expr_ast.elem_type in (InterpreterBase.NEG_NODE, InterpreterBase.NOT_NODE):
+            return self.__apply_unary(expr_ast, self.__eval_now(expr_ast.op1, None))
+        if expr_ast.elem_type == cse.REF_NODE:
+            return self.__get_temp((self.env if thunk_env is None else thunk_env).get(expr_ast.name))
+        op = expr_ast.elem_type
+        left_value_obj = self.__eval_now(expr_ast.op1, thunk_env)
         # short circuiting
-        if op  == '&&':
-            left_value_obj = self.__eval_expr(arith_ast.get("op1"))
-            if not left_value_obj.value():
-                return Value(Type.BOOL, False)
-            return self.__eval_expr(arith_ast.get("op2"))
-        elif op == '||':
-            left_value_obj = self.__eval_expr(arith_ast.get("op1"))
-            if left_value_obj.value():
-                return Value(Type.BOOL, True)
-            return self.__eval_expr(arith_ast.get("op2"))
+        if op == "&&" and not left_value_obj.value():
+            return Value(Type.BOOL, False)
+        if op == "||" and left_value_obj.value():
+            return Value(Type.BOOL, True)
+        right_value_obj = self.__eval_now(expr_ast.op2, thunk_env)
+        if op in ("&&", "||"):
+            return right_value_obj
+        return self.__apply_op(expr_ast, left_value_obj, right_value_obj)
 
-        left_value_obj = self.__eval_expr(arith_ast.get("op1"))
-        right_value_obj = self.__eval_expr(arith_ast.get("op2"))
+    # a cse temporary always holds a thunk; once it's evaluated, each use saves an evaluation
+    def __get_temp(self, thunk_obj): # return Value Object
+        if thunk_obj.is_evaluated:
+            if thunk_obj is self.__just_forced: # forced for this use by __eval, so nothing was saved
+                self.__just_forced = None
+            else:
+                self.stats["cse"]["eliminated_evaluations"] += 1
+        return self.__force_now(thunk_obj)
 
-        # division by zero check (after evaluating both sides)
-        if op == '/' and right_value_obj.value() == 0:
-            raise UserException("div0")  # Custom exception for division by zero
+    # raises _Blocked if the thunk has to be forced by __handle_thunk; the __eval that catches it
+    # does, so a chain of such thunks only takes a few frames per thunk
+    def __force_now(self, thunk_obj): # return a Value Object
+        if not thunk_obj.is_evaluated:
+            if self.__has_call(thunk_obj.expr_ast):
+                raise _Blocked(thunk_obj)
+            thunk_obj.expr_ast = self.__eval_now(thunk_obj.expr_ast, thunk_obj.copied_env)
+            thunk_obj.is_evaluated = True
+        return thunk_obj.expr_ast
 
-        if not self.__compatible_types(
-            arith_ast.elem_type, left_value_obj, right_value_obj
-        ):
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible types for {arith_ast.elem_type} operation",
-            )
-        if arith_ast.elem_type not in self.op_to_lambda[left_value_obj.type()]:
+    def __handle_thunk(self, thunk_obj): # return a Value Object
+        if not thunk_obj.is_evaluated:
+            thunk_obj.expr_ast = yield from self.__eval(thunk_obj.expr_ast, thunk_obj.copied_env)
+            thunk_obj.is_evaluated = True
+        return thunk_obj.expr_ast
+
+    def __has_call(self, expr_ast): # return Bool
+        has_call = self.has_calls.get(expr_ast)
+        if has_call is None:
+            if expr_ast.elem_type == InterpreterBase.FCALL_NODE:
+                has_call = True
+            elif expr_ast.elem_type in Interpreter.BIN_OPS:
+                has_call = self.__has_call(expr_ast.op1) or self.__has_call(expr_ast.op2)
+            elif expr_ast.elem_type in (InterpreterBase.NEG_NODE, InterpreterBase.NOT_NODE):
+                has_call = self.__has_call(expr_ast.op1)
+            else:
+                has_call = False
+            self.has_calls[expr_ast] = has_call
+        return has_call
+
+    def __get_var(self, var_name): # return Value Object
+        val_thunk = self.env.get(var_name)
+        if val_thunk is None:
+            super().error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
+        if not isinstance(val_thunk, Thunk): # then should be a Value obj?
+            return val_thunk
+        return (yield from self.__handle_thunk(val_thunk))
+
+    def __get_fields(self, value_obj, fields): # return Value Object
+        for field in fields:
+            slot = self.__get_slot(value_obj, field)
+            value_obj = value_obj.value().slots[slot]
+        return value_obj
+
+    def __get_slot(self, value_obj, field): # return slot number of field in the struct value_obj
+        if value_obj.type() == Type.NIL:
+            super().error(ErrorType.FAULT_ERROR, f"Accessing field {field} of nil")
+        if value_obj.type() != Type.STRUCT:
+            super().error(ErrorType.TYPE_ERROR, f"Accessing field {field} of a {value_obj.type()}")
+        slot = value_obj.value().layout.field_index.get(field)
+        if slot is None:
             super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible operator {arith_ast.elem_type} for type {left_value_obj.type()}",
+                ErrorType.NAME_ERROR,
+                f"Struct {value_obj.value().layout.name} has no field {field}",
             )
+        return slot
+
+    def __new_struct(self, new_ast): # return Value Object
+        layout = self.struct_layouts.get(new_ast.var_type)
+        if layout is None:
+            super().error(ErrorType.TYPE_ERROR, f"Unknown struct type {new_ast.var_type}")
+        return Value(Type.STRUCT, Struct(layout))
+
+    # && and || are short circuited before this
+    def __apply_op(self, arith_ast, left_value_obj, right_value_obj): # return Value Object
+        # division by zero check (after evaluating both sides)
+        if arith_ast.elem_type == '/' and right_value_obj.value() == 0:
+            raise UserException("div0")  # Custom exception for division by zero
+
+        if not arith_ast.proven: # see typecheck
+            if not self.__compatible_types(
+                arith_ast.elem_type, left_value_obj, right_value_obj
+            ):
+                super().error(
+                    ErrorType.TYPE_ERROR,
+                    f"Incompatible types for {arith_ast.elem_type} operation",
+                )
+            if arith_ast.elem_type not in self.op_to_lambda[left_value_obj.type()]:
+                super().error(
+                    ErrorType.TYPE_ERROR,
+                    f"Incompatible operator {arith_ast.elem_type} for type {left_value_obj.type()}",
+                )
         f = self.op_to_lambda[left_value_obj.type()][arith_ast.elem_type]
         return f(left_value_obj, right_value_obj)
 
+    # evaluates op1 here while a worker evaluates op2, a call to a pure function; lookup reads the
+    # variables its arguments are computed from
+    def __eval_operands_speculatively(self, arith_ast, evaluate, lookup): # return (Value, Value)
+        future = None
+        if len(self.env.environment) <= speculate.MAX_DEPTH:
+            future = self.speculator.submit(arith_ast.op2, lookup)
+        if future is None:
+            return evaluate(arith_ast.op1), evaluate(arith_ast.op2)
+        try:
+            left_value_obj = evaluate(arith_ast.op1)
+        except BaseException:
+            self.speculator.abandon(future)
+            raise
+        right_value_obj = self.speculator.result(future)
+        if right_value_obj is None: # the worker failed; whatever went wrong happens again here
+            right_value_obj = evaluate(arith_ast.op2)
+        return left_value_obj, right_value_obj
+
     def __compatible_types(self, oper, obj1, obj2): # return Bool
         # DOCUMENT: allow comparisons ==/!= of anything against anything
         if oper in ["==", "!="]:
             return True
         return obj1.type() == obj2.type()
 
-    def __eval_unary(self, arith_ast, t, f): # return Value Object
-        value_obj = self.__eval_expr(arith_ast.get("op1"))
+    def __apply_unary(self, arith_ast, value_obj): # return Value Object
+        if arith_ast.elem_type == Interpreter.NEG_NODE:
+            t, f = Type.INT, lambda x: -1 * x
+        else:
+            t, f = Type.BOOL, lambda x: not x
         if value_obj.type() != t:
             super().error(
                 ErrorType.TYPE_ERROR,
@@ -322,6 +886,33 @@ class Interpreter(InterpreterBase):
             Type.BOOL, x.type() != y.type() or x.value() != y.value()
         )
 
+        #  set up operations on structs, which compare by reference
+        self.op_to_lambda[Type.STRUCT] = {}
+        self.op_to_lambda[Type.STRUCT]["=="] = lambda x, y: Value(
+            Type.BOOL, x.type() == y.type() and x.value() is y.value()
+        )
+        self.op_to_lambda[Type.STRUCT]["!="] = lambda x, y: Value(
+            Type.BOOL, x.type() != y.type() or x.value() is not y.value()
+        )
+
+        #  set up operations on arrays, which compare by reference like structs
+        self.op_to_lambda[Type.ARRAY] = {}
+        self.op_to_lambda[Type.ARRAY]["=="] = lambda x, y: Value(
+            Type.BOOL, x.type() == y.type() and x.value() is y.value()
+        )
+        self.op_to_lambda[Type.ARRAY]["!="] = lambda x, y: Value(
+            Type.BOOL, x.type() != y.type() or x.value() is not y.value()
+        )
+
+        #  set up operations on maps, also by reference
+        self.op_to_lambda[Type.MAP] = {}
+        self.op_to_lambda[Type.MAP]["=="] = lambda x, y: Value(
+            Type.BOOL, x.type() == y.type() and x.value() is y.value()
+        )
+        self.op_to_lambda[Type.MAP]["!="] = lambda x, y: Value(
+            Type.BOOL, x.type() != y.type() or x.value() is not y.value()
+        )
+
         #  set up operations on nil
         self.op_to_lambda[Type.NIL] = {}
         self.op_to_lambda[Type.NIL]["=="] = lambda x, y: Value(
@@ -332,31 +923,40 @@ class Interpreter(InterpreterBase):
         )
 
     def __do_if(self, if_ast): # return (status, return_val)
-        cond_ast = if_ast.get("condition")
-        result = self.__eval_expr(cond_ast)
-        if result.type() != Type.BOOL:
+        cond_ast = if_ast.condition
+        result = self.__eval_quick(cond_ast, None) or (yield from self.__eval(cond_ast, None))
+        if not if_ast.proven and result.type() != Type.BOOL:
             super().error(
                 ErrorType.TYPE_ERROR,
                 "Incompatible type for if condition",
             )
         if result.value():
-            statements = if_ast.get("statements")
-            status, return_val = self.__run_statements(statements)
+            statements = if_ast.statements
+            status, return_val = yield from self.__run_statements(statements)
             return (status, return_val)
         else:
-            else_statements = if_ast.get("else_statements")
+            else_statements = if_ast.else_statements
             if else_statements is not None:
-                status, return_val = self.__run_statements(else_statements)
+                status, return_val = yield from self.__run_statements(else_statements)
                 return (status, return_val)
 
         return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
 
     def __do_for(self, for_ast):
-        init_ast = for_ast.get("init") 
-        cond_ast = for_ast.get("condition")
-        update_ast = for_ast.get("update") 
+        init_ast = for_ast.init 
+        cond_ast = for_ast.condition
+        update_ast = for_ast.update 
 
-        self.__run_statement(init_ast)  # initialize counter variable
+        if self.__slicing or not self.__run_quick(init_ast):
+            yield from self.__run_statement(init_ast)  # initialize counter variable
+        counted = self.counted_for(for_ast)
+        if counted is not None:
+            var_name, step = counted
+            start = self.env.get(var_name)
+            if isinstance(start, Thunk):
+                start = yield from self.__handle_thunk(start) # memoized, so the general loop below can still reuse it
+            if start.type() == Type.INT:
+                return (yield from self.__do_counted_for(for_ast, var_name, step, start.value()))
         # run_for = Interpreter.TRUE_VALUE
         # while run_for.value():
         #     run_for = self.__eval_expr(cond_ast)  # check for-loop condition
@@ -372,166 +972,145 @@ class Interpreter(InterpreterBase):
         #             return status, return_val
         #         self.__run_statement(update_ast)  # update counter variable
 
-        while self.__eval_expr(cond_ast).value():
+        while True:
+            run_for = self.__eval_quick(cond_ast, None) or (yield from self.__eval(cond_ast, None))  # check for-loop condition
+            if not for_ast.proven and run_for.type() != Type.BOOL:
+                super().error(
+                    ErrorType.TYPE_ERROR,
+                    "Incompatible type for for condition",
+                )
+            if not run_for.value():
+                break
             self.env.push_block()  # Create a new scope for each iteration
             try:
-                status, return_val = self.__run_statements(for_ast.get("statements"))
+                status, return_val = yield from self.__run_statements(for_ast.statements)
                 if status == ExecStatus.RETURN:
                     return status, return_val
             finally:
                 self.env.pop_block()  # Ensure the block is always popped
-            self.__run_statement(update_ast)  # Update counter variable
+            if self.__slicing or not self.__run_quick(update_ast):
+                yield from self.__run_statement(update_ast)  # Update counter variable
+
+        return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
+
+    # runs a recognized counted loop with a native counter; the body only ever sees i as a forced int
+    def __do_counted_for(self, for_ast, var_name, step, counter): # return (status, return_val)
+        cond_ast = for_ast.condition
+        compare = COUNTED_FOR_OPS[cond_ast.elem_type]
+        bound_ast = cond_ast.op2
+        statements = for_ast.statements
+        if self.vectorize_loops and self.__do_vectorized_for(for_ast, var_name, step, counter):
+            return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
+        while True:
+            bound = self.__eval_quick(bound_ast, None) or (yield from self.__eval(bound_ast, None)) # re-evaluated since the body may change it
+            if not cond_ast.proven and bound.type() != Type.INT:
+                super().error(
+                    ErrorType.TYPE_ERROR,
+                    f"Incompatible types for {cond_ast.elem_type} operation",
+                )
+            if not compare(counter, bound.value()):
+                break
+            if self.__slicing:
+                yield from self.__step() # an empty body runs no statements, but may still run forever
+            status, return_val = yield from self.__run_statements(statements)
+            if status == ExecStatus.RETURN:
+                return status, return_val
+            counter += step
+            self.env.set(var_name, Value(Type.INT, counter))
 
         return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
 
+    def __do_vectorized_for(self, for_ast, var_name, step, counter): # return Bool
+        if for_ast not in self.loop_plans:
+            self.loop_plans[for_ast] = loop_vectorizer.plan_loop(for_ast, var_name)
+        plan = self.loop_plans[for_ast]
+        if plan is None:
+            return False
+        result = loop_vectorizer.run_plan(
+            plan, counter, step, self.__forced_int, lambda name: self.env.get(name) is not None
+        )
+        if result is None:
+            return False
+        method, iterations, values = result
+        for name, value in values.items():
+            self.env.set(name, Value(Type.INT, value))
+        self.stats["vectorized_loops"].append(
+            {"var": var_name, "iterations": iterations, "method": method}
+        )
+        return True
+
+    # return int, or None if the variable is not an int that can be forced without side effects or errors
+    def __forced_int(self, var_name):
+        value = self.env.get(var_name)
+        if isinstance(value, Thunk):
+            if not value.is_evaluated and not self.__is_int_arith(value.expr_ast, value.copied_env, 16):
+                return None
+            value = self.__force_now(value) # int arithmetic has no calls, so this never blocks
+        if value is None or value.type() != Type.INT:
+            return None
+        return value.value()
+
+    def __is_int_arith(self, expr_ast, thunk_env, depth): # return Bool
+        if depth == 0:
+            return False
+        if expr_ast.elem_type == InterpreterBase.INT_NODE:
+            return True
+        if expr_ast.elem_type == InterpreterBase.VAR_NODE and not expr_ast.fields:
+            value = thunk_env.get(expr_ast.name)
+            if isinstance(value, Thunk):
+                if value.is_evaluated:
+                    value = value.expr_ast
+                else:
+                    return self.__is_int_arith(value.expr_ast, value.copied_env, depth - 1)
+            return value is not None and value.type() == Type.INT
+        if expr_ast.elem_type in ("+", "-", "*"):
+            return self.__is_int_arith(expr_ast.op1, thunk_env, depth - 1) and self.__is_int_arith(
+                expr_ast.op2, thunk_env, depth - 1
+            )
+        return False
+
     def __do_return(self, return_ast):
-        expr_ast = return_ast.get("expression")
+        expr_ast = return_ast.expression
         if expr_ast is None:
             return (ExecStatus.RETURN, Interpreter.NIL_VALUE)
         
-        value_obj = copy.copy(self.__eval_expr(expr_ast))
+        value_obj = copy.copy(self.__eval_quick(expr_ast, None) or (yield from self.__eval(expr_ast, None)))
         return (ExecStatus.RETURN, value_obj)
     
-    def __handle_thunk(self, thunk_obj): # return a Value Object        
-        if not thunk_obj.is_evaluated:
-            # print(f"👋: thunk_obj.copied_env = {thunk_obj.copied_env.environment}")
-            thunk_obj.expr_ast = self.__eval_expr_thunk(thunk_obj.expr_ast, thunk_obj.copied_env)
-            thunk_obj.is_evaluated = True
-
-            # # update the environment with the resolved value
-            # variable_name = thunk_obj.copied_env.get_variable_name_from_thunk(thunk_obj)
-            # if variable_name:
-            #     self.env.set(variable_name, thunk_obj.expr_ast)  # Update with resolved value
-
-        return thunk_obj.expr_ast
-    
-    def __eval_expr_thunk(self, expr_ast, thunk_env):
-        if expr_ast.elem_type == InterpreterBase.NIL_NODE:
-            return Interpreter.NIL_VALUE
-        if expr_ast.elem_type == InterpreterBase.INT_NODE:
-            return Value(Type.INT, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.STRING_NODE:
-            return Value(Type.STRING, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.BOOL_NODE:
-            return Value(Type.BOOL, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.VAR_NODE:
-            var_name = expr_ast.get("name") # gets var from the Thunk's expr_ast
-            val_thunk = thunk_env.get(var_name) # gets Thunk of var
-            # print(f"🧮: val_thunk = {val_thunk}")
-            if val_thunk is None: # had not been initiated prior to thunk creation
-                super().error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
-            # val_thunk = val_thunk.copied_env.get(var_name) # get the var stored in copied env
-            
-            if isinstance(val_thunk, Thunk): # if var in copied_env is another Thunk
-                val_thunk = self.__handle_thunk(val_thunk)
-            return val_thunk
-        if expr_ast.elem_type == InterpreterBase.FCALL_NODE:
-            # return self.__call_func(expr_ast)
-            return self.__call_func_thunk(expr_ast, thunk_env)
-        if expr_ast.elem_type in Interpreter.BIN_OPS:
-            return self.__eval_op_thunk(expr_ast, thunk_env) # 🍅
-        if expr_ast.elem_type == Interpreter.NEG_NODE:
-            return self.__eval_unary(expr_ast, Type.INT, lambda x: -1 * x)
-        if expr_ast.elem_type == Interpreter.NOT_NODE:
-            return self.__eval_unary(expr_ast, Type.BOOL, lambda x: not x)
-        
-    def __eval_op_thunk(self, expr_ast, thunk_env): # return Value Object
-        op = expr_ast.elem_type
-        op1 = expr_ast.get("op1")
-        op2 = expr_ast.get("op2")
-        # short circuiting
-        if op  == '&&':
-            left_value_obj = self.__eval_expr_thunk(op1, thunk_env)
-            if not left_value_obj.value():
-                return Value(Type.BOOL, False)
-            return self.__eval_expr_thunk(op2, thunk_env)
-        elif op == '||':
-            left_value_obj = self.__eval_expr_thunk(op1, thunk_env)
-            if left_value_obj.value():
-                return Value(Type.BOOL, True)
-            return self.__eval_expr_thunk(op2, thunk_env)
-
-        left_value_obj = self.__eval_expr_thunk(op1, thunk_env)
-        right_value_obj = self.__eval_expr_thunk(op2, thunk_env)
-        if not self.__compatible_types(
-            expr_ast.elem_type, left_value_obj, right_value_obj
-        ):
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible types for {expr_ast.elem_type} operation",
-            )
-        if expr_ast.elem_type not in self.op_to_lambda[left_value_obj.type()]:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible operator {expr_ast.elem_type} for type {left_value_obj.type()}",
-            )
-        f = self.op_to_lambda[left_value_obj.type()][expr_ast.elem_type]
-        return f(left_value_obj, right_value_obj)
-    
-    def __call_func_thunk(self, call_node, thunk_env): # return return_val
-        func_name = call_node.get("name")
-        actual_args = call_node.get("args")
-
-        if func_name == "print":
-            return self.__call_print(actual_args)
-        if func_name == "inputi" or func_name == "inputs":
-            return self.__call_input(func_name, actual_args)
-
-        func_ast = self.__get_func_by_name(func_name, len(actual_args))
-        formal_args = func_ast.get("args")
-        if len(actual_args) != len(formal_args):
-            super().error(
-                ErrorType.NAME_ERROR,
-                f"Function {func_ast.get('name')} with {len(actual_args)} args not found",
-            )
-
-        # Evaluate actual parameters using the thunk_env
-        args = {}
-        for formal_ast, actual_ast in zip(formal_args, actual_args):
-            thunk = Thunk(actual_ast, copy.copy(thunk_env)) # 🍅 think about later: do I need to copy further? 
-            # result = self.__eval_expr_thunk(actual_ast, thunk_env)  # Evaluate lazily
-            arg_name = formal_ast.get("name")
-            args[arg_name] = thunk
-
-        # Push a new function environment
-        self.env.push_func()
-        for arg_name, value in args.items():
-            self.env.create(arg_name, value)
-
-        _, return_val = self.__run_statements(func_ast.get("statements"))
-        self.env.pop_func()
-
-        return return_val
-
     def __handle_raise(self, raise_ast):
-        exception_expr = raise_ast.get("exception_type")
-        exception_value = self.__eval_expr(exception_expr)
+        exception_expr = raise_ast.exception_type
+        exception_value = yield from self.__eval(exception_expr, None)
         if exception_value.type() != Type.STRING:
             super().error(ErrorType.TYPE_ERROR, f"Raised exception type is not a string, it is of type: {exception_value.type()}")
         raise UserException(exception_value.value()) # 🍅
     
     def __handle_try(self, try_ast):
         did_it_pop = False
-        try_statements = try_ast.get("statements")
-        catchers = try_ast.get("catchers")
+        try_statements = try_ast.statements
+        catchers = try_ast.catchers
+        # a raise skips the pops of every block and call it leaves, so the catch unwinds to
+        # here; it must only see what is in scope lexically (typecheck's proofs rely on it)
+        func_depth = len(self.env.environment)
+        block_depth = len(self.env.environment[-1])
         try:
             self.env.push_block()
             # self.__run_statements(try_statements)
-            status, return_val = self.__run_statements(try_statements)
+            status, return_val = yield from self.__run_statements(try_statements)
             self.env.pop_block()
             did_it_pop = True
             return status, return_val # ensure tuple is returned
         except UserException as e:
             if not did_it_pop:
-                self.env.pop_block()
+                del self.env.environment[func_depth:]
+                del self.env.environment[-1][block_depth:]
             self.env.push_block()
             exception_type = str(e)
             for catcher in catchers:
-                if catcher.get("exception_type") == exception_type: # check if exceptions match
+                if catcher.exception_type == exception_type: # check if exceptions match
                     self.env.push_block() # new scope for catch clause
                     try:
                         # self.__run_statements(catcher.get("statements"))
-                        status, return_val = self.__run_statements(catcher.get("statements"))
+                        status, return_val = yield from self.__run_statements(catcher.statements)
                         return status, return_val
                     finally:
                         self.env.pop_block()
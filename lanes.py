@@ -0,0 +1,411 @@
+"""
+Running one Brewin program over many input vectors at once.
+
+    if lanes.supports(compiled):
+        outputs = lanes.run(compiled, lane_inputs)   # output log per lane, or None
+
+Every value is a vector with a lane per input vector: a NumPy array of the
+lanes' types and one of their Python values. The program runs once, and each
+statement runs on a mask of the lanes that reach it: an if runs each branch on
+the lanes whose condition went that way, a for loops while any lane is still
+looping, and a lane that returns is masked out of the rest of its function.
+Every lane has its own input cursor and output log, so its prints come out in
+the order a run of its own would print them.
+
+Evaluation is lazy exactly as in interpreterv4: an assignment binds a thunk over
+a snapshot of the function's scopes, and a call binds its arguments the same
+way. Lanes force a thunk at different points (one lane's if may print a variable
+another lane only reads later), so a thunk records per lane whether it has been
+evaluated. An assignment made on only some of the lanes binds a Select of the
+new thunk and the old binding.
+
+A lane whose run would raise (a Brewin error, a raise, a read past the end of
+its input or from the keyboard) is dropped where it would raise and gets None:
+the caller runs it on its own, which reproduces whatever it does. Programs
+with structs, arrays, maps or builtins other than print, inputi, inputs and
+the strict pure ones are not supported, nor are functions brewscan hasn't
+parsed yet.
+"""
+
+import operator
+
+import cse
+from brewbuiltins import RESERVED, Builtin
+from brewscan import FuncStub
+from element import Element, iter_elements
+from intbase import InterpreterBase
+from type_valuev2 import Type, Value
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional
+    np = None
+
+NIL, INT, BOOL, STRING = range(4)  # codes of the types a lane can hold
+TYPES = (Type.NIL, Type.INT, Type.BOOL, Type.STRING)
+KINDS = {t: kind for kind, t in enumerate(TYPES)}
+ARITH_OPS = {"+": operator.add, "-": operator.sub, "*": operator.mul, "/": operator.floordiv}
+COMPARE_OPS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+# Raised by error(), so a builtin that reports a Brewin error drops its lane
+class LaneError(Exception):
+    pass
+
+
+# The value of an expression in every lane; only the lanes of the mask it was evaluated on mean anything
+class Lanes:
+    __slots__ = ("kinds", "vals")
+
+    def __init__(self, kinds, vals):
+        self.kinds = kinds
+        self.vals = vals
+
+    @classmethod
+    def filled(cls, n, kind, val): # return Lanes
+        return cls(np.full(n, kind, np.int8), np.full(n, val, object))
+
+
+# A lazy expression over a snapshot of a function's scopes, evaluated separately in each lane
+class LaneThunk:
+    def __init__(self, expr_ast, scope, n):
+        self.expr_ast = expr_ast
+        self.scope = scope
+        self.done = np.zeros(n, bool)
+        self.value = Lanes.filled(n, NIL, None)
+
+
+# The binding of a variable assigned on the lanes of mask only: new there, old elsewhere
+class Select:
+    def __init__(self, mask, new, old):
+        self.mask = mask
+        self.new = new
+        self.old = old
+
+
+def supports(compiled): # return Bool
+    if np is None:
+        return False
+    for funcs in compiled.func_name_to_ast.values():
+        for func_def in funcs.values():
+            if isinstance(func_def, FuncStub) and not func_def.is_parsed():
+                return False
+            for node in iter_elements(func_def):
+                if node.elem_type == InterpreterBase.NEW_NODE:
+                    return False
+                if node.elem_type in (InterpreterBase.VAR_NODE, "=") and node.fields:
+                    return False
+                if node.elem_type == InterpreterBase.FCALL_NODE and isinstance(node.target, Builtin):
+                    target = node.target
+                    if target.name not in RESERVED and not (target.strict and target.pure):
+                        return False
+    return True
+
+
+def run(compiled, lane_inputs): # return list of the output log of each lane, or None for a dropped lane
+    return LaneRun(compiled, lane_inputs).run()
+
+
+class LaneRun:
+    def __init__(self, compiled, lane_inputs):
+        self.n = len(lane_inputs)
+        self.func_name_to_ast = compiled.func_name_to_ast
+        self.inputs = lane_inputs
+        self.cursors = [0] * self.n
+        self.outputs = [[] for _ in range(self.n)]
+        self.alive = np.ones(self.n, bool)  # lanes not dropped yet
+        self.env = []  # function frames, each a list of scope dicts: the same shape as EnvironmentManager's
+        self.nil = Lanes.filled(self.n, NIL, None)
+
+    def run(self): # return list of output logs, or None for each dropped lane
+        main = self.func_name_to_ast.get("main", {}).get(0)
+        try:
+            if main is None:
+                self.__drop(self.alive)
+            else:
+                self.__call_user_func(main, [], self.alive.copy(), [])
+        except RecursionError: # deeper than a lone run's stack would be; run them all alone
+            self.__drop(self.alive)
+        return [output if alive else None for output, alive in zip(self.outputs, self.alive)]
+
+    def error(self, error_type, description=None): # for builtins; the lane is dropped
+        raise LaneError(f"{error_type}: {description}")
+
+    def __drop(self, mask): # no return
+        self.alive &= ~mask
+
+    # statements
+
+    def __run_statements(self, statements, mask): # return (mask of the lanes that returned, their values)
+        self.env[-1].append({})
+        returned = np.zeros(self.n, bool)
+        values = self.nil
+        for statement in statements:
+            active = mask & ~returned & self.alive
+            if not active.any():
+                break
+            status = self.__run_statement(statement, active)
+            if status is not None:
+                ret_mask, ret_values = status
+                values = _select(ret_mask, ret_values, values)
+                returned |= ret_mask
+        self.env[-1].pop()
+        return returned & self.alive, values
+
+    def __run_statement(self, statement, mask): # return (returned mask, values), or None if none can return
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_NODE:
+            self.__call_func(statement, mask, None)
+        elif kind == "=":
+            self.__assign(statement, mask)
+        elif kind == InterpreterBase.VAR_DEF_NODE:
+            scope = self.env[-1][-1]
+            if statement.name in scope:
+                self.__drop(mask)
+            else:
+                scope[statement.name] = self.nil
+        elif kind == InterpreterBase.RETURN_NODE:
+            if statement.expression is None:
+                return mask, self.nil
+            values = self.__eval(statement.expression, mask, None)
+            return mask & self.alive, values
+        elif kind == InterpreterBase.IF_NODE:
+            return self.__do_if(statement, mask)
+        elif kind == InterpreterBase.FOR_NODE:
+            return self.__do_for(statement, mask)
+        elif kind == InterpreterBase.RAISE_NODE:
+            self.__drop(mask) # caught or not, the lane's own run takes it from here
+        elif kind == InterpreterBase.TRY_NODE:
+            self.env[-1].append({})
+            status = self.__run_statements(statement.statements, mask)
+            self.env[-1].pop()
+            return status
+        elif kind == cse.DEF_NODE:
+            scope = self.env[-1][-1]
+            if statement.name not in scope:
+                scope[statement.name] = LaneThunk(statement.expression, self.__snapshot(), self.n)
+        return None
+
+    def __assign(self, assign_ast, mask): # no return
+        thunk = LaneThunk(assign_ast.expression, self.__snapshot(), self.n)
+        for scope in reversed(self.env[-1]):
+            if assign_ast.name in scope:
+                if (self.alive & ~mask).any(): # other lanes may still read the old binding
+                    thunk = Select(mask, thunk, scope[assign_ast.name])
+                scope[assign_ast.name] = thunk
+                return
+        self.__drop(mask)
+
+    def __do_if(self, if_ast, mask): # return (returned mask, values)
+        taken, not_taken = self.__condition(if_ast.condition, mask)
+        returned, values = self.__run_statements(if_ast.statements, taken) if taken.any() else (taken, self.nil)
+        if if_ast.else_statements is not None and not_taken.any():
+            else_returned, else_values = self.__run_statements(if_ast.else_statements, not_taken)
+            values = _select(else_returned, else_values, values)
+            returned = returned | else_returned
+        return returned, values
+
+    def __do_for(self, for_ast, mask): # return (returned mask, values)
+        self.__run_statement(for_ast.init, mask)
+        returned = np.zeros(self.n, bool)
+        values = self.nil
+        looping = mask & self.alive
+        while looping.any():
+            looping, _ = self.__condition(for_ast.condition, looping)
+            if not looping.any():
+                break
+            self.env[-1].append({})  # the scope of each iteration
+            body_returned, body_values = self.__run_statements(for_ast.statements, looping)
+            self.env[-1].pop()
+            values = _select(body_returned, body_values, values)
+            returned |= body_returned
+            looping &= ~body_returned & self.alive
+            if looping.any():
+                self.__run_statement(for_ast.update, looping)
+                looping &= self.alive
+        return returned, values
+
+    def __condition(self, cond_ast, mask): # return (mask of lanes where it is true, where it is false)
+        result = self.__eval(cond_ast, mask, None)
+        mask = mask & self.alive
+        self.__drop(mask & (result.kinds != BOOL))
+        mask &= self.alive
+        true = mask & result.vals.astype(bool)
+        return true, mask & ~true
+
+    # expressions; scope is the snapshot a thunk evaluates in, or None for the current scopes
+
+    def __eval(self, expr_ast, mask, scope): # return Lanes
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.NIL_NODE:
+            return self.nil
+        if kind == InterpreterBase.INT_NODE:
+            return Lanes.filled(self.n, INT, expr_ast.val)
+        if kind == InterpreterBase.STRING_NODE:
+            return Lanes.filled(self.n, STRING, expr_ast.val)
+        if kind == InterpreterBase.BOOL_NODE:
+            return Lanes.filled(self.n, BOOL, expr_ast.val)
+        if kind in (InterpreterBase.VAR_NODE, cse.REF_NODE):
+            binding = self.__lookup(expr_ast.name, scope)
+            if binding is None:
+                self.__drop(mask)
+                return self.nil
+            return self.__force(binding, mask)
+        if kind == InterpreterBase.FCALL_NODE:
+            return self.__call_func(expr_ast, mask, scope)
+        if kind in ("&&", "||"):
+            return self.__eval_short_circuit(expr_ast, mask, scope)
+        if kind in ARITH_OPS or kind in COMPARE_OPS or kind in ("==", "!="):
+            return self.__eval_op(expr_ast, mask, scope)
+        # as in interpreterv4, the operand of a unary op is read from the current scopes even in a thunk
+        if kind == InterpreterBase.NEG_NODE:
+            return self.__eval_unary(expr_ast, mask, INT, lambda vals: -1 * vals)
+        if kind == InterpreterBase.NOT_NODE:
+            return self.__eval_unary(expr_ast, mask, BOOL, lambda vals: ~vals.astype(bool))
+        self.__drop(mask)
+        return self.nil
+
+    def __lookup(self, name, scope): # return binding, or None
+        for bindings in reversed(self.env[-1] if scope is None else scope):
+            if name in bindings:
+                return bindings[name]
+        return None
+
+    # thunks only ever read the current function's scopes, so that is all a snapshot holds
+    def __snapshot(self): # return list of scope dicts
+        return [dict(bindings) for bindings in self.env[-1]]
+
+    def __force(self, binding, mask): # return Lanes
+        if isinstance(binding, Lanes):
+            return binding
+        if isinstance(binding, Select):
+            new_mask = mask & binding.mask
+            old_mask = mask & ~binding.mask
+            new = self.__force(binding.new, new_mask) if new_mask.any() else self.nil
+            old = self.__force(binding.old, old_mask) if old_mask.any() else self.nil
+            return _select(binding.mask, new, old)
+        need = mask & ~binding.done & self.alive
+        if need.any():
+            value = self.__eval(binding.expr_ast, need, binding.scope)
+            binding.value.kinds[need] = value.kinds[need]
+            binding.value.vals[need] = value.vals[need]
+            binding.done |= need
+        return binding.value
+
+    def __eval_short_circuit(self, expr_ast, mask, scope): # return Lanes
+        left = self.__eval(expr_ast.op1, mask, scope)
+        mask = mask & self.alive
+        truthy = left.vals.astype(bool)
+        decided = mask & (~truthy if expr_ast.elem_type == "&&" else truthy)
+        rest = mask & ~decided
+        right = self.__eval(expr_ast.op2, rest, scope) if rest.any() else self.nil
+        return _select(decided, Lanes.filled(self.n, BOOL, expr_ast.elem_type == "||"), right)
+
+    def __eval_op(self, expr_ast, mask, scope): # return Lanes
+        op = expr_ast.elem_type
+        left = self.__eval(expr_ast.op1, mask, scope)
+        right = self.__eval(expr_ast.op2, mask & self.alive, scope)
+        mask = mask & self.alive
+        result = Lanes.filled(self.n, BOOL, False)
+        if op in ("==", "!="):
+            same = mask & (left.kinds == right.kinds)
+            equal = np.zeros(self.n, bool)
+            if same.any():
+                equal[same] = (left.vals[same] == right.vals[same]).astype(bool)
+            result.vals[mask] = (equal[mask] if op == "==" else ~equal[mask]).astype(object)
+            return result
+        if op == "/":
+            self.__drop(mask & (right.vals == 0)) # div0, whatever the types
+        allowed = (INT, STRING) if op == "+" else (INT,)
+        self.__drop(mask & ((left.kinds != right.kinds) | ~np.isin(left.kinds, allowed)))
+        mask &= self.alive
+        if not mask.any():
+            return result
+        if op in COMPARE_OPS:
+            result.vals[mask] = COMPARE_OPS[op](left.vals[mask], right.vals[mask]).astype(bool).astype(object)
+            return result
+        result.kinds[mask] = left.kinds[mask]
+        result.vals[mask] = ARITH_OPS[op](left.vals[mask], right.vals[mask])
+        return result
+
+    def __eval_unary(self, expr_ast, mask, kind, f): # return Lanes
+        operand = self.__eval(expr_ast.op1, mask, None)
+        mask = mask & self.alive
+        self.__drop(mask & (operand.kinds != kind))
+        mask &= self.alive
+        result = Lanes.filled(self.n, kind, None)
+        if mask.any():
+            result.vals[mask] = f(operand.vals[mask]).astype(object)
+        return result
+
+    # calls
+
+    def __call_func(self, call_ast, mask, scope): # return Lanes
+        target = call_ast.target
+        if isinstance(target, Builtin):
+            return self.__call_builtin(target, call_ast.args, mask, scope)
+        if not isinstance(target, Element): # an UnresolvedCall
+            self.__drop(mask)
+            return self.nil
+        return self.__call_user_func(target, call_ast.args, mask, scope)
+
+    def __call_user_func(self, func_ast, actual_args, mask, scope): # return Lanes
+        snapshot = self.__snapshot() if scope is None else scope
+        frame = {}
+        for formal_ast, actual_ast in zip(func_ast.args, actual_args):
+            frame.setdefault(formal_ast.name, LaneThunk(actual_ast, snapshot, self.n))
+        self.env.append([frame])
+        returned, values = self.__run_statements(func_ast.statements, mask)
+        self.env.pop()
+        return _select(returned, values, self.nil)
+
+    def __call_builtin(self, builtin, actual_args, mask, scope): # return Lanes
+        args = []
+        for arg in actual_args:
+            args.append(self.__eval(arg, mask, scope))
+            mask = mask & self.alive
+        if builtin.name == "print":
+            for lane in np.flatnonzero(mask):
+                self.outputs[lane].append("".join(_printable(arg, lane) for arg in args))
+            return self.nil
+        if builtin.name in ("inputi", "inputs"):
+            return self.__read_input(builtin.name, args, mask)
+        result = Lanes.filled(self.n, NIL, None)
+        for lane in np.flatnonzero(mask):
+            try:
+                value = builtin.func(self, [Value(TYPES[arg.kinds[lane]], arg.vals[lane]) for arg in args])
+                result.kinds[lane] = KINDS[value.type()]
+                result.vals[lane] = value.value()
+            except Exception: # a Brewin error, or a type lanes can't hold
+                self.alive[lane] = False
+        return result
+
+    def __read_input(self, name, args, mask): # return Lanes
+        result = Lanes.filled(self.n, INT if name == "inputi" else STRING, None)
+        for lane in np.flatnonzero(mask):
+            if args:
+                self.outputs[lane].append(_printable(args[0], lane))  # the prompt
+            inp = self.inputs[lane]
+            if not inp or self.cursors[lane] >= len(inp): # the keyboard, or past the end
+                self.alive[lane] = False
+                continue
+            text = inp[self.cursors[lane]]
+            self.cursors[lane] += 1
+            try:
+                result.vals[lane] = int(text) if name == "inputi" else text
+            except (TypeError, ValueError):
+                self.alive[lane] = False
+        return result
+
+
+def _select(mask, a, b): # return Lanes: a in the lanes of mask, b in the rest
+    return Lanes(np.where(mask, a.kinds, b.kinds), np.where(mask, a.vals, b.vals))
+
+
+def _printable(lanes, lane): # return str, as get_printable prints the lane's value
+    kind, val = lanes.kinds[lane], lanes.vals[lane]
+    if kind == NIL:
+        return "nil"
+    if kind == BOOL:
+        return "true" if val is True else "false"
+    return str(val) if kind == INT else val
@@ -0,0 +1,350 @@
+"""
+Optional analysis that evaluates side-effect-free counted for loops without
+running their body once per iteration.
+
+A loop qualifies when its body only contains assignments of integer arithmetic
+(+, -, * and / over int literals, the loop variable and variables the body
+never assigns). Each assignment must have one of these shapes:
+
+    v = v + f - g + ...    (reduction, v appearing once with a plus sign)
+    v = v * k              (k loop-invariant)
+    v = f                  (last value wins)
+
+where f never mentions a variable assigned in the body. Any print, call, field
+access or other statement keeps the loop in the interpreter.
+
+Since f is a polynomial in the loop variable whenever it has no division, the
+reductions are summed in closed form with exact big-int arithmetic. Loops that
+divide are vectorized with NumPy (if installed) after an interval check proves
+no int64 overflow and no division by zero; otherwise they fall back to the
+interpreter.
+"""
+
+from math import comb
+
+from element import Element
+from intbase import InterpreterBase
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional
+    np = None
+
+ARITH_OPS = {"+", "-", "*", "/"}
+MAX_DEGREE = 8  # keeps the closed forms small; higher degrees go to numpy
+INT64_LIMIT = 2**62  # leave headroom below 2**63 for the final additions
+
+
+class LoopPlan:
+    def __init__(self, var_name, cond_op, bound_ast, assignments, invariants):
+        self.var_name = var_name
+        self.cond_op = cond_op
+        self.bound_ast = bound_ast
+        self.assignments = assignments  # list of (kind, target, expr_ast)
+        self.invariants = invariants  # variable names read but never assigned by the body
+
+
+# returns a LoopPlan, or None if the loop body is not a pure arithmetic reduction
+def plan_loop(for_ast, var_name):
+    assigned = set()
+    statements = for_ast.get("statements")
+    for statement in statements:
+        if statement.elem_type != "=" or statement.get("fields") or statement.get("name") in assigned:
+            return None
+        assigned.add(statement.get("name"))
+    if var_name in assigned:
+        return None
+
+    assignments = []
+    read = set()
+    for statement in statements:
+        target = statement.get("name")
+        expr_ast = statement.get("expression")
+        kind, term, parts = _classify(target, expr_ast)
+        names = set()
+        for part in parts:
+            part_names = _names_in(part)
+            if part_names is None or part_names & assigned:
+                return None
+            names |= part_names
+        read |= names
+        if kind == "product" and var_name in names:
+            return None
+        assignments.append((kind, target, term))
+
+    bound_ast = for_ast.get("condition").get("op2")
+    bound_names = _names_in(bound_ast)
+    if bound_names is None or bound_names & assigned or var_name in bound_names:
+        return None
+    read |= bound_names
+    read.discard(var_name)
+    cond_op = for_ast.get("condition").elem_type
+    return LoopPlan(var_name, cond_op, bound_ast, assignments, read)
+
+
+# returns (method, iterations, {var_name: int}) or None if the interpreter has to run the loop;
+# lookup(name) must return the variable's value if it is already a forced int, else None, and
+# declared(name) whether the variable is in scope at all
+def run_plan(plan, start, step, lookup, declared):
+    env = {}
+    for name in plan.invariants:
+        value = lookup(name)
+        if value is None:
+            return None
+        env[name] = value
+    for kind, target, _ in plan.assignments:
+        if kind != "assign":
+            value = lookup(target)
+            if value is None:
+                return None
+            env[target] = value
+        elif not declared(target):
+            return None
+
+    iterations = _trip_count(plan.cond_op, start, _eval_int(plan.bound_ast, env), step)
+    if iterations is None:
+        return None
+
+    results = _closed_form(plan, env, start, step, iterations)
+    method = "closed form"
+    if results is None:
+        results = _vectorized(plan, env, start, step, iterations)
+        method = "numpy"
+    if results is None:
+        return None
+    results[plan.var_name] = start + step * iterations
+    return method, iterations, results
+
+
+# returns (kind, term, parts): the term to evaluate per iteration and the source subtrees it is made of
+def _classify(target, expr_ast):
+    if expr_ast.elem_type == "*":
+        for own, other in ((expr_ast.get("op1"), expr_ast.get("op2")), (expr_ast.get("op2"), expr_ast.get("op1"))):
+            if _is_var(own, target):
+                return "product", other, [other]
+    terms = _split_sum(expr_ast, 1)
+    own_signs = [sign for sign, term in terms if _is_var(term, target)]
+    if own_signs == [1]:
+        rest = [(sign, term) for sign, term in terms if not _is_var(term, target)]
+        return "add", _join_sum(rest), [term for _, term in rest]
+    return "assign", expr_ast, [expr_ast]
+
+
+# flattens a chain of + and - into signed terms
+def _split_sum(expr_ast, sign):
+    if expr_ast.elem_type in ("+", "-"):
+        op2_sign = sign if expr_ast.elem_type == "+" else -sign
+        return _split_sum(expr_ast.get("op1"), sign) + _split_sum(expr_ast.get("op2"), op2_sign)
+    return [(sign, expr_ast)]
+
+
+def _join_sum(terms):
+    if not terms:
+        return Element(InterpreterBase.INT_NODE, val=0)
+    sign, total = terms[0]
+    if sign < 0:
+        total = Element(InterpreterBase.NEG_NODE, op1=total)
+    for sign, term in terms[1:]:
+        total = Element("+" if sign > 0 else "-", op1=total, op2=term)
+    return total
+
+
+def _is_var(expr_ast, name):
+    return (
+        expr_ast.elem_type == InterpreterBase.VAR_NODE
+        and expr_ast.get("name") == name
+        and not expr_ast.get("fields")
+    )
+
+
+# returns the set of variables read by an arithmetic expression, or None if it is not one
+def _names_in(expr_ast):
+    if expr_ast.elem_type == InterpreterBase.INT_NODE:
+        return set()
+    if expr_ast.elem_type == InterpreterBase.VAR_NODE:
+        if expr_ast.get("fields"):
+            return None
+        return {expr_ast.get("name")}
+    if expr_ast.elem_type == InterpreterBase.NEG_NODE and expr_ast.get("op1").elem_type == InterpreterBase.INT_NODE:
+        return set()  # a negative literal; other unary minus is left to the interpreter
+    if expr_ast.elem_type in ARITH_OPS:
+        left = _names_in(expr_ast.get("op1"))
+        right = _names_in(expr_ast.get("op2"))
+        if left is None or right is None:
+            return None
+        return left | right
+    return None
+
+
+def _eval_int(expr_ast, env):
+    if expr_ast.elem_type == InterpreterBase.INT_NODE:
+        return expr_ast.get("val")
+    if expr_ast.elem_type == InterpreterBase.NEG_NODE:
+        return -expr_ast.get("op1").get("val")
+    if expr_ast.elem_type == InterpreterBase.VAR_NODE:
+        return env.get(expr_ast.get("name"))
+    return None
+
+
+def _trip_count(cond_op, start, bound, step):
+    if bound is None:
+        return None
+    if cond_op == "<=":
+        cond_op, bound = "<", bound + 1
+    elif cond_op == ">=":
+        cond_op, bound = ">", bound - 1
+    if cond_op == "<" and start >= bound or cond_op == ">" and start <= bound:
+        return 0
+    if cond_op == "<" and step <= 0 or cond_op == ">" and step >= 0:
+        return None  # never terminates; leave that to the interpreter
+    return -((start - bound) // step)
+
+
+# polynomials are coefficient lists in k, where the loop variable is start + step * k
+def _poly(expr_ast, env, var_name, start, step):
+    if expr_ast.elem_type == InterpreterBase.INT_NODE:
+        return [expr_ast.get("val")]
+    if expr_ast.elem_type == InterpreterBase.VAR_NODE:
+        if expr_ast.get("name") == var_name:
+            return [start, step]
+        return [env[expr_ast.get("name")]]
+    if expr_ast.elem_type == InterpreterBase.NEG_NODE:
+        inner = _poly(expr_ast.get("op1"), env, var_name, start, step)
+        return None if inner is None else [-c for c in inner]
+    if expr_ast.elem_type == "/":
+        return None
+    left = _poly(expr_ast.get("op1"), env, var_name, start, step)
+    right = _poly(expr_ast.get("op2"), env, var_name, start, step)
+    if left is None or right is None:
+        return None
+    if expr_ast.elem_type == "*":
+        if len(left) + len(right) - 2 > MAX_DEGREE:
+            return None
+        product = [0] * (len(left) + len(right) - 1)
+        for i, a in enumerate(left):
+            for j, b in enumerate(right):
+                product[i + j] += a * b
+        return product
+    sign = 1 if expr_ast.elem_type == "+" else -1
+    total = [0] * max(len(left), len(right))
+    for i, a in enumerate(left):
+        total[i] += a
+    for i, b in enumerate(right):
+        total[i] += sign * b
+    return total
+
+
+def _power_sums(n, degree):  # [sum(k**d for k in range(n)) for d in 0..degree]
+    sums = []
+    for d in range(degree + 1):
+        total = n ** (d + 1) - sum(comb(d + 1, t) * sums[t] for t in range(d))
+        sums.append(total // (d + 1))
+    return sums
+
+
+def _closed_form(plan, env, start, step, n):
+    results = {}
+    for kind, target, term in plan.assignments:
+        if kind == "product":
+            factor = _eval_invariant(term, env)
+            if factor is None:
+                return None
+            results[target] = env[target] * factor**n
+            continue
+        poly = _poly(term, env, plan.var_name, start, step)
+        if poly is None:
+            return None
+        if kind == "assign":
+            if n:
+                results[target] = sum(c * (n - 1) ** d for d, c in enumerate(poly))
+            continue
+        sums = _power_sums(n, len(poly) - 1)
+        total = sum(c * s for c, s in zip(poly, sums))
+        results[target] = env[target] + total
+    return results
+
+
+def _eval_invariant(expr_ast, env):
+    poly = _poly(expr_ast, env, None, 0, 0)
+    if poly is None or any(poly[1:]):
+        return None
+    return poly[0]
+
+
+# interval arithmetic over the loop range; returns (lo, hi) or None if int64 or div0 is at risk
+def _bounds(expr_ast, env, var_name, var_bounds):
+    elem_type = expr_ast.elem_type
+    if elem_type == InterpreterBase.INT_NODE:
+        lo = hi = expr_ast.get("val")
+    elif elem_type == InterpreterBase.VAR_NODE:
+        name = expr_ast.get("name")
+        lo, hi = var_bounds if name == var_name else (env[name], env[name])
+    elif elem_type == InterpreterBase.NEG_NODE:
+        inner = _bounds(expr_ast.get("op1"), env, var_name, var_bounds)
+        if inner is None:
+            return None
+        lo, hi = -inner[1], -inner[0]
+    else:
+        left = _bounds(expr_ast.get("op1"), env, var_name, var_bounds)
+        right = _bounds(expr_ast.get("op2"), env, var_name, var_bounds)
+        if left is None or right is None:
+            return None
+        if elem_type == "/" and right[0] <= 0 <= right[1]:
+            return None
+        combine = {
+            "+": lambda a, b: a + b,
+            "-": lambda a, b: a - b,
+            "*": lambda a, b: a * b,
+            "/": lambda a, b: a // b,
+        }[elem_type]
+        corners = [combine(a, b) for a in left for b in right]
+        lo, hi = min(corners), max(corners)
+    if max(abs(lo), abs(hi)) >= INT64_LIMIT:
+        return None
+    return lo, hi
+
+
+def _vec_eval(expr_ast, env, var_name, index):
+    elem_type = expr_ast.elem_type
+    if elem_type == InterpreterBase.INT_NODE:
+        return expr_ast.get("val")
+    if elem_type == InterpreterBase.VAR_NODE:
+        name = expr_ast.get("name")
+        return index if name == var_name else env[name]
+    if elem_type == InterpreterBase.NEG_NODE:
+        return -_vec_eval(expr_ast.get("op1"), env, var_name, index)
+    left = _vec_eval(expr_ast.get("op1"), env, var_name, index)
+    right = _vec_eval(expr_ast.get("op2"), env, var_name, index)
+    if elem_type == "+":
+        return left + right
+    if elem_type == "-":
+        return left - right
+    if elem_type == "*":
+        return left * right
+    return np.floor_divide(left, right)
+
+
+def _vectorized(plan, env, start, step, n):
+    if np is None:
+        return None
+    if n == 0:
+        return {target: env[target] for kind, target, _ in plan.assignments if kind != "assign"}
+    last = start + step * (n - 1)
+    var_bounds = (min(start, last), max(start, last))
+    if max(abs(start), abs(last)) >= INT64_LIMIT:
+        return None
+    index = np.arange(n, dtype=np.int64) * step + start
+    results = {}
+    for kind, target, term in plan.assignments:
+        if kind == "product":
+            return None  # exact powers are handled by the closed form
+        bounds = _bounds(term, env, plan.var_name, var_bounds)
+        if bounds is None or n * max(abs(bounds[0]), abs(bounds[1])) >= INT64_LIMIT:
+            return None
+        values = _vec_eval(term, env, plan.var_name, index)
+        if kind == "assign":
+            results[target] = int(np.broadcast_to(values, (n,))[-1])
+            continue
+        total = int(np.sum(np.broadcast_to(values, (n,)), dtype=np.int64))
+        results[target] = env[target] + total
+    return results
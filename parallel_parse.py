@@ -0,0 +1,100 @@
+"""
+Parsing large Brewin programs in several processes at once.
+
+    with ParallelParser(workers=4) as parser:
+        ast = parser.parse(source)
+
+brewscan.scan splits the program at its top-level definitions, and the
+definitions are grouped into contiguous chunks of a few per worker. Each chunk
+is parsed in a ProcessPoolExecutor with the usual grammar, strictly and from
+the line it starts on, and comes back as binast bytes rather than pickled
+Elements. The chunks' functions are then joined into one program node, in
+source order; the first chunk holds all the structs (the grammar puts them
+first) and at least one function, so it parses as a program on its own.
+
+A program that doesn't split cleanly, is smaller than MIN_CHUNK_BYTES per
+chunk, or has a syntax error in some chunk is parsed in this process with
+brewparse, so its tree and its syntax errors are exactly brewparse's. The
+nodes that come back are binast's, which decode their fields when first read.
+"""
+
+import contextlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import binast
+import brewparse
+from brewscan import scan
+from element import Element
+from intbase import InterpreterBase
+
+MIN_CHUNK_BYTES = 64 * 1024  # smaller chunks cost more to ship than to parse here
+CHUNKS_PER_WORKER = 2  # a few per worker, so one slow chunk doesn't hold up the others
+
+
+class ParallelParser:
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None  # started on the first program worth splitting
+        self.stats = {"parallel": 0, "serial": 0, "chunks": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def parse(self, program): # return program Element
+        chunks = self.__chunks(program)
+        if chunks is None:
+            self.stats["serial"] += 1
+            return brewparse.parse_program(program)
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers)
+        futures = [self.pool.submit(_parse_chunk, program[start:end], line) for start, end, line in chunks]
+        try:
+            trees = [binast.loads(future.result()) for future in futures]
+        except SyntaxError: # parsed again here so ply reports it as it always does
+            self.stats["serial"] += 1
+            return brewparse.parse_program(program)
+        self.stats["parallel"] += 1
+        self.stats["chunks"] += len(chunks)
+        functions = [func_def for tree in trees for func_def in tree.functions]
+        return Element(InterpreterBase.PROGRAM_NODE, structs=trees[0].structs, functions=functions)
+
+    def close(self): # no return
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    # contiguous runs of definitions, each starting at a func, about the same size
+    def __chunks(self, program): # return list of (start, end, line), or None to parse program whole
+        if self.workers < 2 or len(program) < 2 * MIN_CHUNK_BYTES:
+            return None
+        spans = scan(program)
+        if not spans or spans[-1].kind != "func":
+            return None
+        first_func = next(i for i, span in enumerate(spans) if span.kind == "func")
+        if any(span.kind != "func" for span in spans[first_func:]):
+            return None
+        target = max(MIN_CHUNK_BYTES, len(program) // (self.workers * CHUNKS_PER_WORKER))
+        chunks = []
+        start, line = 0, 1
+        for span in spans[first_func + 1 :]:
+            if span.start - start >= target:
+                chunks.append((start, span.start, line))
+                start, line = span.start, span.line
+        chunks.append((start, len(program), line))
+        return chunks if len(chunks) > 1 else None
+
+
+def parse_program(program, workers=None): # return program Element
+    with ParallelParser(workers) as parser:
+        return parser.parse(program)
+
+
+def _parse_chunk(text, line): # return binast bytes of the chunk's program
+    with contextlib.redirect_stdout(io.StringIO()): # the caller reparses a bad program and reports it then
+        ast = brewparse.parse_program(text, line, strict=True)
+    return binast.dumps(ast)
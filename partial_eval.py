@@ -0,0 +1,553 @@
+"""
+Partial evaluator: specializes a Brewin program for a known prefix of its inputs.
+
+    spec = partial_eval.specialize(interpreter, source, known_inputs)
+    for inputs in runs:  # every run starts with known_inputs
+        interpreter.run_many(spec.program, [spec.remaining_inputs(inputs)])
+
+Input values are baked in by tracing: the program is run once on the known
+prefix, recording which inputi()/inputs() call consumed each value. The program
+is deterministic, so every run that starts with the same prefix performs those
+same first reads. A read is replaced by its value when its call can only ever
+run once (in main, outside any loop, with no prompt) and all the reads before it
+were replaced as well, so the remaining inputs line up with the calls left over.
+
+The residual program is then simplified, in every function:
+
+  - constants are propagated through variables and folded (division by zero and
+    type errors are left for run time)
+  - if statements whose condition is a known bool run the chosen branch only
+  - for loops with a known, small trip count are unrolled
+  - pure builtins (see brewbuiltins) are precomputed on constant arguments
+  - calls from main to user functions with all-constant arguments get a copy
+    of the function specialized for those arguments, or are replaced by the
+    result when the copy reduces to returning a constant
+
+Branches and loop iterations are kept as `if (true) { ... }` blocks so their
+variables stay scoped as before. Variables are never replaced under unary - and
+!, since a thunk evaluates their operand in the current environment rather
+than its own; replacing those reads could change what the program does.
+"""
+
+from brewparse import parse_program
+from brewbuiltins import Builtin
+from element import Element, iter_elements
+from intbase import InterpreterBase
+from type_valuev2 import Type, Value
+
+MAX_UNROLL = 16  # iterations
+MAX_UNROLLED_NODES = 256  # iterations * size of the loop body
+INPUT_FUNCS = ("inputi", "inputs")
+LITERAL_NODES = {
+    InterpreterBase.INT_NODE: Type.INT,
+    InterpreterBase.STRING_NODE: Type.STRING,
+    InterpreterBase.BOOL_NODE: Type.BOOL,
+    InterpreterBase.NIL_NODE: Type.NIL,
+}
+COMPARE_OPS = {
+    "<": lambda x, y: x < y,
+    "<=": lambda x, y: x <= y,
+    ">": lambda x, y: x > y,
+    ">=": lambda x, y: x >= y,
+}
+INT_OPS = {
+    "+": lambda x, y: x + y,
+    "-": lambda x, y: x - y,
+    "*": lambda x, y: x * y,
+}
+
+
+# A specialized program; run it on the inputs that follow the known prefix
+class Specialization:
+    def __init__(self, program, consumed, stats):
+        self.program = program  # compiled interpreterv4.Program
+        self.consumed = consumed  # number of known inputs baked into the program
+        self.stats = stats
+
+    def remaining_inputs(self, inputs): # return list of inputs for the residual program
+        return list(inputs)[self.consumed:]
+
+
+def specialize(interpreter, source, known_inputs=()): # return Specialization
+    ast = parse_program(source)
+    # works on the program as written: the calls linked, which the rewrite needs, but no cse temporaries
+    plain = type(interpreter)(
+        False, list(known_inputs), builtins=interpreter.builtins, eliminate_subexpressions=False
+    )
+    plain.compile_ast(ast)
+    reads = _trace_reads(plain, source, list(known_inputs))
+    nodes = list(iter_elements(ast))
+    eligible = _single_run_input_calls(ast)
+    input_literals = {}
+    for index, value in reads:
+        if nodes[index] not in eligible:
+            break
+        input_literals[nodes[index]] = (value.type(), value.value())
+    specializer = _Specializer(input_literals)
+    residual = specializer.program(ast)
+    specializer.stats["inputs_consumed"] = len(input_literals)
+    return Specialization(interpreter.compile_ast(residual), len(input_literals), specializer.stats)
+
+
+class _OutOfInputs(Exception):
+    pass
+
+
+# runs the program on the known inputs, returning (node index, Value) for each input read in order
+def _trace_reads(tracer, source, known_inputs):
+    reads = []
+    if not known_inputs:
+        return reads
+
+    def recorder(index, builtin):
+        def call(interp, args):
+            if interp.input_reads >= len(known_inputs):
+                raise _OutOfInputs()
+            value = builtin.func(interp, args)
+            reads.append((index, value))
+            return value
+        return Builtin(builtin.name, builtin.arity, call, True, builtin.returns, False)
+
+    compiled = tracer.compile(source)
+    for index, node in enumerate(iter_elements(compiled.ast)):
+        target = getattr(node, "target", None)
+        if isinstance(target, Builtin) and target.name in INPUT_FUNCS:
+            node.target = recorder(index, target)
+    try:
+        tracer.run_program(compiled)
+    except Exception: # out of known inputs, or the program failed: either way the trace so far holds
+        pass
+    return reads
+
+
+# input calls that run at most once per run: no prompt, in main, outside any loop, main never called
+def _single_run_input_calls(ast): # return set of fcall nodes
+    main = None
+    for func_ast in ast.get("functions"):
+        if func_ast.get("name") == "main" and not func_ast.get("args"):
+            main = func_ast
+    if main is None:
+        return set()
+    for node in iter_elements(ast):
+        if node.elem_type == InterpreterBase.FCALL_NODE and node.get("name") == "main":
+            return set()
+    calls = set()
+    stack = list(main.get("statements"))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, Element) and node.elem_type != InterpreterBase.FOR_NODE:
+            if (
+                node.elem_type == InterpreterBase.FCALL_NODE
+                and node.get("name") in INPUT_FUNCS
+                and not node.get("args")
+            ):
+                calls.add(node)
+            stack.extend(node.get(key) for key in node.FIELDS)
+    return calls
+
+
+def _literal_of(node): # return (type, value) or None
+    t = LITERAL_NODES.get(node.elem_type)
+    if t is None:
+        return None
+    return (t, node.get("val"))
+
+
+def _node_of(literal): # return literal Element
+    t, v = literal
+    if t == Type.NIL:
+        return Element(InterpreterBase.NIL_NODE)
+    for elem_type, node_type in LITERAL_NODES.items():
+        if node_type == t:
+            return Element(elem_type, val=v)
+    return None
+
+
+def _fold_binary(op, left, right): # return (type, value) or None, mirroring Interpreter.__setup_ops
+    if op == "==":
+        return (Type.BOOL, left[0] == right[0] and left[1] == right[1])
+    if op == "!=":
+        return (Type.BOOL, left[0] != right[0] or left[1] != right[1])
+    if left[0] != right[0]:
+        return None
+    if left[0] == Type.INT:
+        if op in INT_OPS:
+            return (Type.INT, INT_OPS[op](left[1], right[1]))
+        if op == "/":
+            return None if right[1] == 0 else (Type.INT, left[1] // right[1])
+        if op in COMPARE_OPS:
+            return (Type.BOOL, COMPARE_OPS[op](left[1], right[1]))
+    if left[0] == Type.STRING and op == "+":
+        return (Type.STRING, left[1] + right[1])
+    return None
+
+
+def _assigned_names(node): # return set of variable names assigned anywhere under node
+    return {
+        n.get("name") for n in iter_elements(node) if n.elem_type == "=" and not n.get("fields")
+    }
+
+
+def _var_names(node): # return set of variable names read anywhere under node
+    return {n.get("name") for n in iter_elements(node) if n.elem_type == InterpreterBase.VAR_NODE}
+
+
+# evaluation context for folding pure builtins: any error just means "don't fold"
+class _FoldContext:
+    def error(self, error_type, description=None, line_num=None):
+        raise ValueError(description)
+
+
+# Rewrites a program, tracking what is known about each variable. Knowledge mirrors the
+# environment: a list of scopes, each mapping a name to its (type, value) if known, else None.
+class _Specializer:
+    def __init__(self, input_literals):
+        self.input_literals = input_literals
+        self.clones = {}  # (func_ast, constant args) -> specialized func_ast
+        self.new_functions = []
+        self.specialize_calls = False
+        self.stats = {"folded": 0, "branches_resolved": 0, "loops_unrolled": 0, "specialized_calls": 0}
+
+    def program(self, ast): # return residual program Element
+        functions = []
+        for func_ast in ast.get("functions"):
+            self.specialize_calls = func_ast.get("name") == "main"
+            functions.append(self.__function(func_ast, {}, func_ast.get("name")))
+        self.specialize_calls = False
+        return Element(
+            InterpreterBase.PROGRAM_NODE,
+            structs=ast.get("structs"),
+            functions=functions + self.new_functions,
+        )
+
+    def __function(self, func_ast, arg_literals, name): # return func Element
+        knowledge = [{arg.get("name"): arg_literals.get(arg.get("name")) for arg in func_ast.get("args")}]
+        statements, _ = self.__block(func_ast.get("statements"), knowledge)
+        return Element(
+            InterpreterBase.FUNC_NODE,
+            name=name,
+            args=func_ast.get("args"),
+            return_type=func_ast.get("return_type"),
+            statements=statements,
+        )
+
+    # knowledge helpers
+
+    def __lookup(self, knowledge, name):
+        for scope in reversed(knowledge):
+            if name in scope:
+                return scope[name]
+        return None
+
+    def __set(self, knowledge, name, literal):
+        for scope in reversed(knowledge):
+            if name in scope:
+                scope[name] = literal
+                return
+
+    def __forget(self, knowledge, names):
+        for scope in knowledge:
+            for name in names:
+                if name in scope:
+                    scope[name] = None
+
+    def __join(self, knowledge, other): # merge other into knowledge, keeping only what both agree on
+        for scope, other_scope in zip(knowledge, other):
+            for name, literal in scope.items():
+                if other_scope.get(name) != literal:
+                    scope[name] = None
+
+    # statements
+
+    def __block(self, statements, knowledge): # return (statements, knowledge after the block)
+        inner = [dict(scope) for scope in knowledge] + [{}]
+        result = []
+        for statement in statements:
+            result.extend(self.__statement(statement, inner))
+        return result, inner[:-1]
+
+    def __statement(self, statement, knowledge): # return list of statements
+        kind = statement.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            knowledge[-1][statement.get("name")] = (Type.NIL, None)
+            return [statement]
+        if kind == "=":
+            expr_ast = self.__expr(statement.get("expression"), knowledge, True)
+            if not statement.get("fields"):
+                self.__set(knowledge, statement.get("name"), _literal_of(expr_ast))
+            return [Element("=", name=statement.get("name"), fields=statement.get("fields"), expression=expr_ast)]
+        if kind == InterpreterBase.FCALL_NODE:
+            call = self.__expr(statement, knowledge, True)
+            return [] if _literal_of(call) is not None else [call] # a precomputed pure call does nothing
+        if kind == InterpreterBase.RETURN_NODE:
+            expr_ast = statement.get("expression")
+            if expr_ast is not None:
+                expr_ast = self.__expr(expr_ast, knowledge, True)
+            return [Element(InterpreterBase.RETURN_NODE, expression=expr_ast)]
+        if kind == InterpreterBase.RAISE_NODE:
+            expr_ast = self.__expr(statement.get("exception_type"), knowledge, True)
+            return [Element(InterpreterBase.RAISE_NODE, exception_type=expr_ast)]
+        if kind == InterpreterBase.IF_NODE:
+            return self.__if(statement, knowledge)
+        if kind == InterpreterBase.FOR_NODE:
+            return self.__for(statement, knowledge)
+        if kind == InterpreterBase.TRY_NODE:
+            return self.__try(statement, knowledge)
+        return [statement]
+
+    def __if(self, if_ast, knowledge): # return list of statements
+        condition = self.__expr(if_ast.get("condition"), knowledge, True)
+        literal = _literal_of(condition)
+        if literal is not None and literal[0] == Type.BOOL:
+            self.stats["branches_resolved"] += 1
+            branch = if_ast.get("statements") if literal[1] else if_ast.get("else_statements")
+            if branch is None:
+                return []
+            statements, after = self.__block(branch, knowledge)
+            knowledge[:] = after
+            return [_always(statements)]
+
+        then_statements, after = self.__block(if_ast.get("statements"), knowledge)
+        else_statements = if_ast.get("else_statements")
+        if else_statements is not None:
+            else_statements, else_after = self.__block(else_statements, knowledge)
+            self.__join(after, else_after)
+        else:
+            self.__join(after, knowledge)
+        knowledge[:] = after
+        return [
+            Element(
+                InterpreterBase.IF_NODE,
+                condition=condition,
+                statements=then_statements,
+                else_statements=else_statements,
+            )
+        ]
+
+    def __for(self, for_ast, knowledge): # return list of statements
+        init = self.__statement(for_ast.get("init"), knowledge)
+        unrolled = self.__unroll(for_ast, knowledge)
+        if unrolled is not None:
+            self.stats["loops_unrolled"] += 1
+            return init + unrolled
+
+        self.__forget(knowledge, _assigned_names(for_ast.get("statements")) | _assigned_names(for_ast.get("update")))
+        condition = self.__expr(for_ast.get("condition"), knowledge, True)
+        statements, _ = self.__block(for_ast.get("statements"), knowledge)
+        update = self.__statement(for_ast.get("update"), [dict(scope) for scope in knowledge])[0]
+        return [
+            Element(
+                InterpreterBase.FOR_NODE,
+                init=init[0],
+                condition=condition,
+                update=update,
+                statements=statements,
+            )
+        ]
+
+    # unrolls for (i = a; i OP b; i = i +/- c) when a, b and c are known and the trip count is small
+    def __unroll(self, for_ast, knowledge): # return list of statements or None
+        var_name = for_ast.get("init").get("name")
+        condition = for_ast.get("condition")
+        update = for_ast.get("update")
+        statements = for_ast.get("statements")
+        if for_ast.get("init").get("fields") or update.get("name") != var_name or update.get("fields"):
+            return None
+        step = _step(update.get("expression"), var_name)
+        if step is None or condition.elem_type not in COMPARE_OPS:
+            return None
+        op1 = condition.get("op1")
+        if op1.elem_type != InterpreterBase.VAR_NODE or op1.get("name") != var_name or op1.get("fields"):
+            return None
+        assigned = _assigned_names(statements)
+        if var_name in assigned or assigned & _var_names(condition.get("op2")):
+            return None
+        start = self.__lookup(knowledge, var_name)
+        bound = _literal_of(self.__expr(condition.get("op2"), [dict(s) for s in knowledge], True))
+        if start is None or start[0] != Type.INT or bound is None or bound[0] != Type.INT:
+            return None
+
+        counters = []
+        counter = start[1]
+        while COMPARE_OPS[condition.elem_type](counter, bound[1]):
+            counters.append(counter)
+            counter += step
+            if len(counters) > MAX_UNROLL:
+                return None
+        body_size = sum(1 for _ in iter_elements(statements))
+        if len(counters) * body_size > MAX_UNROLLED_NODES:
+            return None
+
+        result = []
+        for counter in counters:
+            self.__set(knowledge, var_name, (Type.INT, counter))
+            body, after = self.__block(statements, knowledge)
+            knowledge[:] = after
+            next_value = (Type.INT, counter + step)
+            result.append(_always(body))
+            result.append(Element("=", name=var_name, fields=update.get("fields"), expression=_node_of(next_value)))
+            self.__set(knowledge, var_name, next_value)
+        return result
+
+    def __try(self, try_ast, knowledge): # return list of statements
+        # any statement in the try block may throw, so nothing it assigns is known in a catch or after
+        self.__forget(knowledge, _assigned_names(try_ast))
+        statements, _ = self.__block(try_ast.get("statements"), knowledge)
+        catchers = []
+        for catcher in try_ast.get("catchers"):
+            catch_statements, _ = self.__block(catcher.get("statements"), knowledge)
+            catchers.append(
+                Element(
+                    InterpreterBase.CATCH_NODE,
+                    exception_type=catcher.get("exception_type"),
+                    statements=catch_statements,
+                )
+            )
+        return [Element(InterpreterBase.TRY_NODE, statements=statements, catchers=catchers)]
+
+    # expressions; propagate is False under unary operators, see the module docstring
+
+    def __expr(self, expr_ast, knowledge, propagate): # return Element
+        kind = expr_ast.elem_type
+        if expr_ast in self.input_literals:
+            return _node_of(self.input_literals[expr_ast])
+        if kind in LITERAL_NODES or kind == InterpreterBase.NEW_NODE:
+            return expr_ast
+        if kind == InterpreterBase.VAR_NODE:
+            if propagate and not expr_ast.get("fields"):
+                literal = self.__lookup(knowledge, expr_ast.get("name"))
+                if literal is not None:
+                    return _node_of(literal)
+            return expr_ast
+        if kind == InterpreterBase.FCALL_NODE:
+            return self.__call(expr_ast, knowledge, propagate)
+        if kind in (InterpreterBase.NEG_NODE, InterpreterBase.NOT_NODE):
+            op1 = self.__expr(expr_ast.get("op1"), knowledge, False)
+            literal = _literal_of(op1)
+            if kind == InterpreterBase.NEG_NODE and literal is not None and literal[0] == Type.INT:
+                return self.__folded((Type.INT, -literal[1]))
+            if kind == InterpreterBase.NOT_NODE and literal is not None and literal[0] == Type.BOOL:
+                return self.__folded((Type.BOOL, not literal[1]))
+            return Element(kind, op1=op1)
+
+        op1 = self.__expr(expr_ast.get("op1"), knowledge, propagate)
+        op2 = self.__expr(expr_ast.get("op2"), knowledge, propagate)
+        left = _literal_of(op1)
+        if kind in ("&&", "||"):
+            if left is None:
+                return Element(kind, op1=op1, op2=op2)
+            self.stats["folded"] += 1
+            if kind == "&&":
+                return op2 if left[1] else _node_of((Type.BOOL, False))
+            return _node_of((Type.BOOL, True)) if left[1] else op2
+        right = _literal_of(op2)
+        if left is not None and right is not None:
+            folded = _fold_binary(kind, left, right)
+            if folded is not None:
+                return self.__folded(folded)
+        return Element(kind, op1=op1, op2=op2)
+
+    def __folded(self, literal):
+        self.stats["folded"] += 1
+        return _node_of(literal)
+
+    def __call(self, call_ast, knowledge, propagate): # return Element
+        args = [self.__expr(arg, knowledge, propagate) for arg in call_ast.get("args")]
+        literals = [_literal_of(arg) for arg in args]
+        target = call_ast.target
+        name = call_ast.get("name")
+        if None not in literals:
+            if isinstance(target, Builtin) and target.pure:
+                try:
+                    value = target.func(_FoldContext(), [Value(t, v) for t, v in literals])
+                    if value.type() in LITERAL_NODES.values():
+                        return self.__folded((value.type(), value.value()))
+                except Exception: # it fails at run time too; leave that to the interpreter
+                    pass
+            elif isinstance(target, Element) and self.specialize_calls and target.get("name") != "main":
+                clone = self.__clone(target, literals)
+                self.stats["specialized_calls"] += 1
+                result = _constant_result(clone)
+                if result is not None:
+                    return self.__folded(result)
+                name = clone.get("name")
+        return Element(InterpreterBase.FCALL_NODE, name=name, args=args)
+
+    def __clone(self, func_ast, literals): # return specialized func Element
+        key = (func_ast, tuple(literals))
+        if key not in self.clones:
+            # the name can't be written in Brewin, so it never clashes with a user function
+            name = f"{func_ast.get('name')}@{len(self.clones)}"
+            arg_literals = {arg.get("name"): literal for arg, literal in zip(func_ast.get("args"), literals)}
+            specialize_calls = self.specialize_calls
+            self.specialize_calls = False  # one level deep, so recursion terminates
+            self.clones[key] = self.__function(func_ast, arg_literals, name)
+            self.specialize_calls = specialize_calls
+            self.new_functions.append(self.clones[key])
+        return self.clones[key]
+
+
+# the value a call to func_ast always returns, if its body does nothing but bind variables
+# (without errors) and then return a constant
+def _constant_result(func_ast): # return (type, value) or None
+    statements = func_ast.get("statements")
+    if not statements or statements[-1].elem_type != InterpreterBase.RETURN_NODE:
+        return None
+    result = statements[-1].get("expression")
+    result = (Type.NIL, None) if result is None else _literal_of(result)
+    scopes = [{arg.get("name") for arg in func_ast.get("args")}]
+    if result is None or not _only_bindings(statements[:-1], scopes):
+        return None
+    return result
+
+
+def _only_bindings(statements, scopes): # return Bool
+    scopes = scopes + [set()]
+    for statement in statements:
+        kind = statement.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            if statement.get("name") in scopes[-1]:
+                return False # redefinition is a NAME_ERROR
+            scopes[-1].add(statement.get("name"))
+        elif kind == "=":
+            if statement.get("fields") or not any(statement.get("name") in scope for scope in scopes):
+                return False
+            # the value is a thunk nobody forces, but keep anything with side effects
+            for node in iter_elements(statement.get("expression")):
+                if node.elem_type in (InterpreterBase.FCALL_NODE, InterpreterBase.NEW_NODE):
+                    return False
+        elif kind == InterpreterBase.IF_NODE:
+            if _literal_of(statement.get("condition")) != (Type.BOOL, True):
+                return False
+            if not _only_bindings(statement.get("statements"), scopes):
+                return False
+        else:
+            return False
+    return True
+
+
+def _always(statements): # return an if statement that always runs statements in their own scope
+    return Element(
+        InterpreterBase.IF_NODE,
+        condition=Element(InterpreterBase.BOOL_NODE, val=True),
+        statements=statements,
+        else_statements=None,
+    )
+
+
+def _step(expr_ast, var_name): # return the int step of var_name = var_name +/- c, or None
+    if expr_ast.elem_type not in ("+", "-"):
+        return None
+    op1, op2 = expr_ast.get("op1"), expr_ast.get("op2")
+    if expr_ast.elem_type == "+" and op2.elem_type == InterpreterBase.VAR_NODE:
+        op1, op2 = op2, op1
+    if (
+        op1.elem_type != InterpreterBase.VAR_NODE
+        or op1.get("name") != var_name
+        or op1.get("fields")
+        or op2.elem_type != InterpreterBase.INT_NODE
+    ):
+        return None
+    return op2.get("val") if expr_ast.elem_type == "+" else -op2.get("val")
@@ -0,0 +1,132 @@
+"""
+Cooperative scheduling of many Brewin runs inside one process.
+
+A ResumableRun is one run of a program that can pause at any statement and be
+resumed later, much like a generator:
+
+    run = ResumableRun(program, slice_steps=1000)
+    request = run.resume()     # runs until the next pause
+    while request[0] != DONE:
+        ...                    # e.g. run.feed("42") after an INPUT request
+        request = run.resume()
+    result = request[1]        # interpreterv4.RunResult
+
+It pauses with (SLICE,) every slice_steps statements, with (INPUT,) when the
+program reads an input that hasn't been fed yet (if wait_for_input is set), with
+(OUTPUT, text) after every print (if pause_on_output is set), and finishes with
+(DONE, RunResult).
+
+Runs are interpreterv4.Interpreter.run_steps runs: each is a generator, and a
+paused run is one suspended at a yield, so runs need no thread of their own,
+and only ever execute inside resume().
+
+A Scheduler interleaves many runs round robin, one slice each, and parks runs
+that wait for input until input is fed to them, so a runaway loop in one program
+can't starve the others. Scheduler.run returns after a given number of rounds,
+so the caller keeps control even while a runaway run is left:
+
+    sched = Scheduler()
+    runs = [sched.spawn(source) for source in sources]
+    while any(not run.done for run in runs):
+        finished, pending = sched.run()
+"""
+
+import time
+
+from interpreterv4 import Interpreter, Program, RunResult, SLICE, INPUT, OUTPUT
+
+DONE = "done"
+
+
+class ResumableRun:
+    def __init__(
+        self, program, inputs=(), slice_steps=1000, wait_for_input=False, pause_on_output=False, **options
+    ):
+        self.interpreter = Interpreter(
+            False,
+            list(inputs),
+            slice_steps=slice_steps,
+            wait_for_input=wait_for_input,
+            pause_on_output=pause_on_output,
+            **options,
+        )
+        self.program = program  # source text or a compiled interpreterv4.Program
+        self.inputs = self.interpreter.inp
+        self.done = False
+        self.result = None  # RunResult once done, unless the run was closed first
+        self.stats = self.interpreter.pause_stats  # steps, slices and input_waits
+        self.stats["run_seconds"] = 0.0
+        self.__steps = self.__run()
+
+    def feed(self, value): # no return
+        self.inputs.append(value)
+
+    def close_input(self): # no return; later reads are a FAULT_ERROR, as past the end of an input list
+        self.interpreter.input_closed = True
+
+    def resume(self): # return the request the run paused with
+        if self.done:
+            return (DONE, self.result)
+        start = time.perf_counter()
+        try:
+            request = next(self.__steps)
+        except StopIteration as stop:
+            self.done = True
+            self.result = stop.value
+            request = (DONE, self.result)
+        self.stats["run_seconds"] += time.perf_counter() - start
+        return request
+
+    def close(self): # no return; abandons a paused run
+        if not self.done:
+            self.__steps.close()
+            self.done = True
+
+    def __run(self): # generator of pause requests; returns RunResult
+        try:
+            compiled = self.program if isinstance(self.program, Program) else self.interpreter.compile(self.program)
+        except Exception as e: # the program didn't compile
+            return RunResult([], None, e)
+        return (yield from self.interpreter.run_steps(compiled))
+
+
+class Scheduler:
+    def __init__(self, slice_steps=1000):
+        self.slice_steps = slice_steps
+        self.runs = []
+        self.waiting = set()  # runs paused until they are fed input
+
+    def spawn(self, program, inputs=(), wait_for_input=False, **options): # return ResumableRun
+        run = ResumableRun(program, inputs, self.slice_steps, wait_for_input, **options)
+        self.runs.append(run)
+        return run
+
+    def feed(self, run, value): # no return
+        run.feed(value)
+        self.waiting.discard(run)
+
+    def close_input(self, run): # no return
+        run.close_input()
+        self.waiting.discard(run)
+
+    # runs every ready run one slice per round, for at most rounds rounds (None: until no run is
+    # ready, which never comes while a runaway run is left), and returns between rounds
+    def run(self, rounds=1): # return (list of the runs that finished in these rounds, list of the runs not done)
+        finished = []
+        while rounds is None or rounds > 0:
+            ready = [run for run in self.runs if not run.done and run not in self.waiting]
+            if not ready:
+                break
+            for run in ready:
+                request = run.resume()
+                if request[0] == DONE:
+                    finished.append(run)
+                elif request[0] == INPUT:
+                    self.waiting.add(run)
+            if rounds is not None:
+                rounds -= 1
+        return finished, [run for run in self.runs if not run.done]
+
+    def close(self): # no return
+        for run in self.runs:
+            run.close()
@@ -0,0 +1,175 @@
+"""
+Opt-in speculative evaluation of independent pure calls in worker processes.
+
+In fib(n - 1) + fib(n - 2) both operands are always evaluated, and the second
+can't observe anything the first does when fib is pure (see cse.pure_functions).
+With Interpreter(parallel_workers=N), such a binary operation sends its right
+operand to a pool of N worker processes, evaluates the left one locally, and
+then collects the right one's value.
+
+Every worker compiles the program once, when it starts, and keeps it for all the
+calls it runs; the pool itself is kept for as long as the interpreter runs the
+same program. A call is only dispatched when it is worth a round trip to
+another process and can't change what the program does:
+
+  - the callee is pure and costly: it loops, or calls itself (directly or not)
+  - each argument is a literal, a variable or +, -, * over them whose value is
+    already known (no thunk gets forced early) and is an int, bool or string
+  - it runs at most MAX_DEPTH function calls deep, and a worker is free
+
+If the worker raises, or the left operand does, the right operand is evaluated
+locally just as it would have been, so errors surface exactly as before.
+Custom builtins registered on the interpreter are not available to workers;
+calls that need them fail there and fall back too.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import cse
+from element import Element, iter_elements
+from intbase import InterpreterBase
+from type_valuev2 import Type, Value, Thunk
+
+BIN_OPS = {"+", "-", "*", "/", "==", "!=", ">", ">=", "<", "<="}  # never short circuits
+ARG_OPS = {"+": lambda x, y: x + y, "-": lambda x, y: x - y, "*": lambda x, y: x * y}
+LITERAL_NODES = {
+    InterpreterBase.INT_NODE: Type.INT,
+    InterpreterBase.STRING_NODE: Type.STRING,
+    InterpreterBase.BOOL_NODE: Type.BOOL,
+}
+MAX_DEPTH = 6  # deeper calls are too cheap to ship, and there is enough parallelism above them
+
+
+def plan_program(ast): # return set of binary operation nodes whose right operand may run in a worker
+    costly = _costly_functions(ast) & cse.pure_functions(ast)
+    ops = set()
+    for node in iter_elements(ast):
+        if node.elem_type not in BIN_OPS:
+            continue
+        op2 = node.get("op2")
+        if op2.elem_type == InterpreterBase.FCALL_NODE and op2.target in costly:
+            ops.add(node)
+    return ops
+
+
+# functions that loop or are (mutually) recursive
+def _costly_functions(ast): # return set of func_asts
+    calls = {}
+    costly = set()
+    for func_ast in ast.get("functions"):
+        calls[func_ast] = set()
+        for node in iter_elements(func_ast.get("statements")):
+            if node.elem_type == InterpreterBase.FOR_NODE:
+                costly.add(func_ast)
+            elif node.elem_type == InterpreterBase.FCALL_NODE and isinstance(node.target, Element):
+                calls[func_ast].add(node.target)
+    for func_ast in calls:
+        seen = set()
+        stack = list(calls[func_ast])
+        while stack:
+            callee = stack.pop()
+            if callee is func_ast:
+                costly.add(func_ast)
+                break
+            if callee not in seen:
+                seen.add(callee)
+                stack.extend(calls.get(callee, ()))
+    return costly
+
+
+# value of an argument, if computing it now can neither fail nor force anything
+def _known_value(expr_ast, lookup): # return Value or None
+    kind = expr_ast.elem_type
+    if kind in LITERAL_NODES:
+        return Value(LITERAL_NODES[kind], expr_ast.get("val"))
+    if kind == InterpreterBase.VAR_NODE:
+        if expr_ast.get("fields"):
+            return None
+        value = lookup(expr_ast.get("name"))
+        if isinstance(value, Thunk):
+            if not value.is_evaluated:
+                return None
+            value = value.expr_ast # an evaluated thunk keeps its value here
+        if value is None or value.type() not in LITERAL_NODES.values():
+            return None
+        return value
+    if kind in ARG_OPS:
+        left = _known_value(expr_ast.get("op1"), lookup)
+        right = _known_value(expr_ast.get("op2"), lookup)
+        if left is None or right is None or left.type() != Type.INT or right.type() != Type.INT:
+            return None
+        return Value(Type.INT, ARG_OPS[kind](left.value(), right.value()))
+    return None
+
+
+# Pool of warm workers for one compiled program, plus the counts reported in the run stats
+class Speculator:
+    def __init__(self, program, workers):
+        self.program = program
+        self.workers = workers
+        self.ops = plan_program(program.ast)
+        self.in_flight = 0
+        self.pool = None
+        self.stats = None
+
+    def new_run(self): # return the stats dict for a new run
+        self.stats = {"candidates": len(self.ops), "dispatched": 0, "fallbacks": 0}
+        return self.stats
+
+    def submit(self, call_ast, lookup): # return Future, or None if the call stays local
+        if self.in_flight >= self.workers:
+            return None
+        args = []
+        for arg in call_ast.get("args"):
+            value = _known_value(arg, lookup)
+            if value is None:
+                return None
+            args.append((value.type(), value.value()))
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker, initargs=(self.program.ast,)
+            )
+        try:
+            future = self.pool.submit(_call, call_ast.get("name"), args)
+        except RuntimeError: # the pool broke down; carry on without it
+            return None
+        self.in_flight += 1
+        self.stats["dispatched"] += 1
+        return future
+
+    def result(self, future): # return Value, or None if the caller has to evaluate the call itself
+        self.in_flight -= 1
+        try:
+            value_type, value = future.result()
+        except Exception:
+            self.stats["fallbacks"] += 1
+            return None
+        return Value(value_type, value)
+
+    def abandon(self, future): # no return
+        self.in_flight -= 1
+        future.cancel()
+
+    def close(self): # no return
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+
+_worker = None  # (interpreter, compiled program) of this worker process
+
+
+def _init_worker(ast):
+    global _worker
+    from interpreterv4 import Interpreter # imported here, since interpreterv4 imports this module
+
+    interpreter = Interpreter(False, [], eliminate_subexpressions=False) # ast already has its temporaries
+    _worker = (interpreter, interpreter.compile_ast(ast))
+
+
+def _call(func_name, args): # return (type, value) of the call's result
+    interpreter, compiled = _worker
+    result = interpreter.call_function(compiled, func_name, [Value(t, v) for t, v in args])
+    if result.type() not in (Type.INT, Type.BOOL, Type.STRING, Type.NIL):
+        raise TypeError(f"{func_name} returned a {result.type()}")
+    return (result.type(), result.value())
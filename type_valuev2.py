@@ -1,4 +1,6 @@
 import copy
+
+import brewarray
 from intbase import InterpreterBase
 
 
@@ -8,6 +10,9 @@ class Type:
     BOOL = "bool"
     STRING = "string"
     NIL = "nil"
+    STRUCT = "struct"
+    ARRAY = "array"
+    MAP = "map"
 
 
 # Represents a value, which has a type and its value
@@ -38,7 +43,8 @@ def create_value(val):
         raise ValueError("Unknown value type")
 
 
-def get_printable(val):
+# on_stack holds the ids of the maps being printed around val, so a map inside itself prints as {...}
+def get_printable(val, on_stack=None):
     if val.type() == Type.INT:
         return str(val.value())
     if val.type() == Type.STRING:
@@ -47,7 +53,63 @@ def get_printable(val):
         if val.value() is True:
             return "true"
         return "false"
-    return None
+    if val.type() == Type.NIL:
+        return "nil"
+    if val.type() == Type.ARRAY:
+        return brewarray.to_printable(val.value())
+    if val.type() == Type.MAP:
+        if on_stack is None:
+            on_stack = set()
+        if id(val.value()) in on_stack:
+            return "{...}"
+        on_stack.add(id(val.value()))
+        items = []
+        for key, value in val.value().values():
+            key_text, value_text = get_printable(key, on_stack), get_printable(value, on_stack)
+            if key_text is None or value_text is None:
+                return None
+            items.append(f"{key_text}: {value_text}")
+        on_stack.discard(id(val.value()))
+        return "{" + ", ".join(items) + "}"
+    return None  # structs have no printable form
+
+
+# Dict key for a map key value, following the same equality rules as ==: ints, bools and
+# strings compare by value, all nils are equal, and structs, arrays and maps by reference
+def map_key(val):
+    if val.type() in (Type.STRUCT, Type.ARRAY, Type.MAP):
+        return (val.type(), id(val.value()))
+    return (val.type(), val.value())
+
+
+def default_value(var_type):
+    if var_type == Type.INT:
+        return Value(Type.INT, 0)
+    if var_type == Type.BOOL:
+        return Value(Type.BOOL, False)
+    if var_type == Type.STRING:
+        return Value(Type.STRING, "")
+    return Value(Type.NIL, None)  # struct-typed (and untyped) fields start out nil
+
+
+# Field layout of a struct type, computed once from its struct definition
+class StructLayout:
+    def __init__(self, struct_ast):
+        self.name = struct_ast.get("name")
+        self.field_index = {}  # field name -> slot number
+        self.defaults = []
+        for field in struct_ast.get("fields"):
+            self.field_index[field.get("name")] = len(self.defaults)
+            self.defaults.append(default_value(field.get("var_type")))
+
+
+# A struct instance; field values live in a list indexed by slot number
+class Struct:
+    __slots__ = ("layout", "slots")
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.slots = list(layout.defaults)
 
 class Thunk:
     def __init__(self, expr_ast, curr_dict):
@@ -0,0 +1,294 @@
+"""
+Static type inference for Brewin programs.
+
+The interpreter checks operand types on every operation. This pass infers, per
+function, the type each variable holds at each point of the function (joining
+the types from every path that reaches it), and marks the operations whose
+checks can never fail:
+
+    binary operations    node.proven: both operands have known types the operator accepts
+    if / for statements  node.proven: the condition is known to be a bool
+
+The interpreter skips the checks on proven nodes and keeps them everywhere else.
+
+The analysis follows v4's lazy semantics: a thunk is evaluated in a snapshot of
+the environment taken when it was created, so an expression's operand types are
+the ones at the point where it appears, whenever it is actually forced. Any
+statement inside a try can throw, so a catch block starts from the join of all
+the states seen in its try block. Arguments, struct fields and map values are
+never enforced at run time, so they are unknown. Expressions under unary - and !
+are left unproven, since forcing one of those from a thunk evaluates its operand
+in the current environment rather than the thunk's.
+
+Declared variable, argument and return types aren't enforced by v4 either;
+assignments that provably disagree with them are reported as mismatches.
+"""
+
+import cse
+from brewbuiltins import Builtin
+from element import Element, iter_elements
+from intbase import InterpreterBase
+from type_valuev2 import Type
+
+UNKNOWN = "unknown"  # may hold any type; None means no value reaches this point
+BIN_OPS = {"+", "-", "*", "/", "==", "!=", ">", ">=", "<", "<=", "||", "&&"}
+BOOL_RESULT_OPS = {"==", "!=", ">", ">=", "<", "<="}
+DECLARED_TYPES = {"int": Type.INT, "bool": Type.BOOL, "string": Type.STRING, "void": Type.NIL}
+MAX_PASSES = 20  # return types settle in a couple of passes; this only bounds pathological cases
+
+
+def join(t1, t2):
+    if t1 is None:
+        return t2
+    if t2 is None or t1 == t2:
+        return t1
+    return UNKNOWN
+
+
+# a state is a list of scopes (dicts of variable name -> type) mirroring the environment of
+# one function, or None if the point is unreachable
+def join_states(s1, s2):
+    if s1 is None:
+        return s2
+    if s2 is None:
+        return s1
+    joined = []
+    for scope1, scope2 in zip(s1, s2):
+        joined.append({name: join(t, scope2.get(name)) for name, t in scope1.items()})
+    return joined
+
+
+def check_program(ast, op_to_lambda, struct_names):
+    """Infer types for every function in ast, set node.proven and return a report dict."""
+    return TypeChecker(ast, op_to_lambda, struct_names).check()
+
+
+class TypeChecker:
+    def __init__(self, ast, op_to_lambda, struct_names):
+        self.ast = ast
+        self.functions = set(ast.get("functions"))
+        self.op_to_lambda = op_to_lambda
+        self.struct_names = struct_names
+
+    def check(self): # return report dict
+        checked_nodes = []
+        for node in iter_elements(self.ast):
+            if node.elem_type in BIN_OPS or node.elem_type in (
+                InterpreterBase.IF_NODE, InterpreterBase.FOR_NODE
+            ):
+                node.proven = False
+                if node.elem_type not in ("&&", "||"): # the interpreter never checks these
+                    checked_nodes.append(node)
+
+        # return types depend on each other, so re-run the whole program until they settle
+        self.return_types = {}  # func_ast -> type
+        for _ in range(MAX_PASSES):
+            previous = dict(self.return_types)
+            self.__check_functions()
+            if self.return_types == previous:
+                break
+        else:
+            self.return_types = {func: UNKNOWN for func in self.return_types}
+            self.__check_functions()
+
+        proven = 0
+        for node in checked_nodes:
+            node.proven = self.__is_proven(node)
+            proven += node.proven
+        return {
+            "operations": len(checked_nodes),
+            "proven": proven,
+            "percent_proven": round(100 * proven / len(checked_nodes), 1) if checked_nodes else 100.0,
+            "mismatches": sorted(set(self.mismatches)),
+        }
+
+    def __check_functions(self): # no return
+        self.node_types = {}  # node -> type of its operand(s), joined over every visit
+        self.mismatches = []
+        for func_ast in self.ast.get("functions"):
+            self.func_ast = func_ast
+            self.declared = {}  # variable name -> declared type, for reporting mismatches
+            for node in iter_elements(func_ast.get("statements")):
+                if node.elem_type == InterpreterBase.VAR_DEF_NODE:
+                    self.declared.setdefault(node.get("name"), node.get("var_type"))
+            self.returned = None
+            self.open_tries = []  # accumulated states of the try blocks we are inside
+            state = [{arg.get("name"): UNKNOWN for arg in func_ast.get("args")}]
+            state = self.__statements(func_ast.get("statements"), state)
+            self.returned = join(self.returned, Type.NIL if state is not None else None)
+            self.__check_declared(func_ast.get("return_type"), self.returned, "return value", func_ast)
+            self.return_types[func_ast] = self.returned
+
+    def __is_proven(self, node): # return Bool
+        types = self.node_types.get(node)
+        if types is None:
+            return False
+        if node.elem_type in (InterpreterBase.IF_NODE, InterpreterBase.FOR_NODE):
+            return types == Type.BOOL
+        left, right = types
+        if left in (None, UNKNOWN) or right in (None, UNKNOWN):
+            return False
+        if node.elem_type not in ("==", "!=") and left != right:
+            return False
+        return node.elem_type in self.op_to_lambda.get(left, {})
+
+    def __record(self, node, types): # no return
+        old = self.node_types.get(node)
+        if isinstance(types, tuple):
+            self.node_types[node] = types if old is None else tuple(map(join, old, types))
+        else:
+            self.node_types[node] = join(old, types)
+
+    def __mark_point(self, state): # no return
+        for i, try_state in enumerate(self.open_tries):
+            self.open_tries[i] = join_states(try_state, None if state is None else state[:len(try_state)])
+
+    def __check_declared(self, declared, actual, what, node): # no return
+        if declared is None or actual in (None, UNKNOWN):
+            return
+        if declared in self.struct_names:
+            ok = actual in (Type.STRUCT, Type.NIL)
+        elif declared in DECLARED_TYPES:
+            ok = actual == DECLARED_TYPES[declared]
+        else:
+            return
+        if not ok:
+            self.mismatches.append(
+                f"{self.func_ast.get('name')}: {what} {node.get('name')} declared {declared}, got {actual}"
+            )
+
+    def __lookup(self, state, name): # return type
+        for scope in reversed(state):
+            if name in scope:
+                return scope[name]
+        return UNKNOWN # a NAME_ERROR at run time
+
+    def __statements(self, statements, state): # return state after the statements
+        if state is None:
+            return None
+        state = [dict(scope) for scope in state] + [{}]
+        for statement in statements:
+            self.__mark_point(state)
+            state = self.__statement(statement, state)
+            if state is None:
+                return None
+        self.__mark_point(state)
+        return state[:-1]
+
+    def __statement(self, statement, state): # return state after the statement
+        kind = statement.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            state[-1][statement.get("name")] = Type.NIL
+            return state
+        if kind == "=":
+            value_type = self.__expr(statement.get("expression"), state, True)
+            if statement.get("fields"):
+                return state
+            for scope in reversed(state):
+                if statement.get("name") in scope:
+                    scope[statement.get("name")] = value_type
+                    break
+            self.__check_declared(
+                self.declared.get(statement.get("name")), value_type, "variable", statement
+            )
+            return state
+        if kind == InterpreterBase.FCALL_NODE:
+            self.__expr(statement, state, True)
+            return state
+        if kind == cse.DEF_NODE:
+            state[-1][statement.get("name")] = self.__expr(statement.get("expression"), state, True)
+            return state
+        if kind == InterpreterBase.RETURN_NODE:
+            expr_ast = statement.get("expression")
+            value_type = Type.NIL if expr_ast is None else self.__expr(expr_ast, state, True)
+            self.returned = join(self.returned, value_type)
+            return None
+        if kind == InterpreterBase.RAISE_NODE:
+            self.__expr(statement.get("exception_type"), state, True)
+            return None
+        if kind == InterpreterBase.IF_NODE:
+            self.__record(statement, self.__expr(statement.get("condition"), state, True))
+            then_state = self.__statements(statement.get("statements"), state)
+            else_statements = statement.get("else_statements")
+            if else_statements is None:
+                return join_states(then_state, state)
+            return join_states(then_state, self.__statements(else_statements, state))
+        if kind == InterpreterBase.FOR_NODE:
+            return self.__for(statement, state)
+        if kind == InterpreterBase.TRY_NODE:
+            return self.__try(statement, state)
+        return state
+
+    def __for(self, for_ast, state): # return state after the loop
+        state = self.__statement(for_ast.get("init"), state)
+        # iterate the body until the types at the loop head stop changing
+        while True:
+            self.__record(for_ast, self.__expr(for_ast.get("condition"), state, True))
+            body_state = self.__statements(for_ast.get("statements"), state)
+            if body_state is not None:
+                body_state = self.__statement(for_ast.get("update"), body_state)
+            head_state = join_states(state, body_state)
+            if head_state == state:
+                return state
+            state = head_state
+
+    def __try(self, try_ast, state): # return state after the try/catch
+        self.open_tries.append([dict(scope) for scope in state])
+        after_try = self.__statements(try_ast.get("statements"), state)
+        catch_state = self.open_tries.pop()
+        self.__mark_point(catch_state)
+        after = after_try
+        for catcher in try_ast.get("catchers"):
+            after = join_states(after, self.__statements(catcher.get("statements"), catch_state))
+        return after
+
+    # provable is False under unary operators, whose operands may be evaluated in another environment
+    def __expr(self, expr_ast, state, provable): # return type of the expression's value
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.INT_NODE:
+            return Type.INT
+        if kind == InterpreterBase.STRING_NODE:
+            return Type.STRING
+        if kind == InterpreterBase.BOOL_NODE:
+            return Type.BOOL
+        if kind == InterpreterBase.NIL_NODE:
+            return Type.NIL
+        if kind == InterpreterBase.NEW_NODE:
+            return Type.STRUCT
+        if kind in (InterpreterBase.VAR_NODE, cse.REF_NODE):
+            if expr_ast.get("fields"):
+                return UNKNOWN
+            return self.__lookup(state, expr_ast.get("name"))
+        if kind == InterpreterBase.NEG_NODE:
+            self.__expr(expr_ast.get("op1"), state, False)
+            return Type.INT
+        if kind == InterpreterBase.NOT_NODE:
+            self.__expr(expr_ast.get("op1"), state, False)
+            return Type.BOOL
+        if kind == InterpreterBase.FCALL_NODE:
+            return self.__call(expr_ast, state, provable)
+        if kind in BIN_OPS:
+            left = self.__expr(expr_ast.get("op1"), state, provable)
+            right = self.__expr(expr_ast.get("op2"), state, provable)
+            if provable:
+                self.__record(expr_ast, (left, right))
+            if kind in ("&&", "||"):
+                return join(Type.BOOL, right) # returns op2's value as is when it gets that far
+            if kind in BOOL_RESULT_OPS:
+                return Type.BOOL
+            return left if left == right else UNKNOWN
+        return UNKNOWN
+
+    def __call(self, call_ast, state, provable): # return type of the call's value
+        arg_types = [self.__expr(arg, state, provable) for arg in call_ast.get("args")]
+        target = call_ast.target
+        if isinstance(target, Builtin):
+            return target.returns or UNKNOWN
+        if not isinstance(target, Element): # an unresolved call
+            return UNKNOWN
+        for formal_ast, arg_type in zip(target.get("args"), arg_types):
+            self.__check_declared(formal_ast.get("var_type"), arg_type, "argument", formal_ast)
+        if target not in self.functions: # checked on its own, e.g. a body brewscan parses later
+            return UNKNOWN
+        return self.return_types.get(target) # None until the callee's first analysis
+